@@ -0,0 +1,142 @@
+from contextlib import contextmanager
+from dataclasses import dataclass
+import io
+import json
+import os
+import threading
+from typing import TextIO
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+from requests.adapters import HTTPAdapter
+
+
+@dataclass
+class AuditTarget:
+    vco: str
+    token: str
+    # set for partner and operator tokens, which see more than one enterprise
+    enterprise_id: int | None = None
+    name: str | None = None
+    # rate budget for the target's VCO, targets on the same VCO share it
+    max_rps: float | None = None
+
+    @property
+    def label(self) -> str:
+        if self.name is not None:
+            return self.name
+        if self.enterprise_id is not None:
+            return f"{self.vco}/{self.enterprise_id}"
+        return self.vco
+
+
+def load_targets(path: str) -> list[AuditTarget]:
+    # a JSON list of targets, tokens can be given directly or as the name of an environment variable
+    # [{"vco": "vco1.example.net", "token_env": "VCO1_TOKEN", "enterprise_id": 12, "name": "acme"}]
+    with open(path) as fp:
+        entries = json.load(fp)
+
+    targets = []
+    labels = set()
+    for entry in entries:
+        token = entry.get("token")
+        if token is None:
+            token = os.getenv(entry["token_env"])
+            assert (
+                token is not None
+            ), f"missing env var {entry['token_env']} for {entry['vco']}"
+        targets.append(
+            AuditTarget(
+                entry["vco"],
+                token,
+                entry.get("enterprise_id"),
+                entry.get("name"),
+                entry.get("max_rps"),
+            )
+        )
+        # labels name each target's rows in the merged frames and its lines in the output
+        label = targets[-1].label
+        assert (
+            label not in labels
+        ), f"more than one target labelled {label}, give them distinct names"
+        labels.add(label)
+    return targets
+
+
+def vco_adapters(
+    targets: list[AuditTarget], connections_per_vco: int
+) -> dict[str, HTTPAdapter]:
+    # one connection pool per VCO, shared by the sessions of every target on it
+    # the pool blocks when full, so enterprises on one VCO never open more than connections_per_vco
+    return {
+        vco: HTTPAdapter(
+            pool_connections=1, pool_maxsize=connections_per_vco, pool_block=True
+        )
+        for vco in {t.vco for t in targets}
+    }
+
+
+class TargetOutput(io.TextIOBase):
+    # stands in for stdout while targets are audited side by side, lines printed from a target's
+    # thread are prefixed with its label and written whole so they never interleave
+    def __init__(self, out: TextIO):
+        self.out = out
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def target(self, label: str):
+        self.local.label, self.local.partial = label, ""
+        try:
+            yield
+        finally:
+            if self.local.partial:
+                self.write("\n")
+            del self.local.label
+
+    def write(self, text: str) -> int:
+        label = getattr(self.local, "label", None)
+        if label is None:
+            with self.lock:
+                return self.out.write(text)
+        *lines, self.local.partial = (self.local.partial + text).split("\n")
+        if lines:
+            with self.lock:
+                self.out.write("".join(f"[{label}] {line}\n" for line in lines))
+        return len(text)
+
+    def flush(self):
+        self.out.flush()
+
+
+def merge_target_frames(frames: list[tuple[AuditTarget, pd.DataFrame]]) -> pd.DataFrame:
+    # one fleet-wide frame with vco and target columns in front, edge ids are only unique per target
+    frames = [(target, df) for target, df in frames if len(df)]
+    if not frames:
+        return pd.DataFrame()
+
+    merged = pd.concat([df for _, df in frames], ignore_index=True)
+    # categoricals with different categories would come out of concat as object columns
+    for column in frames[0][1].columns:
+        if all(isinstance(df[column].dtype, pd.CategoricalDtype) for _, df in frames):
+            merged[column] = union_categoricals([df[column] for _, df in frames])
+
+    codes = np.repeat(
+        np.arange(len(frames), dtype=np.int32), [len(df) for _, df in frames]
+    )
+    merged.insert(
+        0,
+        "target",
+        pd.Categorical.from_codes(codes, categories=[t.label for t, _ in frames]),
+    )
+    vcos = list(dict.fromkeys(t.vco for t, _ in frames))
+    merged.insert(
+        0,
+        "vco",
+        pd.Categorical.from_codes(
+            np.array([vcos.index(t.vco) for t, _ in frames], dtype=np.int32)[codes],
+            categories=vcos,
+        ),
+    )
+    return merged
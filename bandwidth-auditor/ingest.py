@@ -0,0 +1,112 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+# compact dtypes for link metrics, repeated strings become categoricals
+STRING_COLUMNS = ["edge_name", "link_internal_id", "link_name", "isp"]
+
+
+class LinkMetricsAccumulator:
+    # converts each window's response into column arrays as it arrives, so the raw responses can be dropped
+    def __init__(self):
+        self.edge_id: list[np.ndarray] = []
+        self.window_start: list[np.ndarray] = []
+        self.upstream_mbps: list[np.ndarray] = []
+        self.downstream_mbps: list[np.ndarray] = []
+        # strings are dictionary encoded as they arrive, each column keeps int32 codes plus its distinct values
+        self.dictionaries: dict[str, dict[str, int]] = {c: {} for c in STRING_COLUMNS}
+        self.codes: dict[str, list[np.ndarray]] = {c: [] for c in STRING_COLUMNS}
+
+    def _encode(self, column: str, values) -> np.ndarray:
+        dictionary = self.dictionaries[column]
+        return np.fromiter(
+            (dictionary.setdefault(v, len(dictionary)) for v in values), dtype=np.int32
+        )
+
+    def add(self, resp: list[dict], window_start: int):
+        n = len(resp)
+        self.edge_id.append(
+            np.fromiter((l["link"]["edgeId"] for l in resp), dtype=np.int32, count=n)
+        )
+        self.window_start.append(np.full(n, window_start, dtype=np.int64))
+        upstream_bps = np.fromiter(
+            (l["bpsOfBestPathTx"] for l in resp), dtype=np.float64, count=n
+        )
+        self.upstream_mbps.append((upstream_bps / 1000000).astype(np.float32))
+        downstream_bps = np.fromiter(
+            (l["bpsOfBestPathRx"] for l in resp), dtype=np.float64, count=n
+        )
+        self.downstream_mbps.append((downstream_bps / 1000000).astype(np.float32))
+        for column, key in (
+            ("edge_name", "edgeName"),
+            ("link_internal_id", "internalId"),
+            ("link_name", "displayName"),
+            ("isp", "isp"),
+        ):
+            self.codes[column].append(
+                self._encode(column, (l["link"][key] for l in resp))
+            )
+
+    def frame(self) -> pd.DataFrame:
+        def concat(arrays: list[np.ndarray], dtype) -> np.ndarray:
+            return np.concatenate(arrays) if arrays else np.empty(0, dtype=dtype)
+
+        def categorical(column: str) -> pd.Categorical:
+            return pd.Categorical.from_codes(
+                concat(self.codes[column], np.int32),
+                categories=list(self.dictionaries[column]),
+            )
+
+        return pd.DataFrame(
+            {
+                "edge_id": concat(self.edge_id, np.int32),
+                "edge_name": categorical("edge_name"),
+                "link_internal_id": categorical("link_internal_id"),
+                "link_name": categorical("link_name"),
+                "isp": categorical("isp"),
+                "upstream_mbps": concat(self.upstream_mbps, np.float32),
+                "downstream_mbps": concat(self.downstream_mbps, np.float32),
+                "window_start": concat(self.window_start, np.int64),
+            }
+        )
+
+
+def split_windows(start_ms: int, end_ms: int, window_ms: int) -> list[tuple[int, int]]:
+    return [
+        (window_start, min(window_start + window_ms, end_ms))
+        for window_start in range(start_ms, end_ms, window_ms)
+    ]
+
+
+def ingest_windows(
+    fetch_window: Callable[[int, int], list[dict]],
+    start_ms: int,
+    end_ms: int,
+    window_ms: int = 60 * 60 * 1000,
+    max_workers: int = 4,
+    accumulator: LinkMetricsAccumulator | None = None,
+) -> LinkMetricsAccumulator:
+    # at most max_workers responses are held at once, each is folded into the accumulator when it lands
+    if accumulator is None:
+        accumulator = LinkMetricsAccumulator()
+    windows = iter(split_windows(start_ms, end_ms, window_ms))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {}
+        for window in windows:
+            pending[executor.submit(fetch_window, *window)] = window
+            if len(pending) >= max_workers:
+                break
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                window_start, _ = pending.pop(future)
+                accumulator.add(future.result(), window_start)
+                next_window = next(windows, None)
+                if next_window is not None:
+                    pending[executor.submit(fetch_window, *next_window)] = next_window
+
+    return accumulator
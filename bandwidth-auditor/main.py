@@ -1,32 +1,83 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
 from dataclasses import dataclass
-from typing import cast
 import dotenv
-import json
 import os
 import pandas as pd
 from requests import Session, session
+from requests.adapters import HTTPAdapter
+import sys
 import time
 
+# shared VCO client code lives at the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from fleet import (
+    AuditTarget,
+    TargetOutput,
+    load_targets,
+    merge_target_frames,
+    vco_adapters,
+)
+from ingest import ingest_windows
+from remediate import Checkpoint, run_pipeline
+from rules import (
+    DEFAULT_RULES,
+    AuditRule,
+    apply_fixes,
+    confirm_candidates,
+    evaluate_rules,
+)
+from state import AuditState, candidate_signatures
+from store import MetricsStore
+from vcoclient import portal
+from vcoclient.aio import AsyncVcoClient
+from vcoclient.codec import set_codec
+from vcoclient.modules import ModuleUpdate, plan_module_update
+from vcoclient.portal import PortalCall, PortalResult
+from vcoclient.metrics import recorder
+from vcoclient.ratelimit import limiter_for, set_rate_limit
+from vcoclient.simulator import VcoSimulator, config_from_env, install_simulator
+from vcoclient.stacks import (
+    find_module,
+    get_edge_modules,
+    get_edge_modules_async,
+    stack_cache,
+)
+from vcoclient.transport import mount_transport
+
 
 @dataclass
 class CommonData:
     vco: str
     token: str
+    # partner and operator tokens see several enterprises, every call is then scoped to this one
+    enterprise_id: int | None = None
+
+
+def scoped_params(shared: CommonData, params: dict) -> dict:
+    if shared.enterprise_id is None:
+        return params
+    return {**params, "enterpriseId": shared.enterprise_id}
+
+
+def new_session(shared: CommonData, adapter: HTTPAdapter | None = None) -> Session:
+    s = session()
+    s.headers.update({"Authorization": f"Token {shared.token}"})
+    if adapter is not None:
+        s.mount(f"https://{shared.vco}/", adapter)
+    return mount_transport(s, shared.vco)
 
 
 def do_portal(s: Session, shared: CommonData, method: str, params: dict):
-    resp = s.post(
-        f"https://{shared.vco}/portal/",
-        json={
-            "jsonrpc": "2.0",
-            "id": 1,
-            "method": method,
-            "params": params,
-        },
-    ).json()
-    if "result" not in resp:
-        raise ValueError(json.dumps(resp, indent=2))
-    return resp["result"]
+    return portal.call(s, shared.vco, method, scoped_params(shared, params))
+
+
+def do_portal_batch(
+    s: Session, shared: CommonData, calls: list[PortalCall], chunk_size: int = 50
+) -> list[PortalResult]:
+    return portal.call_batch(s, shared.vco, calls, chunk_size)
 
 
 @dataclass
@@ -40,24 +91,89 @@ class LinkData:
     downstream_mbps: float
 
 
+def link_metrics_params(
+    start_time: int | None = None, end_time: int | None = None
+) -> dict:
+    if start_time is None:
+        # start_time = int((time.time() - 24 * 60 * 60) * 1000)
+        start_time = int((time.time() - 30 * 60) * 1000)
+    interval = {"start": start_time}
+    if end_time is not None:
+        interval["end"] = end_time
+    return {
+        # comment out the following line to get all available metrics
+        "metrics": ["bpsOfBestPathRx", "bpsOfBestPathTx"],
+        "interval": interval,
+    }
+
+
 def get_link_data(s: Session, shared: CommonData) -> list[LinkData]:
-    # start_time = int((time.time() - 24 * 60 * 60) * 1000)
-    start_time = int((time.time() - 30 * 60) * 1000)
     resp = do_portal(
         s,
         shared,
         "monitoring/getAggregateEdgeLinkMetrics",
-        params={
-            # comment out the following line to get all available metrics
-            "metrics": ["bpsOfBestPathRx", "bpsOfBestPathTx"],
-            "interval": {
-                "start": start_time,
-            },
-        },
+        params=link_metrics_params(),
     )
 
     # print(json.dumps(resp, indent=2))
 
+    return parse_link_data(resp)
+
+
+def get_link_data_range(
+    s: Session,
+    shared: CommonData,
+    start_time: int,
+    end_time: int,
+    window_hours: float = 1.0,
+    max_workers: int = 4,
+) -> pd.DataFrame:
+    # long ranges are split into windows fetched in parallel, one row per link per window
+    def fetch_window(window_start: int, window_end: int) -> list[dict]:
+        return do_portal(
+            s,
+            shared,
+            "monitoring/getAggregateEdgeLinkMetrics",
+            params=link_metrics_params(window_start, window_end),
+        )
+
+    return ingest_windows(
+        fetch_window,
+        start_time,
+        end_time,
+        int(window_hours * 60 * 60 * 1000),
+        max_workers,
+    ).frame()
+
+
+def get_link_data_windowed(
+    s: Session,
+    shared: CommonData,
+    hours: float,
+    window_hours: float = 1.0,
+    max_workers: int = 4,
+) -> pd.DataFrame:
+    end_time = int(time.time() * 1000)
+    start_time = end_time - int(hours * 60 * 60 * 1000)
+    return get_link_data_range(
+        s, shared, start_time, end_time, window_hours, max_workers
+    )
+
+
+def sync_link_metrics(
+    s: Session, shared: CommonData, store: MetricsStore, hours: float
+) -> pd.DataFrame:
+    # only the interval since the last stored window is requested, the rest is read back from disk
+    end_time = int(time.time() * 1000)
+    range_start = end_time - int(hours * 60 * 60 * 1000)
+    fetch_start = max(range_start, store.last_window_end or range_start)
+
+    if fetch_start < end_time:
+        store.append(get_link_data_range(s, shared, fetch_start, end_time), end_time)
+    return store.read(start_ms=range_start)
+
+
+def parse_link_data(resp: list[dict]) -> list[LinkData]:
     return [
         LinkData(
             l["link"]["edgeId"],
@@ -72,9 +188,21 @@ def get_link_data(s: Session, shared: CommonData) -> list[LinkData]:
     ]
 
 
-def get_edge_stack(s: Session, shared: CommonData, edge_id: int) -> list[dict]:
-    return do_portal(
-        s, shared, "edge/getEdgeConfigurationStack", params={"edgeId": edge_id}
+def get_edges_modules(
+    s: Session,
+    shared: CommonData,
+    edge_ids: list[int],
+    modules: set[str],
+    chunk_size: int = 20,
+) -> dict[int, PortalResult]:
+    # only the named modules of each edge's own layer, whole stacks where the VCO cannot do that
+    return get_edge_modules(
+        s,
+        shared.vco,
+        edge_ids,
+        modules,
+        lambda params: scoped_params(shared, params),
+        chunk_size,
     )
 
 
@@ -94,94 +222,411 @@ def update_module(
     )
 
 
-def extract_module(module_stack: list[dict], module_name: str) -> dict | None:
-    return next((m for m in module_stack if m["name"] == module_name), None)
-
-
-def audit_links(s: Session, shared: CommonData, apply_changes=False):
-    # fetch the link metrics and build pandas frame
-    links_df = pd.DataFrame(get_link_data(s, shared))
+def update_module_if_changed(
+    s: Session, shared: CommonData, module: dict, new_data: dict
+) -> ModuleUpdate:
+    plan = plan_module_update(module, new_data)
+    if plan.changed:
+        do_portal(
+            s,
+            shared,
+            "configuration/updateConfigurationModule",
+            params={"id": plan.module_id, "_update": plan.update},
+        )
+    return plan
 
-    if len(links_df) == 0:
-        print("no links found")
-        return
 
-    # select any link which measured 200 > downstream > 175 while having upstream < 175
-    # these are candidates for when burst mode should have been enabled
-    affected_links = links_df[
-        (links_df["downstream_mbps"] < 200.0)
-        & (links_df["downstream_mbps"] > 175.0)
-        & (links_df["upstream_mbps"] < 175.0)
-    ]
+def extract_module(module_stack: list[dict], module_name: str) -> dict | None:
+    # stacks fetched through the stack cache are indexed by module name
+    return find_module(module_stack, module_name)
 
-    affected_edges = affected_links.groupby("edge_id")
 
+def print_audit_header(
+    affected_links: pd.DataFrame, edge_count: int, apply_changes: bool
+):
     print(
-        f"{len(affected_links)} potentially affected link(s) found on {len(affected_edges)} edge(s)"
+        f"{len(affected_links)} potentially affected link(s) found on {edge_count} edge(s)"
     )
     print("checking configuration on those edges to confirm...")
     if not apply_changes:
         print("- not applying configuration changes due to audit-only mode")
 
-    affected_links_output = None
-    affected_links_output_list = []
 
-    for edge_id, df in affected_edges:
-        # don't spam getEdgeConfigurationStack
-        time.sleep(1)
+def limiter_stats_text(vco: str) -> str:
+    limiter_stats = limiter_for(vco).stats()
+    return (
+        f"{limiter_stats.calls} VCO request(s), {limiter_stats.waited_calls} waited "
+        f"{limiter_stats.wait_seconds:.1f}s in total for the rate limiter, "
+        f"{limiter_stats.throttled} throttled"
+    )
 
-        edge_stack = get_edge_stack(s, shared, cast(int, edge_id))
-        # edge-specific config is always 0th element
-        edge_config = edge_stack[0]
 
-        wan_module = extract_module(edge_config["modules"], "WAN")
-        if wan_module is None:
+def print_limiter_stats(shared: CommonData):
+    print(limiter_stats_text(shared.vco))
+    print(recorder().summary())
+    # only whole stacks go through the stack cache, targeted module fetches do not
+    if stack_cache().stats().misses:
+        print(stack_cache().summary())
+
+
+def split_wan_modules(
+    edge_stacks: dict[int, PortalResult],
+) -> tuple[dict[int, dict], dict[int, str]]:
+    # the WAN module of every edge that has one, and why the others could not be read
+    wan_modules, failures = {}, {}
+    for edge_id, stack_result in edge_stacks.items():
+        if not stack_result.ok:
+            failures[edge_id] = str(stack_result.error)
             continue
 
-        # retrieve edge_name scalar from first row
-        edge_name = df["edge_name"].head(1).item()
+        # edge-specific config is always 0th element
+        wan_module = extract_module(stack_result.result[0]["modules"], "WAN")
+        if wan_module is None:
+            failures[edge_id] = "no WAN module"
+        else:
+            wan_modules[edge_id] = wan_module
+    return wan_modules, failures
+
+
+def wan_modules_from_stacks(edge_stacks: dict[int, PortalResult]) -> dict[int, dict]:
+    wan_modules, failures = split_wan_modules(edge_stacks)
+    for edge_id, reason in failures.items():
+        print(f"failed to fetch configuration for edge {edge_id}: {reason}")
+    return wan_modules
+
+
+def confirm_affected_edges(
+    candidates: pd.DataFrame, wan_modules: dict[int, dict], rules: list[AuditRule]
+) -> tuple[pd.DataFrame, dict[int, dict]]:
+    confirmed = confirm_candidates(candidates, wan_modules, rules)
+    new_wan_data = apply_fixes(confirmed, wan_modules, rules)
+
+    for edge_id, df in confirmed.groupby("edge_id"):
+        edge_name = df["edge_name"].iloc[0]
+        # windowed metrics can confirm the same link once per window
+        updated_links_text = ", ".join(df["wan_link_name"].unique())
+        print(
+            f"confirmed as affected - edge [{edge_name}] - link(s) [{updated_links_text}]"
+        )
+    return confirmed, new_wan_data
+
+
+def get_edges_modified(s: Session, shared: CommonData) -> dict[int, str | None]:
+    edges = do_portal(s, shared, "enterprise/getEnterpriseEdges", {})
+    return {e["id"]: e.get("modified") for e in edges}
+
+
+def select_edges_to_check(
+    state: AuditState,
+    candidates: pd.DataFrame,
+    edge_ids: list[int],
+    edges_modified: dict[int, str | None],
+) -> list[int]:
+    signatures = candidate_signatures(candidates)
+    to_check = [
+        edge_id
+        for edge_id in edge_ids
+        if state.needs_check(edge_id, signatures[edge_id], edges_modified.get(edge_id))
+    ]
+    print(
+        f"- {len(edge_ids) - len(to_check)} edge(s) unchanged since the last audit, skipping them"
+    )
+    return to_check
+
+
+def record_audit_state(
+    state: AuditState,
+    candidates: pd.DataFrame,
+    edges_modified: dict[int, str | None],
+    wan_modules: dict[int, dict],
+    new_wan_data: dict[int, dict],
+    fixed_edge_ids: set[int],
+):
+    signatures = candidate_signatures(candidates)
+    for edge_id in wan_modules:
+        # an edge is clear once fixed, or when nothing on it needed fixing
+        verdict = (
+            "affected"
+            if edge_id in new_wan_data and edge_id not in fixed_edge_ids
+            else "clear"
+        )
+        state.record(edge_id, signatures[edge_id], edges_modified.get(edge_id), verdict)
+    state.save()
+
+
+def write_affected_links(confirmed: pd.DataFrame, path: str = "affected_links.csv"):
+    confirmed.drop(columns=["link_index"], errors="ignore").to_csv(path, index=False)
+
+
+@dataclass
+class AuditResult:
+    links: pd.DataFrame
+    confirmed: pd.DataFrame
+
+
+def audit_links(
+    s: Session,
+    shared: CommonData,
+    apply_changes=False,
+    rules: list[AuditRule] = DEFAULT_RULES,
+    hours: float | None = None,
+    store: MetricsStore | None = None,
+    state: AuditState | None = None,
+    checkpoint: Checkpoint | None = None,
+    read_workers: int = 4,
+    write_workers: int = 2,
+    affected_links_path: str | None = "affected_links.csv",
+    print_stats: bool = True,
+) -> AuditResult:
+    # fetch the link metrics and build pandas frame
+    if hours is None:
+        links_df = pd.DataFrame(get_link_data(s, shared))
+    elif store is not None:
+        links_df = sync_link_metrics(s, shared, store, hours)
+    else:
+        links_df = get_link_data_windowed(s, shared, hours)
+
+    if len(links_df) == 0:
+        print("no links found")
+        return AuditResult(links_df, pd.DataFrame())
+
+    candidates = evaluate_rules(links_df, rules)
+    edge_ids = [int(edge_id) for edge_id in candidates["edge_id"].unique()]
+    print_audit_header(candidates, len(edge_ids), apply_changes)
 
-        wan_id = wan_module["id"]
-        wan_data = wan_module["data"]
-        wan_links = wan_data["links"]
+    edges_modified = {}
+    if state is not None:
+        edges_modified = get_edges_modified(s, shared)
+        edge_ids = select_edges_to_check(state, candidates, edge_ids, edges_modified)
 
-        # array to track affected link names
-        confirmed_affected_link_names = []
+    if checkpoint is not None:
+        resumed = [edge_id for edge_id in edge_ids if edge_id in checkpoint.done]
+        if resumed:
+            print(
+                f"skipping {len(resumed)} edge(s) already completed according to {checkpoint.path}"
+            )
+        edge_ids = [edge_id for edge_id in edge_ids if edge_id not in checkpoint.done]
+
+    result = run_pipeline(
+        edge_ids,
+        lambda chunk: split_wan_modules(get_edges_modules(s, shared, chunk, {"WAN"})),
+        lambda wan_modules: confirm_affected_edges(candidates, wan_modules, rules),
+        (
+            (
+                lambda edge_id, wan_module, wan_data: update_module_if_changed(
+                    s, shared, wan_module, wan_data
+                )
+            )
+            if apply_changes
+            else None
+        ),
+        read_workers=read_workers,
+        write_workers=write_workers,
+        checkpoint=checkpoint if apply_changes else None,
+    )
+    if result.unread_edges:
+        print(
+            f"{len(result.unread_edges)} edge(s) could not be checked, rerun to retry them"
+        )
+    if result.failed_edge_ids:
+        print(
+            f"{len(result.failed_edge_ids)} edge(s) could not be fixed, rerun to retry them"
+        )
 
-        affected_link_was_found = False
-        for wan_link in wan_links:
-            if wan_link["bwMeasurement"] != "SLOW_START":
-                continue
+    if state is not None:
+        record_audit_state(
+            state,
+            candidates,
+            edges_modified,
+            result.wan_modules,
+            result.new_wan_data,
+            result.fixed_edge_ids,
+        )
 
-            link_internal_id = wan_link["internalId"]
+    confirmed = (
+        pd.concat(result.confirmed, ignore_index=True)
+        if result.confirmed
+        else confirm_candidates(candidates, {}, rules)
+    )
+    if affected_links_path is not None:
+        write_affected_links(confirmed, affected_links_path)
+    if print_stats:
+        print_limiter_stats(shared)
+    return AuditResult(links_df, confirmed)
+
+
+async def update_module_if_changed_async(
+    c: AsyncVcoClient, shared: CommonData, module: dict, new_data: dict
+) -> ModuleUpdate:
+    plan = plan_module_update(module, new_data)
+    if plan.changed:
+        await c.do_portal(
+            "configuration/updateConfigurationModule",
+            scoped_params(shared, {"id": plan.module_id, "_update": plan.update}),
+        )
+    return plan
 
-            # check if this link exists in the candidate list
-            id_series = df["link_internal_id"]
-            if len(id_series.where(id_series == link_internal_id)) > 0:
-                # get the dataframe for this link
-                link_row = df.loc[df["link_internal_id"] == link_internal_id]
-                affected_links_output_list.append(link_row)
 
-                # save link name to display later
-                confirmed_affected_link_names.append(wan_link["name"])
+async def audit_links_async(
+    c: AsyncVcoClient,
+    shared: CommonData,
+    apply_changes=False,
+    rules: list[AuditRule] = DEFAULT_RULES,
+    state: AuditState | None = None,
+    write_workers: int = 2,
+):
+    resp = await c.do_portal(
+        "monitoring/getAggregateEdgeLinkMetrics",
+        scoped_params(shared, link_metrics_params()),
+    )
+    links_df = pd.DataFrame(parse_link_data(resp))
 
-                # STATIC means burst mode
-                wan_link["bwMeasurement"] = "STATIC"
+    if len(links_df) == 0:
+        print("no links found")
+        return
 
-                # set flag to update the module once done iterating over links
-                affected_link_was_found = True
+    candidates = evaluate_rules(links_df, rules)
+    edge_ids = [int(edge_id) for edge_id in candidates["edge_id"].unique()]
+    print_audit_header(candidates, len(edge_ids), apply_changes)
 
-        if affected_link_was_found:
-            updated_links_text = ", ".join(confirmed_affected_link_names)
+    edges_modified = {}
+    if state is not None:
+        edges = await c.do_portal(
+            "enterprise/getEnterpriseEdges", scoped_params(shared, {})
+        )
+        edges_modified = {e["id"]: e.get("modified") for e in edges}
+        edge_ids = select_edges_to_check(state, candidates, edge_ids, edges_modified)
+
+    chunk_size = 20
+    # every chunk of WAN modules is requested at once, the client's limits decide how many overlap
+    chunk_results = await asyncio.gather(
+        *(
+            get_edge_modules_async(
+                c,
+                edge_ids[start : start + chunk_size],
+                {"WAN"},
+                lambda params: scoped_params(shared, params),
+                chunk_size,
+            )
+            for start in range(0, len(edge_ids), chunk_size)
+        )
+    )
+    edge_stacks = {
+        edge_id: r for chunk in chunk_results for edge_id, r in chunk.items()
+    }
+
+    wan_modules = wan_modules_from_stacks(edge_stacks)
+    confirmed, new_wan_data = confirm_affected_edges(candidates, wan_modules, rules)
+
+    if apply_changes:
+        # writes get a tighter bound than the client's in-flight limit used for reads
+        writes = asyncio.Semaphore(write_workers)
+
+        async def bounded_update(edge_id: int, wan_data: dict) -> ModuleUpdate:
+            async with writes:
+                return await update_module_if_changed_async(
+                    c, shared, wan_modules[edge_id], wan_data
+                )
+
+        wan_updates = await asyncio.gather(
+            *(
+                bounded_update(edge_id, wan_data)
+                for edge_id, wan_data in new_wan_data.items()
+            )
+        )
+        for edge_id, wan_update in zip(new_wan_data, wan_updates):
             print(
-                f"confirmed as affected - edge [{edge_name}] - link(s) [{updated_links_text}]"
+                f"- applied fix to WAN module of edge {edge_id}: {wan_update.describe()}"
+            )
+
+    if state is not None:
+        record_audit_state(
+            state,
+            candidates,
+            edges_modified,
+            wan_modules,
+            new_wan_data,
+            set(new_wan_data) if apply_changes else set(),
+        )
+
+    write_affected_links(confirmed)
+    print_limiter_stats(shared)
+
+
+def audit_fleet(
+    targets: list[AuditTarget],
+    apply_changes=False,
+    rules: list[AuditRule] = DEFAULT_RULES,
+    hours: float | None = None,
+    max_targets: int = 16,
+    connections_per_vco: int = 8,
+    read_workers: int = 4,
+    write_workers: int = 2,
+    affected_links_path: str | None = "affected_links.csv",
+) -> AuditResult:
+    # every target is audited on its own thread, so a sweep takes about as long as the slowest target
+    # targets on one VCO share its connection pool and rate limiter, the lowest max_rps given wins
+    budgets: dict[str, float] = {}
+    for target in targets:
+        if target.max_rps is not None:
+            budgets[target.vco] = min(
+                target.max_rps, budgets.get(target.vco, target.max_rps)
             )
-            if apply_changes:
-                print("- applying fix to WAN module")
-                update_module(s, shared, wan_id, wan_data)
+    for vco, max_rps in budgets.items():
+        set_rate_limit(vco, max_rps)
+    adapters = vco_adapters(targets, connections_per_vco)
+
+    output = TargetOutput(sys.stdout)
+
+    def audit_target(target: AuditTarget) -> AuditResult:
+        shared = CommonData(target.vco, target.token, target.enterprise_id)
+        with output.target(target.label):
+            return audit_links(
+                new_session(shared, adapters[target.vco]),
+                shared,
+                apply_changes,
+                rules,
+                hours,
+                read_workers=read_workers,
+                write_workers=write_workers,
+                affected_links_path=None,
+                print_stats=False,
+            )
+
+    results: list[tuple[AuditTarget, AuditResult]] = []
+    with (
+        redirect_stdout(output),
+        ThreadPoolExecutor(
+            max_workers=max(1, min(max_targets, len(targets)))
+        ) as executor,
+    ):
+        futures = [
+            (target, executor.submit(audit_target, target)) for target in targets
+        ]
+        for target, future in futures:
+            try:
+                results.append((target, future.result()))
+            except Exception as e:
+                print(f"[{target.label}] audit failed: {type(e).__name__}: {e}")
+
+    fleet = AuditResult(
+        merge_target_frames([(target, result.links) for target, result in results]),
+        merge_target_frames([(target, result.confirmed) for target, result in results]),
+    )
+    print(
+        f"audited {len(results)} of {len(targets)} target(s): {len(fleet.links)} link(s), "
+        f"{len(fleet.confirmed)} confirmed as affected"
+    )
+    if affected_links_path is not None:
+        write_affected_links(fleet.confirmed, affected_links_path)
 
-    affected_links_output = pd.concat(affected_links_output_list)
-    affected_links_output.to_csv("affected_links.csv")
+    for vco in dict.fromkeys(t.vco for t in targets):
+        print(f"{vco}: {limiter_stats_text(vco)}")
+    print(recorder().summary())
+    # only whole stacks go through the stack cache, targeted module fetches do not
+    if stack_cache().stats().misses:
+        print(stack_cache().summary())
+    return fleet
 
 
 def readenv(name: str) -> str:
@@ -190,10 +635,100 @@ def readenv(name: str) -> str:
     return val
 
 
-dotenv.load_dotenv(".env")
-shared = CommonData(readenv("VCO"), readenv("VCO_TOKEN"))
-
-s = session()
-s.headers.update({"Authorization": f"Token {shared.token}"})
-
-audit_links(s, shared, apply_changes=False)
+if __name__ == "__main__":
+    dotenv.load_dotenv(".env")
+
+    # AUDIT_TARGETS lists several VCOs and enterprises to audit in parallel, otherwise VCO is audited
+    targets_path = os.getenv("AUDIT_TARGETS")
+    if targets_path is not None:
+        targets = load_targets(targets_path)
+    else:
+        targets = [AuditTarget(readenv("VCO"), readenv("VCO_TOKEN"))]
+    vcos = list(dict.fromkeys(t.vco for t in targets))
+
+    json_codec = os.getenv("VCO_JSON_CODEC")
+    if json_codec is not None:
+        set_codec(json_codec)
+
+    max_rps = os.getenv("VCO_MAX_RPS")
+    if max_rps is not None:
+        for vco in vcos:
+            set_rate_limit(vco, float(max_rps))
+
+    if os.getenv("VCO_SIMULATOR") == "1":
+        for vco in vcos:
+            install_simulator(vco, VcoSimulator(config_from_env(dict(os.environ))))
+
+    trace_path = os.getenv("VCO_TRACE_FILE")
+    if trace_path is not None:
+        recorder().open_trace(trace_path)
+
+    audit_hours = os.getenv("AUDIT_HOURS")
+    try:
+        if targets_path is not None:
+            audit_fleet(
+                targets,
+                apply_changes=os.getenv("APPLY_CHANGES") == "1",
+                hours=float(audit_hours) if audit_hours is not None else None,
+                max_targets=int(os.getenv("MAX_TARGETS", "16")),
+                connections_per_vco=int(os.getenv("CONNECTIONS_PER_VCO", "8")),
+                read_workers=int(os.getenv("READ_WORKERS", "4")),
+                write_workers=int(os.getenv("WRITE_WORKERS", "2")),
+            )
+        elif os.getenv("VCO_ASYNC") == "1":
+            # the async audit reads the latest metrics only, it has no windows, store or checkpoint
+            unsupported = [
+                name
+                for name in ("AUDIT_HOURS", "METRICS_STORE", "REMEDIATION_CHECKPOINT")
+                if os.getenv(name) is not None
+            ]
+            if unsupported:
+                sys.exit(
+                    f"VCO_ASYNC=1 cannot be combined with {', '.join(unsupported)}"
+                )
+            shared = CommonData(targets[0].vco, targets[0].token)
+            state_path = os.getenv("AUDIT_STATE")
+
+            async def run_async_audit():
+                async with AsyncVcoClient(shared.vco, shared.token) as c:
+                    await audit_links_async(
+                        c,
+                        shared,
+                        apply_changes=os.getenv("APPLY_CHANGES") == "1",
+                        state=(
+                            AuditState(state_path) if state_path is not None else None
+                        ),
+                        write_workers=int(os.getenv("WRITE_WORKERS", "2")),
+                    )
+
+            asyncio.run(run_async_audit())
+        else:
+            shared = CommonData(targets[0].vco, targets[0].token)
+            s = new_session(shared)
+
+            store_path = os.getenv("METRICS_STORE")
+            state_path = os.getenv("AUDIT_STATE")
+            checkpoint_path = os.getenv("REMEDIATION_CHECKPOINT")
+            checkpoint = (
+                Checkpoint(checkpoint_path) if checkpoint_path is not None else None
+            )
+            try:
+                audit_links(
+                    s,
+                    shared,
+                    apply_changes=os.getenv("APPLY_CHANGES") == "1",
+                    hours=float(audit_hours) if audit_hours is not None else None,
+                    store=MetricsStore(store_path) if store_path is not None else None,
+                    state=AuditState(state_path) if state_path is not None else None,
+                    checkpoint=checkpoint,
+                    read_workers=int(os.getenv("READ_WORKERS", "4")),
+                    write_workers=int(os.getenv("WRITE_WORKERS", "2")),
+                )
+            finally:
+                if checkpoint is not None:
+                    checkpoint.close()
+    finally:
+        recorder().close()
+        metrics_path = os.getenv("VCO_METRICS_FILE")
+        if metrics_path is not None:
+            recorder().write_prometheus(metrics_path)
@@ -0,0 +1,145 @@
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+import json
+import os
+import threading
+import time
+from typing import Callable
+
+import pandas as pd
+
+from vcoclient.modules import ModuleUpdate
+
+
+class Checkpoint:
+    # append-only JSON lines file, one line per edge outcome
+    # edges which were fixed or found clear are skipped when a run is resumed, failed edges are retried
+    def __init__(self, path: str):
+        self.path = path
+        self.done: set[int] = set()
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as fp:
+                for line in fp:
+                    if not line.strip():
+                        continue
+                    entry = json.loads(line)
+                    if entry["status"] in ("fixed", "clear"):
+                        self.done.add(entry["edge_id"])
+                    else:
+                        self.done.discard(entry["edge_id"])
+        self.fp = open(path, "a")
+
+    def record(self, edge_id: int, status: str, detail: str = ""):
+        with self.lock:
+            self.fp.write(
+                json.dumps(
+                    {
+                        "edge_id": edge_id,
+                        "status": status,
+                        "detail": detail,
+                        "at": time.time(),
+                    }
+                )
+                + "\n"
+            )
+            self.fp.flush()
+            if status in ("fixed", "clear"):
+                self.done.add(edge_id)
+
+    def close(self):
+        with self.lock:
+            self.fp.close()
+
+
+@dataclass
+class PipelineResult:
+    wan_modules: dict[int, dict] = field(default_factory=dict)
+    confirmed: list[pd.DataFrame] = field(default_factory=list)
+    new_wan_data: dict[int, dict] = field(default_factory=dict)
+    fixed_edge_ids: set[int] = field(default_factory=set)
+    failed_edge_ids: set[int] = field(default_factory=set)
+    # edges whose WAN module could not be fetched, with the reason
+    unread_edges: dict[int, str] = field(default_factory=dict)
+
+
+def run_pipeline(
+    edge_ids: list[int],
+    fetch_chunk: Callable[[list[int]], tuple[dict[int, dict], dict[int, str]]],
+    decide: Callable[[dict[int, dict]], tuple[pd.DataFrame, dict[int, dict]]],
+    write: Callable[[int, dict, dict], ModuleUpdate] | None,
+    chunk_size: int = 20,
+    read_workers: int = 4,
+    write_workers: int = 2,
+    checkpoint: Checkpoint | None = None,
+) -> PipelineResult:
+    # reads run on their own pool and each chunk is decided as soon as it lands,
+    # fixes go to a smaller write pool so the VCO sees far fewer concurrent updates than reads
+    # fetch_chunk returns the WAN modules it found and a reason for every edge it could not read
+    # every outcome is handled on the calling thread, so nothing prints from the pools
+    result = PipelineResult()
+
+    def unread(edge_id: int, reason: str):
+        print(f"- failed to fetch WAN module of edge {edge_id}: {reason}")
+        result.unread_edges[edge_id] = reason
+        if checkpoint is not None:
+            checkpoint.record(edge_id, "unread", reason)
+
+    def on_read(chunk: list[int], future: Future):
+        try:
+            wan_modules, failures = future.result()
+        except Exception as e:
+            # a chunk that failed as a whole only costs its own edges
+            wan_modules, failures = {}, {
+                edge_id: f"{type(e).__name__}: {e}" for edge_id in chunk
+            }
+        for edge_id, reason in failures.items():
+            unread(edge_id, reason)
+        if not wan_modules:
+            return
+
+        confirmed, new_wan_data = decide(wan_modules)
+        result.wan_modules.update(wan_modules)
+        result.confirmed.append(confirmed)
+        result.new_wan_data.update(new_wan_data)
+        for edge_id, wan_module in wan_modules.items():
+            if edge_id not in new_wan_data:
+                if checkpoint is not None:
+                    checkpoint.record(edge_id, "clear")
+            elif write is not None:
+                future = writers.submit(
+                    write, edge_id, wan_module, new_wan_data[edge_id]
+                )
+                pending[future] = lambda f, edge_id=edge_id: on_written(edge_id, f)
+
+    def on_written(edge_id: int, future: Future):
+        try:
+            update = future.result()
+        except Exception as e:
+            print(
+                f"- failed to fix WAN module of edge {edge_id}: {type(e).__name__}: {e}"
+            )
+            result.failed_edge_ids.add(edge_id)
+            if checkpoint is not None:
+                checkpoint.record(edge_id, "failed", f"{type(e).__name__}: {e}")
+            return
+
+        print(f"- applied fix to WAN module of edge {edge_id}: {update.describe()}")
+        result.fixed_edge_ids.add(edge_id)
+        if checkpoint is not None:
+            checkpoint.record(edge_id, "fixed", update.describe())
+
+    chunks = [edge_ids[i : i + chunk_size] for i in range(0, len(edge_ids), chunk_size)]
+    with ThreadPoolExecutor(read_workers) as readers, ThreadPoolExecutor(
+        write_workers
+    ) as writers:
+        pending: dict[Future, Callable[[Future], None]] = {
+            readers.submit(fetch_chunk, chunk): lambda f, chunk=chunk: on_read(chunk, f)
+            for chunk in chunks
+        }
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.pop(future)(future)
+
+    return result
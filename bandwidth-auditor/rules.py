@@ -0,0 +1,98 @@
+from dataclasses import dataclass, field
+import copy
+from typing import Any
+
+import pandas as pd
+
+
+@dataclass
+class AuditRule:
+    name: str
+    # pandas.eval expression over the link metrics frame, evaluated for every link at once
+    expression: str
+    # WAN module link fields a candidate link must have for the rule to be confirmed
+    config_match: dict[str, Any] = field(default_factory=dict)
+    # WAN module link fields written to confirmed links
+    fix: dict[str, Any] = field(default_factory=dict)
+
+
+# links which measured 200 > downstream > 175 while having upstream < 175
+# are candidates for when burst mode should have been enabled, STATIC means burst mode
+BURST_MODE_RULE = AuditRule(
+    "burst-mode",
+    "175.0 < downstream_mbps < 200.0 and upstream_mbps < 175.0",
+    config_match={"bwMeasurement": "SLOW_START"},
+    fix={"bwMeasurement": "STATIC"},
+)
+
+DEFAULT_RULES = [BURST_MODE_RULE]
+
+
+def evaluate_rules(links_df: pd.DataFrame, rules: list[AuditRule]) -> pd.DataFrame:
+    # one vectorized mask per rule, a link matching several rules appears once per rule
+    matches = []
+    for rule in rules:
+        mask = links_df.eval(rule.expression)
+        matches.append(links_df[mask].assign(rule=rule.name))
+    if len(matches) == 0:
+        return links_df.iloc[0:0].assign(rule=pd.Series(dtype=str))
+    return pd.concat(matches)
+
+
+def wan_links_frame(wan_modules: dict[int, dict], fields: set[str]) -> pd.DataFrame:
+    # one row per link in each edge's WAN module, with the fields the rules look at
+    rows = [
+        {
+            "edge_id": edge_id,
+            "link_index": i,
+            "link_internal_id": link.get("internalId"),
+            "wan_link_name": link.get("name"),
+            **{f: link.get(f) for f in fields},
+        }
+        for edge_id, module in wan_modules.items()
+        for i, link in enumerate(module["data"].get("links", []))
+    ]
+    return pd.DataFrame(
+        rows,
+        columns=[
+            "edge_id",
+            "link_index",
+            "link_internal_id",
+            "wan_link_name",
+            *sorted(fields),
+        ],
+    )
+
+
+def confirm_candidates(
+    candidates: pd.DataFrame, wan_modules: dict[int, dict], rules: list[AuditRule]
+) -> pd.DataFrame:
+    fields = {f for rule in rules for f in rule.config_match}
+    wan_links = wan_links_frame(wan_modules, fields)
+    merged = candidates.merge(
+        wan_links, on=["edge_id", "link_internal_id"], how="inner"
+    )
+
+    confirmed = []
+    for rule in rules:
+        mask = merged["rule"] == rule.name
+        for f, value in rule.config_match.items():
+            mask &= merged[f] == value
+        confirmed.append(merged[mask])
+    return pd.concat(confirmed) if len(confirmed) > 0 else merged.iloc[0:0]
+
+
+def apply_fixes(
+    confirmed: pd.DataFrame, wan_modules: dict[int, dict], rules: list[AuditRule]
+) -> dict[int, dict]:
+    # returns fixed copies of the WAN data for every edge with a confirmed link
+    fixes = {rule.name: rule.fix for rule in rules}
+    new_wan_data = {}
+    for edge_id, link_index, rule_name in zip(
+        confirmed["edge_id"], confirmed["link_index"], confirmed["rule"]
+    ):
+        edge_id = int(edge_id)
+        if edge_id not in new_wan_data:
+            new_wan_data[edge_id] = copy.deepcopy(wan_modules[edge_id]["data"])
+        new_wan_data[edge_id]["links"][int(link_index)].update(fixes[rule_name])
+    return new_wan_data
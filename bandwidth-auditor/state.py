@@ -0,0 +1,78 @@
+from dataclasses import asdict, dataclass
+import json
+import os
+import time
+
+import pandas as pd
+
+
+@dataclass
+class EdgeAuditState:
+    # the edge record's modified timestamp from enterprise/getEnterpriseEdges
+    edge_modified: str | None
+    # rule:internalId pairs the link metrics flagged for this edge
+    candidates: list[str]
+    # "affected" when confirmed links were left unfixed, otherwise "clear"
+    verdict: str
+    checked_at: float
+
+
+def candidate_signatures(candidates: pd.DataFrame) -> dict[int, list[str]]:
+    signatures = (
+        candidates["rule"].astype(str)
+        + ":"
+        + candidates["link_internal_id"].astype(str)
+    )
+    return {
+        int(edge_id): sorted(set(group))
+        for edge_id, group in signatures.groupby(candidates["edge_id"].to_numpy())
+    }
+
+
+class AuditState:
+    def __init__(
+        self, path: str = "audit_state.json", recheck_after_hours: float = 7 * 24
+    ):
+        self.path = path
+        self.recheck_after_seconds = recheck_after_hours * 60 * 60
+        self.edges: dict[int, EdgeAuditState] = {}
+        if os.path.exists(path):
+            with open(path) as fp:
+                self.edges = {
+                    int(edge_id): EdgeAuditState(**edge)
+                    for edge_id, edge in json.load(fp).items()
+                }
+
+    def needs_check(
+        self, edge_id: int, candidates: list[str], edge_modified: str | None
+    ) -> bool:
+        # an edge is skipped only when its last check found nothing left to do
+        # and neither its metrics verdict nor its edge record changed since
+        # the VCO does not always bump the edge record's modified timestamp for an edit made only to
+        # the WAN module, such an edit is picked up by the periodic recheck
+        prior = self.edges.get(edge_id)
+        return (
+            prior is None
+            or prior.verdict != "clear"
+            or prior.candidates != candidates
+            or edge_modified is None
+            or prior.edge_modified != edge_modified
+            or time.time() - prior.checked_at > self.recheck_after_seconds
+        )
+
+    def record(
+        self,
+        edge_id: int,
+        candidates: list[str],
+        edge_modified: str | None,
+        verdict: str,
+    ):
+        self.edges[edge_id] = EdgeAuditState(
+            edge_modified, candidates, verdict, time.time()
+        )
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as fp:
+            json.dump({str(k): asdict(v) for k, v in self.edges.items()}, fp)
+        os.replace(tmp_path, self.path)
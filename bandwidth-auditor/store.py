@@ -0,0 +1,157 @@
+from datetime import datetime, timezone
+import json
+import os
+from typing import cast
+
+import numpy as np
+import pandas as pd
+
+from ingest import STRING_COLUMNS
+
+# one raw little-endian file per column and per UTC day partition, so columns can be memory mapped directly
+NUMERIC_COLUMNS = {
+    "edge_id": np.dtype("<i4"),
+    "window_start": np.dtype("<i8"),
+    "upstream_mbps": np.dtype("<f4"),
+    "downstream_mbps": np.dtype("<f4"),
+}
+# string columns are stored as int32 codes into dictionaries shared by every partition
+COLUMNS = {**NUMERIC_COLUMNS, **{c: np.dtype("<i4") for c in STRING_COLUMNS}}
+
+
+def partition_name(window_start_ms: int) -> str:
+    return datetime.fromtimestamp(window_start_ms / 1000, timezone.utc).strftime(
+        "%Y-%m-%d"
+    )
+
+
+class MetricsStore:
+    def __init__(self, path: str = "metrics_store"):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.manifest = {"partitions": {}, "last_window_end": None}
+        self.dictionaries: dict[str, list[str]] = {c: [] for c in STRING_COLUMNS}
+
+        manifest_path = os.path.join(path, "manifest.json")
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as fp:
+                self.manifest = json.load(fp)
+            with open(os.path.join(path, "dictionaries.json")) as fp:
+                self.dictionaries = json.load(fp)
+        self.lookups = {
+            c: {v: i for i, v in enumerate(values)}
+            for c, values in self.dictionaries.items()
+        }
+
+    @property
+    def last_window_end(self) -> int | None:
+        return self.manifest["last_window_end"]
+
+    def _column_path(self, partition: str, column: str) -> str:
+        return os.path.join(self.path, partition, f"{column}.bin")
+
+    def _write_json(self, name: str, value):
+        tmp_path = os.path.join(self.path, f"{name}.tmp")
+        with open(tmp_path, "w") as fp:
+            json.dump(value, fp)
+        os.replace(tmp_path, os.path.join(self.path, name))
+
+    def _encode(self, column: str, values: pd.Series) -> np.ndarray:
+        categorical = values.astype("category")
+        lookup, dictionary = self.lookups[column], self.dictionaries[column]
+        for category in categorical.cat.categories:
+            if category not in lookup:
+                lookup[category] = len(dictionary)
+                dictionary.append(category)
+        category_codes = np.array(
+            [lookup[c] for c in categorical.cat.categories], dtype=np.int32
+        )
+        return category_codes[categorical.cat.codes.to_numpy()]
+
+    def append(self, links_df: pd.DataFrame, window_end: int):
+        # links_df has the columns produced by ingest.LinkMetricsAccumulator
+        encoded = {
+            c: self._encode(c, cast(pd.Series, links_df[c])) for c in STRING_COLUMNS
+        }
+        partitions = np.array(
+            [partition_name(int(ws)) for ws in links_df["window_start"]]
+        )
+
+        for partition in np.unique(partitions):
+            rows = partitions == partition
+            os.makedirs(os.path.join(self.path, partition), exist_ok=True)
+            stored_rows = self.manifest["partitions"].get(partition, 0)
+            for column, dtype in COLUMNS.items():
+                values = (
+                    encoded[column]
+                    if column in encoded
+                    else links_df[column].to_numpy()
+                )
+                column_path = self._column_path(partition, column)
+                with open(column_path, "ab") as fp:
+                    # drop anything written past the manifest by an interrupted append
+                    fp.truncate(stored_rows * dtype.itemsize)
+                    fp.write(np.ascontiguousarray(values[rows], dtype=dtype).tobytes())
+            self.manifest["partitions"][partition] = stored_rows + int(rows.sum())
+
+        # dictionaries first, so the manifest never references codes that were not saved
+        self._write_json("dictionaries.json", self.dictionaries)
+        self.manifest["last_window_end"] = window_end
+        self._write_json("manifest.json", self.manifest)
+
+    def columns(self, partition: str) -> dict[str, np.ndarray]:
+        # read-only memory maps, nothing is loaded until it is touched
+        rows = self.manifest["partitions"].get(partition, 0)
+        if rows == 0:
+            return {c: np.empty(0, dtype=dtype) for c, dtype in COLUMNS.items()}
+        return {
+            c: np.memmap(
+                self._column_path(partition, c), dtype=dtype, mode="r", shape=(rows,)
+            )
+            for c, dtype in COLUMNS.items()
+        }
+
+    def read(
+        self,
+        start_ms: int | None = None,
+        end_ms: int | None = None,
+        edge_ids: list[int] | None = None,
+    ) -> pd.DataFrame:
+        first = partition_name(start_ms) if start_ms is not None else None
+        last = partition_name(end_ms) if end_ms is not None else None
+
+        frames = []
+        for partition in sorted(self.manifest["partitions"]):
+            if (first is not None and partition < first) or (
+                last is not None and partition > last
+            ):
+                continue
+            cols = self.columns(partition)
+            mask = np.ones(len(cols["window_start"]), dtype=bool)
+            if start_ms is not None:
+                mask &= cols["window_start"] >= start_ms
+            if end_ms is not None:
+                mask &= cols["window_start"] < end_ms
+            if edge_ids is not None:
+                mask &= np.isin(cols["edge_id"], edge_ids)
+            frames.append({c: values[mask] for c, values in cols.items()})
+
+        def concat(column: str) -> np.ndarray:
+            if len(frames) == 0:
+                return np.empty(0, dtype=COLUMNS[column])
+            return np.concatenate([f[column] for f in frames])
+
+        return pd.DataFrame(
+            {
+                "edge_id": concat("edge_id"),
+                **{
+                    c: pd.Categorical.from_codes(
+                        concat(c), categories=self.dictionaries[c]
+                    )
+                    for c in STRING_COLUMNS
+                },
+                "upstream_mbps": concat("upstream_mbps"),
+                "downstream_mbps": concat("downstream_mbps"),
+                "window_start": concat("window_start"),
+            }
+        )
@@ -0,0 +1,448 @@
+import argparse
+import contextlib
+import copy
+from dataclasses import dataclass
+import importlib.util
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable
+
+import jsonpatch
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+PROVISIONING_DIR = os.path.join(ROOT, "branch-provisioning")
+AUDITOR_DIR = os.path.join(ROOT, "bandwidth-auditor")
+sys.path[:0] = [ROOT, PROVISIONING_DIR, AUDITOR_DIR]
+
+BASELINES_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "baselines.json"
+)
+
+
+def load_script(name: str, path: str):
+    # both tools have a main.py, so each is loaded under its own module name
+    spec = importlib.util.spec_from_file_location(name, path)
+    assert spec is not None and spec.loader is not None, f"cannot load {path}"
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+provisioning = load_script(
+    "provisioning_main", os.path.join(PROVISIONING_DIR, "main.py")
+)
+auditor = load_script("auditor_main", os.path.join(AUDITOR_DIR, "main.py"))
+
+import geocache  # noqa: E402
+from models import LatLon  # noqa: E402
+from vcoclient.ratelimit import set_rate_limit  # noqa: E402
+from vcoclient.simulator import (  # noqa: E402
+    SimulatorConfig,
+    VcoSimulator,
+    install_simulator,
+)
+from vcoclient.stacks import stack_cache  # noqa: E402
+
+
+@dataclass
+class Benchmark:
+    name: str
+    # returns the function to time, everything done before returning is setup
+    setup: Callable[[], Callable[[], object]]
+    repeat: int = 7
+
+
+BENCHMARKS: list[Benchmark] = []
+
+
+def benchmark(name: str, repeat: int = 7):
+    def register(setup: Callable[[], Callable[[], object]]):
+        BENCHMARKS.append(Benchmark(name, setup, repeat))
+        return setup
+
+    return register
+
+
+def branches(n: int) -> list:
+    result = []
+    for i in range(n):
+        branch = copy.deepcopy(provisioning.branch_data)
+        branch.name = f"bench-branch-{i}"
+        result.append(branch)
+    return result
+
+
+def device_settings() -> dict:
+    stack = VcoSimulator(SimulatorConfig(edge_count=1, seed=0)).stack(1)
+    return provisioning.extract_module(stack[0]["modules"], "deviceSettings")["data"]
+
+
+@benchmark("patch.build_x1000")
+def bench_patch_build():
+    ds = device_settings()
+    batch = branches(1000)
+
+    def run():
+        for branch in batch:
+            provisioning.build_static_routes_patch(branch)
+            provisioning.build_vlan_999_patch()
+            provisioning.build_wan_patch(branch.wans[0], "GE3", ds)
+            provisioning.build_wan_patch(branch.wans[1], "GE4", ds)
+            provisioning.build_ge2_patch(branch, ds)
+
+    return run
+
+
+@benchmark("patch.jsonpatch_apply_x1000")
+def bench_jsonpatch_apply():
+    ds = device_settings()
+    patches = [
+        jsonpatch.JsonPatch(provisioning.build_device_settings_patch(branch, ds).patch)
+        for branch in branches(1000)
+    ]
+
+    def run():
+        for patch in patches:
+            patch.apply(ds)
+
+    return run
+
+
+@benchmark("patch.template_apply_x1000")
+def bench_template_apply():
+    ds = device_settings()
+    patch_sets = [
+        provisioning.build_device_settings_patch(branch, ds)
+        for branch in branches(1000)
+    ]
+
+    def run():
+        for patch_set in patch_sets:
+            patch_set.apply(ds)
+
+    return run
+
+
+@benchmark("wan_overlay.generate_x10000")
+def bench_wan_overlay():
+    wans = provisioning.branch_data.wans
+
+    def run():
+        for _ in range(10000):
+            provisioning.generate_wan_overlay(wans)
+
+    return run
+
+
+def links_frame(n: int, seed: int = 0) -> pd.DataFrame:
+    # same layout as LinkMetricsAccumulator.frame, two links per edge
+    rng = np.random.default_rng(seed)
+    edge_id = (np.arange(n) // 2).astype(np.int32)
+    link_codes = np.arange(n, dtype=np.int32)
+    return pd.DataFrame(
+        {
+            "edge_id": edge_id,
+            "edge_name": pd.Categorical.from_codes(
+                edge_id, categories=[f"edge-{i}" for i in range((n + 1) // 2)]
+            ),
+            "link_internal_id": pd.Categorical.from_codes(
+                link_codes, categories=[f"link-{i}" for i in range(n)]
+            ),
+            "link_name": pd.Categorical.from_codes(
+                link_codes % 2, categories=["WAN1", "WAN2"]
+            ),
+            "isp": pd.Categorical.from_codes(
+                link_codes % 3, categories=["A", "B", "C"]
+            ),
+            "upstream_mbps": rng.uniform(0, 250, n).astype(np.float32),
+            "downstream_mbps": rng.uniform(0, 250, n).astype(np.float32),
+            "window_start": np.zeros(n, dtype=np.int64),
+        }
+    )
+
+
+def wan_modules_for(candidates: pd.DataFrame) -> dict[int, dict]:
+    wan_modules = {}
+    for edge_id, link_id in zip(candidates["edge_id"], candidates["link_internal_id"]):
+        module = wan_modules.setdefault(
+            int(edge_id), {"id": int(edge_id) * 10 + 2, "data": {"links": []}}
+        )
+        module["data"]["links"].append(
+            {
+                "internalId": link_id,
+                "name": "WAN1",
+                "bwMeasurement": (
+                    "SLOW_START" if int(edge_id) % 2 == 0 else "USER_DEFINED"
+                ),
+            }
+        )
+    return wan_modules
+
+
+def audit_benchmark(n: int):
+    def setup():
+        links_df = links_frame(n)
+        wan_modules = wan_modules_for(
+            auditor.evaluate_rules(links_df, auditor.DEFAULT_RULES)
+        )
+
+        def run():
+            candidates = auditor.evaluate_rules(links_df, auditor.DEFAULT_RULES)
+            confirmed = auditor.confirm_candidates(
+                candidates, wan_modules, auditor.DEFAULT_RULES
+            )
+            for _, df in confirmed.groupby("edge_id", observed=True):
+                df["wan_link_name"].unique()
+
+        return run
+
+    return setup
+
+
+benchmark("audit.filter_group_10k")(audit_benchmark(10_000))
+benchmark("audit.filter_group_100k")(audit_benchmark(100_000))
+benchmark("audit.filter_group_1m", repeat=3)(audit_benchmark(1_000_000))
+
+
+def stack_batch_body() -> bytes:
+    # a batch response of 20 edge stacks, each padded to the size of a busy production edge
+    sim = VcoSimulator(SimulatorConfig(edge_count=20, seed=0))
+    stacks = []
+    for edge_id in range(1, 21):
+        stack = copy.deepcopy(sim.stack(edge_id))
+        ds = stack[0]["modules"][0]["data"]
+        ds["segments"][0]["routes"]["static"] = [
+            provisioning.static_route(provisioning.branch_data, net)
+            for net in provisioning.branch_data.corporate_nets
+        ] * 200
+        stack[1]["modules"][1]["data"]["outbound"] = [
+            {
+                "name": f"rule-{i}",
+                "match": {"dip": f"10.{i % 256}.0.0", "dport_low": i},
+                "action": {"allow_or_deny": "allow"},
+            }
+            for i in range(1000)
+        ]
+        stacks.append({"jsonrpc": "2.0", "id": edge_id, "result": stack})
+    return json.dumps(stacks).encode()
+
+
+@benchmark("json.decode_stack_batch_x20")
+def bench_json_decode():
+    body = stack_batch_body()
+
+    def run():
+        json.loads(body)
+
+    return run
+
+
+@benchmark("json.decode_stack_batch_cached_x20")
+def bench_stack_cache_decode():
+    # the profile layers are decoded once, every later stack only hashes their bytes
+    body = stack_batch_body()
+    decode = stack_cache().decoder()
+
+    def run():
+        decode(body)
+
+    return run
+
+
+def provisioning_benchmark(use_async: bool):
+    def setup():
+        vco = "bench-async.vco" if use_async else "bench.vco"
+        shared = provisioning.CommonData(
+            vco, "token", "bench-enterprise", "zs", "profile", "license", "maps-key"
+        )
+        sim = VcoSimulator(
+            SimulatorConfig(
+                edge_count=0,
+                latency_ms=0,
+                latency_jitter_ms=0,
+                per_call_latency_ms=0,
+                seed=0,
+            ),
+            shared.enterprise_logical_id,
+        )
+        install_simulator(vco, sim)
+        set_rate_limit(vco, 100000)
+
+        fd, cache_path = tempfile.mkstemp(suffix=".sqlite3")
+        os.close(fd)
+        geocache._default_cache = geocache.GeocodeCache(cache_path)
+        branch = provisioning.branch_data
+        geocache._default_cache.put(
+            branch.postal_code, branch.country, LatLon(0.0, 0.0)
+        )
+        batch = branches(200)
+
+        def run():
+            if use_async:
+                import asyncio
+
+                return asyncio.run(provisioning.provision_branches_async(shared, batch))
+            return provisioning.provision_branches(shared, batch, max_workers=8)
+
+        return run
+
+    return setup
+
+
+benchmark("provision.e2e_threads_x200", repeat=3)(provisioning_benchmark(False))
+benchmark("provision.e2e_async_x200", repeat=3)(provisioning_benchmark(True))
+
+
+def calibrate() -> float:
+    # a fixed mixed workload timed next to every benchmark, shared machines drift by tens of
+    # percent between runs and comparing against it cancels most of that out
+    doc = {
+        "links": [
+            {"name": f"WAN{i}", "mbps": i * 1.5, "tags": list(range(10))}
+            for i in range(200)
+        ]
+    }
+    timings = []
+    for _ in range(5):
+        start = time.perf_counter()
+        for _ in range(20):
+            json.loads(json.dumps(doc))
+            copy.deepcopy(doc)
+            np.sort(np.arange(50000, 0, -1))
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def measure(bench: Benchmark) -> dict:
+    before = calibrate()
+    with contextlib.redirect_stdout(io.StringIO()):
+        run = bench.setup()
+        run()
+        timings = []
+        for _ in range(bench.repeat):
+            start = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - start)
+    # calibrated on both sides of the benchmark, a single pause in either should not skew the comparison
+    return {
+        "median_s": statistics.median(timings),
+        "min_s": min(timings),
+        "calibration_s": min(before, calibrate()),
+    }
+
+
+def ratio(result: dict) -> float:
+    # best time in units of the calibration loop, baselines recorded before "ratio" was stored
+    # only have the raw timings
+    return result.get("ratio", result["min_s"] / result["calibration_s"])
+
+
+def measure_sessions(bench: Benchmark, sessions: int) -> dict:
+    # the session with the median ratio is kept, so one slow calibration or one noisy session
+    # cannot move the result; noise is how far the sessions spread around it
+    results = [measure(bench) for _ in range(sessions)]
+    ratios = [ratio(r) for r in results]
+    median = statistics.median_low(ratios)
+    result = dict(results[ratios.index(median)])
+    result["ratio"] = median
+    result["noise"] = (max(ratios) - min(ratios)) / median if sessions > 1 else 0.0
+    result["sessions"] = sessions
+    return result
+
+
+def load_baselines(path: str) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path) as fp:
+        return json.load(fp)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="benchmark the provisioning and auditing hot paths"
+    )
+    parser.add_argument(
+        "filter", nargs="*", help="only run benchmarks whose name contains one of these"
+    )
+    parser.add_argument("--baselines", default=BASELINES_PATH)
+    # the fastest run relative to the calibration loop is compared, see calibrate()
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.25,
+        help="allowed slowdown over the baseline best time, 0.25 = 25%%",
+    )
+    parser.add_argument(
+        "--sessions",
+        type=int,
+        default=None,
+        help="times each benchmark is measured, the median is used (default 1, 5 with --update)",
+    )
+    parser.add_argument(
+        "--update", action="store_true", help="store the results as the new baselines"
+    )
+    args = parser.parse_args()
+
+    sessions = args.sessions if args.sessions is not None else (5 if args.update else 1)
+    stored = load_baselines(args.baselines)
+    baselines = stored.get("benchmarks", {})
+    regressions = []
+    results = {}
+
+    print(
+        f"{'benchmark':<34} {'best':>10} {'median':>10} {'baseline':>10} {'change':>8}"
+    )
+    for bench in BENCHMARKS:
+        if args.filter and not any(f in bench.name for f in args.filter):
+            continue
+        result = measure_sessions(bench, sessions)
+        results[bench.name] = result
+
+        baseline = baselines.get(bench.name)
+        line = f"{bench.name:<34} {result['min_s'] * 1000:>8.1f}ms {result['median_s'] * 1000:>8.1f}ms"
+        if baseline is None:
+            print(f"{line} {'-':>10} {'-':>8}")
+            continue
+        change = ratio(result) / ratio(baseline) - 1
+        # the spread seen while recording the baseline is allowed on top of the threshold
+        flag = ""
+        if change > args.threshold + baseline.get("noise", 0.0):
+            regressions.append(bench.name)
+            flag = "  REGRESSION"
+        print(f"{line} {baseline['min_s'] * 1000:>8.1f}ms {change:>+7.0%}{flag}")
+
+    if args.update:
+        baselines.update(results)
+        with open(args.baselines, "w") as fp:
+            json.dump(
+                {
+                    "machine": f"{platform.machine()} {platform.processor() or ''}".strip(),
+                    "python": platform.python_version(),
+                    "cpus": os.cpu_count(),
+                    "benchmarks": baselines,
+                },
+                fp,
+                indent=2,
+                sort_keys=True,
+            )
+        print(f"baselines written to {args.baselines}")
+        return 0
+
+    if regressions:
+        print(
+            f"{len(regressions)} benchmark(s) slower than baseline by more than {args.threshold:.0%}: {', '.join(regressions)}"
+        )
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,249 @@
+import asyncio
+import httpx
+import time
+from typing import AsyncIterator
+
+from api import EdgeDirectory, directory_for
+from geocache import GeocodeCache
+from models import CommonData, EdgeLicense, LatLon
+from util import GEOCODER
+from vcoclient.aio import AsyncVcoClient
+from vcoclient.modules import ModuleUpdate, plan_module_update
+from vcoclient.portal import PortalCall, PortalResult, decode_json, record_request
+from vcoclient.codec import codec
+from vcoclient.stacks import get_edge_modules_async, stack_cache
+
+# asyncio counterparts of the functions in api.py, taking an AsyncVcoClient in place of a Session
+
+
+def new_client(shared: CommonData, max_in_flight: int = 32) -> AsyncVcoClient:
+    return AsyncVcoClient(shared.vco, shared.token, max_in_flight=max_in_flight)
+
+
+async def do_portal(c: AsyncVcoClient, shared: CommonData, method: str, params: dict):
+    return await c.do_portal(method, params)
+
+
+async def do_portal_batch(
+    c: AsyncVcoClient, shared: CommonData, calls: list[PortalCall], chunk_size: int = 50
+) -> list[PortalResult]:
+    return await c.do_portal_batch(calls, chunk_size)
+
+
+async def get_async(c: AsyncVcoClient, shared: CommonData, async_token: str):
+    return await do_portal(
+        c,
+        shared,
+        "async/getStatus",
+        {
+            "apiToken": async_token,
+        },
+    )
+
+
+async def get_enterprise_edges_v1(c: AsyncVcoClient, shared: CommonData) -> list[dict]:
+    return await do_portal(c, shared, "enterprise/getEnterpriseEdges", {})
+
+
+async def get_edge_v1(
+    c: AsyncVcoClient, shared: CommonData, edge_logical_id: str
+) -> dict:
+    return await do_portal(c, shared, "edge/getEdge", {"logicalId": edge_logical_id})
+
+
+# the directories themselves are shared with api.py, these locks only serialize async refreshes
+_refresh_locks: dict[int, asyncio.Lock] = {}
+
+
+async def edge_directory(c: AsyncVcoClient, shared: CommonData) -> EdgeDirectory:
+    directory = directory_for(shared)
+    refresh_lock = _refresh_locks.setdefault(id(directory), asyncio.Lock())
+    async with refresh_lock:
+        if directory.is_stale():
+            edges = await get_enterprise_edges_v1(c, shared)
+            with directory.lock:
+                directory.load(edges)
+    return directory
+
+
+async def find_edge(c: AsyncVcoClient, shared: CommonData, edge_logical_id: str):
+    directory = await edge_directory(c, shared)
+    edge = directory.by_logical_id.get(edge_logical_id)
+    if edge is not None:
+        return edge
+
+    try:
+        edge = await get_edge_v1(c, shared, edge_logical_id)
+    except ValueError:
+        return None
+    with directory.lock:
+        directory.add(edge)
+    return edge
+
+
+async def find_edge_by_id(c: AsyncVcoClient, shared: CommonData, edge_id: int):
+    return (await edge_directory(c, shared)).by_id.get(edge_id)
+
+
+async def find_edge_by_name(c: AsyncVcoClient, shared: CommonData, edge_name: str):
+    return (await edge_directory(c, shared)).by_name.get(edge_name)
+
+
+async def get_configuration_stack(
+    c: AsyncVcoClient, shared: CommonData, edge_id: int, modules: set[str] | None = None
+) -> list[dict]:
+    return await c.do_portal(
+        "edge/getEdgeConfigurationStack",
+        {"edgeId": edge_id},
+        stack_cache().decoder(modules),
+    )
+
+
+async def get_edge_configuration_modules(
+    c: AsyncVcoClient, shared: CommonData, edge_id: int, modules: set[str]
+) -> dict:
+    result = (await get_edge_modules_async(c, [edge_id], modules))[edge_id]
+    if not result.ok:
+        raise ValueError(codec().dumps(result.error, indent=True).decode())
+    return result.result[0]
+
+
+async def update_configuration_module(
+    c: AsyncVcoClient,
+    shared: CommonData,
+    configuration_module_id: int,
+    new_data: dict,
+    new_refs: dict | None = None,
+):
+    update = {"data": new_data}
+    if new_refs is not None:
+        update["refs"] = new_refs
+
+    await do_portal(
+        c,
+        shared,
+        "configuration/updateConfigurationModule",
+        params={
+            "id": configuration_module_id,
+            "_update": update,
+        },
+    )
+
+
+async def update_configuration_module_if_changed(
+    c: AsyncVcoClient,
+    shared: CommonData,
+    module: dict,
+    new_data: dict | None,
+    new_refs: dict | None = None,
+) -> ModuleUpdate:
+    plan = plan_module_update(module, new_data, new_refs)
+    if plan.changed:
+        await do_portal(
+            c,
+            shared,
+            "configuration/updateConfigurationModule",
+            params={"id": plan.module_id, "_update": plan.update},
+        )
+    return plan
+
+
+async def get_licenses_v1(c: AsyncVcoClient, shared: CommonData) -> list[EdgeLicense]:
+    resp = await do_portal(c, shared, "license/getEnterpriseEdgeLicenses", {})
+    return [
+        EdgeLicense(
+            lic["id"],
+            lic["logicalId"],
+            lic["name"],
+            lic["bandwidthTier"],
+            lic["edition"],
+            lic["termMonths"],
+        )
+        for lic in resp
+    ]
+
+
+async def get_edges(
+    c: AsyncVcoClient, shared: CommonData, next_page_token: str | None = None
+):
+    params = f"?nextPageLink={next_page_token}" if next_page_token is not None else ""
+
+    resp = await c.send(
+        "GET",
+        f"/api/sdwan/v2/enterprises/{shared.enterprise_logical_id}/edges{params}",
+    )
+    return decode_json(c.vco, resp)
+
+
+async def iter_edges(
+    c: AsyncVcoClient, shared: CommonData, fields: list[str] | None = None
+) -> AsyncIterator[dict]:
+    pending = asyncio.ensure_future(get_edges(c, shared))
+    try:
+        while pending is not None:
+            page = await pending
+            meta = page.get("metaData", {})
+            next_page_token = meta.get("nextPageLink") if meta.get("more") else None
+            pending = (
+                asyncio.ensure_future(get_edges(c, shared, next_page_token))
+                if next_page_token
+                else None
+            )
+
+            for edge in page.get("data", []):
+                if fields is None:
+                    yield edge
+                else:
+                    yield {f: edge.get(f) for f in fields}
+            del page
+    finally:
+        if pending is not None:
+            pending.cancel()
+
+
+async def post_edge(
+    c: AsyncVcoClient,
+    shared: CommonData,
+    model_name: str,
+    profile_logical_id: str,
+    extras: dict,
+):
+    # a 5xx may still have created the edge, so only throttled posts are retried
+    resp = await c.send(
+        "POST",
+        f"/api/sdwan/v2/enterprises/{shared.enterprise_logical_id}/edges",
+        retry_server_errors=False,
+        json={
+            "modelNumber": model_name,
+            "profile": profile_logical_id,
+            **extras,
+        },
+    )
+    return decode_json(c.vco, resp)
+
+
+async def calculate_lat_lon(
+    http: httpx.AsyncClient,
+    gmaps_api_key: str,
+    postal_code: str,
+    country: str,
+    cache: GeocodeCache | None = None,
+) -> LatLon:
+    if cache is not None:
+        cached = cache.get(postal_code, country)
+        if cached is not None:
+            return cached
+
+    started = time.perf_counter()
+    http_resp = await http.get(
+        "https://maps.googleapis.com/maps/api/geocode/json",
+        params={"address": f"{postal_code},{country}", "key": gmaps_api_key},
+    )
+    record_request(GEOCODER, "geocode", None, http_resp, 1, started, 0.0, 0.0, 0)
+    resp = decode_json(GEOCODER, http_resp, "geocode")
+
+    first_location = resp["results"][0]["geometry"]["location"]
+    lat_lon = LatLon(first_location["lat"], first_location["lng"])
+    if cache is not None:
+        cache.put(postal_code, country, lat_lon)
+    return lat_lon
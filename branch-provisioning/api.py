@@ -1,22 +1,38 @@
-from requests import Session
-import json
+from concurrent.futures import ThreadPoolExecutor
+import os
+from requests import Session, session
+import sys
+import threading
+import time
+from typing import Iterator
+
+# shared VCO client code lives at the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
 
 from models import EdgeLicense, CommonData
+from vcoclient import portal
+from vcoclient.modules import ModuleUpdate, plan_module_update
+from vcoclient.poller import Poller
+from vcoclient.portal import PortalCall, PortalResult
+from vcoclient.codec import codec
+from vcoclient.stacks import get_edge_modules, stack_cache
+from vcoclient.transport import mount_transport
+
+
+def new_session(shared: CommonData) -> Session:
+    s = session()
+    s.headers.update({"Authorization": f"Token {shared.token}"})
+    return mount_transport(s, shared.vco)
 
 
 def do_portal(s: Session, shared: CommonData, method: str, params: dict):
-    resp = s.post(
-        f"https://{shared.vco}/portal/",
-        json={
-            "jsonrpc": "2.0",
-            "id": 1,
-            "method": method,
-            "params": params,
-        },
-    ).json()
-    if "result" not in resp:
-        raise ValueError(json.dumps(resp, indent=2))
-    return resp["result"]
+    return portal.call(s, shared.vco, method, params)
+
+
+def do_portal_batch(
+    s: Session, shared: CommonData, calls: list[PortalCall], chunk_size: int = 50
+) -> list[PortalResult]:
+    return portal.call_batch(s, shared.vco, calls, chunk_size)
 
 
 def get_async(s: Session, shared: CommonData, async_token: str):
@@ -30,21 +46,152 @@ def get_async(s: Session, shared: CommonData, async_token: str):
     )
 
 
+# async/getStatus states of an operation that has not finished yet
+ASYNC_PENDING_STATES = {"PENDING", "RUNNING", "IN_PROGRESS"}
+
+
+def get_async_statuses(
+    s: Session, shared: CommonData, async_tokens: list[str]
+) -> dict[str, PortalResult]:
+    results = do_portal_batch(
+        s,
+        shared,
+        [PortalCall("async/getStatus", {"apiToken": token}) for token in async_tokens],
+    )
+    return dict(zip(async_tokens, results))
+
+
+def async_poller(s: Session, shared: CommonData, **kwargs) -> Poller[str]:
+    # watch(token) resolves to the final async/getStatus result, every token due together
+    # shares one batch request
+    def check(async_tokens: list[str]) -> dict[str, dict | Exception]:
+        done = {}
+        for token, status in get_async_statuses(s, shared, async_tokens).items():
+            if not status.ok:
+                done[token] = ValueError(
+                    f"async/getStatus failed for {token}: {status.error}"
+                )
+            elif status.result.get("status") not in ASYNC_PENDING_STATES:
+                done[token] = status.result
+        return done
+
+    return Poller(check, **kwargs)
+
+
 def get_enterprise_edges_v1(s: Session, shared: CommonData) -> list[dict]:
     return do_portal(s, shared, "enterprise/getEnterpriseEdges", {})
 
 
+def get_edge_v1(s: Session, shared: CommonData, edge_logical_id: str) -> dict:
+    return do_portal(s, shared, "edge/getEdge", {"logicalId": edge_logical_id})
+
+
+class EdgeDirectory:
+    def __init__(self, ttl_seconds: float = 300.0):
+        self.ttl_seconds = ttl_seconds
+        self.by_logical_id: dict[str, dict] = {}
+        self.by_id: dict[int, dict] = {}
+        self.by_name: dict[str, dict] = {}
+        self.loaded_at: float | None = None
+        self.lock = threading.Lock()
+
+    def is_stale(self) -> bool:
+        return (
+            self.loaded_at is None
+            or time.monotonic() - self.loaded_at > self.ttl_seconds
+        )
+
+    def load(self, edges: list[dict]):
+        self.by_logical_id = {}
+        self.by_id = {}
+        self.by_name = {}
+        for edge in edges:
+            self.add(edge)
+        self.loaded_at = time.monotonic()
+
+    def add(self, edge: dict):
+        self.by_logical_id[edge["logicalId"]] = edge
+        self.by_id[edge["id"]] = edge
+        self.by_name[edge["name"]] = edge
+
+    def invalidate(self):
+        self.loaded_at = None
+
+
+# one directory per VCO + enterprise, shared by every caller in this module
+_edge_directories: dict[tuple[str, str], EdgeDirectory] = {}
+_edge_directories_lock = threading.Lock()
+
+
+def directory_for(shared: CommonData) -> EdgeDirectory:
+    key = (shared.vco, shared.enterprise_logical_id)
+    with _edge_directories_lock:
+        return _edge_directories.setdefault(key, EdgeDirectory())
+
+
+def edge_directory(s: Session, shared: CommonData) -> EdgeDirectory:
+    directory = directory_for(shared)
+
+    # only one caller pays for the bulk fetch, the rest wait and reuse it
+    with directory.lock:
+        if directory.is_stale():
+            directory.load(get_enterprise_edges_v1(s, shared))
+    return directory
+
+
 def find_edge(s: Session, shared: CommonData, edge_logical_id: str):
-    edges = get_enterprise_edges_v1(s, shared)
-    return next((e for e in edges if e["logicalId"] == edge_logical_id), None)
+    directory = edge_directory(s, shared)
+    edge = directory.by_logical_id.get(edge_logical_id)
+    if edge is not None:
+        return edge
 
+    # edges created after the last bulk fetch are added one at a time
+    try:
+        edge = get_edge_v1(s, shared, edge_logical_id)
+    except ValueError:
+        return None
+    with directory.lock:
+        directory.add(edge)
+    return edge
 
-def get_configuration_stack(s: Session, shared: CommonData, edge_id: int) -> list[dict]:
-    return do_portal(
-        s, shared, "edge/getEdgeConfigurationStack", params={"edgeId": edge_id}
+
+def find_edge_by_id(s: Session, shared: CommonData, edge_id: int):
+    return edge_directory(s, shared).by_id.get(edge_id)
+
+
+def find_edge_by_name(s: Session, shared: CommonData, edge_name: str):
+    return edge_directory(s, shared).by_name.get(edge_name)
+
+
+def get_configuration_stack(
+    s: Session, shared: CommonData, edge_id: int, modules: set[str] | None = None
+) -> list[dict]:
+    # with modules set, every layer only carries those modules and the rest is never decoded
+    return portal.call(
+        s,
+        shared.vco,
+        "edge/getEdgeConfigurationStack",
+        {"edgeId": edge_id},
+        stack_cache().decoder(modules),
     )
 
 
+def get_edge_configuration_modules(
+    s: Session, shared: CommonData, edge_id: int, modules: set[str]
+) -> dict:
+    # the edge's own layer with only the named modules, the profile layers are not fetched
+    result = get_edges_configuration_modules(s, shared, [edge_id], modules)[edge_id]
+    if not result.ok:
+        raise ValueError(codec().dumps(result.error, indent=True).decode())
+    return result.result[0]
+
+
+def get_edges_configuration_modules(
+    s: Session, shared: CommonData, edge_ids: list[int], modules: set[str]
+) -> dict[int, PortalResult]:
+    return get_edge_modules(s, shared.vco, edge_ids, modules)
+
+
 def update_configuration_module(
     s: Session,
     shared: CommonData,
@@ -67,6 +214,25 @@ def update_configuration_module(
     )
 
 
+def update_configuration_module_if_changed(
+    s: Session,
+    shared: CommonData,
+    module: dict,
+    new_data: dict | None,
+    new_refs: dict | None = None,
+) -> ModuleUpdate:
+    # module is the copy fetched from the VCO, it must not have been modified in place
+    plan = plan_module_update(module, new_data, new_refs)
+    if plan.changed:
+        do_portal(
+            s,
+            shared,
+            "configuration/updateConfigurationModule",
+            params={"id": plan.module_id, "_update": plan.update},
+        )
+    return plan
+
+
 def get_licenses_v1(s: Session, shared: CommonData) -> list[EdgeLicense]:
     resp = do_portal(s, shared, "license/getEnterpriseEdgeLicenses", {})
     licenses = []
@@ -87,9 +253,37 @@ def get_licenses_v1(s: Session, shared: CommonData) -> list[EdgeLicense]:
 def get_edges(s: Session, shared: CommonData, next_page_token: str | None = None):
     params = f"?nextPageLink={next_page_token}" if next_page_token is not None else ""
 
-    return s.get(
-        f"https://{shared.vco}/api/sdwan/v2/enterprises/{shared.enterprise_logical_id}/edges{params}"
-    ).json()
+    resp = portal.send(
+        s,
+        shared.vco,
+        "GET",
+        f"https://{shared.vco}/api/sdwan/v2/enterprises/{shared.enterprise_logical_id}/edges{params}",
+    )
+    return portal.decode_json(shared.vco, resp)
+
+
+def iter_edges(
+    s: Session, shared: CommonData, fields: list[str] | None = None
+) -> Iterator[dict]:
+    # at most two pages are held at once: the one being consumed and the one being prefetched
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        pending = executor.submit(get_edges, s, shared)
+        while pending is not None:
+            page = pending.result()
+            meta = page.get("metaData", {})
+            next_page_token = meta.get("nextPageLink") if meta.get("more") else None
+            pending = (
+                executor.submit(get_edges, s, shared, next_page_token)
+                if next_page_token
+                else None
+            )
+
+            for edge in page.get("data", []):
+                if fields is None:
+                    yield edge
+                else:
+                    yield {f: edge.get(f) for f in fields}
+            del page
 
 
 def post_edge(
@@ -99,8 +293,13 @@ def post_edge(
     profile_logical_id: str,
     extras: dict,
 ):
-    post_edge_resp = s.post(
+    # a 5xx may still have created the edge, so only throttled posts are retried
+    post_edge_resp = portal.send(
+        s,
+        shared.vco,
+        "POST",
         f"https://{shared.vco}/api/sdwan/v2/enterprises/{shared.enterprise_logical_id}/edges",
+        retry_server_errors=False,
         json={
             "modelNumber": model_name,
             "profile": profile_logical_id,
@@ -108,6 +307,6 @@ def post_edge(
         },
     )
 
-    post_edge_resp_json = post_edge_resp.json()
+    post_edge_resp_json = portal.decode_json(shared.vco, post_edge_resp)
 
     return post_edge_resp_json
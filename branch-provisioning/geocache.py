@@ -0,0 +1,165 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import csv
+import dotenv
+import os
+import sqlite3
+import sys
+import threading
+import time
+from typing import Iterable
+
+from models import LatLon
+from util import calculate_lat_lon
+
+
+def normalize_key(postal_code: str, country: str) -> tuple[str, str]:
+    return ("".join(postal_code.split()).upper(), country.strip().upper())
+
+
+class GeocodeCache:
+    # in-process LRU in front of a SQLite file so lookups are reused across runs
+    def __init__(
+        self,
+        path: str = "geocode_cache.sqlite3",
+        ttl_seconds: float = 90 * 24 * 60 * 60,
+        max_entries: int = 100_000,
+        lru_size: int = 4096,
+        evict_every: int = 256,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.lru_size = lru_size
+        # eviction counts the table, so it runs once per evict_every puts rather than on each one
+        # and the file can hold up to that many rows beyond max_entries in between
+        self.evict_every = evict_every
+        self.puts_since_evict = 0
+        self.lru: OrderedDict[tuple[str, str], tuple[LatLon, float]] = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS geocode (
+                postal_code TEXT NOT NULL,
+                country TEXT NOT NULL,
+                lat REAL NOT NULL,
+                lon REAL NOT NULL,
+                stored_at REAL NOT NULL,
+                PRIMARY KEY (postal_code, country)
+            )
+            """)
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS geocode_stored_at ON geocode (stored_at)"
+        )
+        self.db.commit()
+
+    def _remember(self, key: tuple[str, str], lat_lon: LatLon, stored_at: float):
+        self.lru[key] = (lat_lon, stored_at)
+        self.lru.move_to_end(key)
+        while len(self.lru) > self.lru_size:
+            self.lru.popitem(last=False)
+
+    def get(self, postal_code: str, country: str) -> LatLon | None:
+        key = normalize_key(postal_code, country)
+        expired_before = time.time() - self.ttl_seconds
+        with self.lock:
+            hit = self.lru.get(key)
+            if hit is not None:
+                if hit[1] >= expired_before:
+                    self.lru.move_to_end(key)
+                    return hit[0]
+                del self.lru[key]
+
+            row = self.db.execute(
+                "SELECT lat, lon, stored_at FROM geocode WHERE postal_code = ? AND country = ?",
+                key,
+            ).fetchone()
+            if row is None or row[2] < expired_before:
+                return None
+
+            lat_lon = LatLon(row[0], row[1])
+            self._remember(key, lat_lon, row[2])
+            return lat_lon
+
+    def put(self, postal_code: str, country: str, lat_lon: LatLon):
+        key = normalize_key(postal_code, country)
+        stored_at = time.time()
+        with self.lock:
+            self._remember(key, lat_lon, stored_at)
+            self.db.execute(
+                "INSERT OR REPLACE INTO geocode VALUES (?, ?, ?, ?, ?)",
+                (*key, lat_lon.lat, lat_lon.lon, stored_at),
+            )
+            self.puts_since_evict += 1
+            if self.puts_since_evict >= self.evict_every:
+                self._evict()
+            self.db.commit()
+
+    def _evict(self):
+        # drop expired rows, then the oldest rows beyond max_entries
+        self.puts_since_evict = 0
+        self.db.execute(
+            "DELETE FROM geocode WHERE stored_at < ?", (time.time() - self.ttl_seconds,)
+        )
+        (count,) = self.db.execute("SELECT COUNT(*) FROM geocode").fetchone()
+        if count > self.max_entries:
+            self.db.execute(
+                "DELETE FROM geocode WHERE rowid IN (SELECT rowid FROM geocode ORDER BY stored_at LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+_default_cache: GeocodeCache | None = None
+_default_cache_lock = threading.Lock()
+
+
+def default_cache() -> GeocodeCache:
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = GeocodeCache(
+                os.getenv("GEOCODE_CACHE_PATH", "geocode_cache.sqlite3")
+            )
+        return _default_cache
+
+
+def prewarm(
+    cache: GeocodeCache,
+    gmaps_api_key: str,
+    locations: Iterable[tuple[str, str]],
+    max_workers: int = 8,
+) -> dict[tuple[str, str], LatLon | Exception]:
+    # resolves every distinct (postal_code, country) that is not cached yet
+    unique = {normalize_key(pc, c): (pc, c) for pc, c in locations}
+    missing = [loc for loc in unique.values() if cache.get(*loc) is None]
+
+    def resolve(loc: tuple[str, str]) -> LatLon | Exception:
+        try:
+            return calculate_lat_lon(gmaps_api_key, *loc, cache=cache)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(missing, executor.map(resolve, missing)))
+
+
+if __name__ == "__main__":
+    # usage: geocache.py <branches.csv>, the file needs postal_code and country columns
+    dotenv.load_dotenv(".env")
+    gmaps_api_key = os.getenv("GOOGLE_MAPS_API_KEY")
+    assert gmaps_api_key is not None, "missing environment var GOOGLE_MAPS_API_KEY"
+
+    with open(sys.argv[1], newline="") as fp:
+        locations = [(row["postal_code"], row["country"]) for row in csv.DictReader(fp)]
+
+    results = prewarm(default_cache(), gmaps_api_key, locations)
+    failed = {k: v for k, v in results.items() if isinstance(v, Exception)}
+    print(
+        f"resolved {len(results) - len(failed)} new location(s), {len(failed)} failed"
+    )
+    for (postal_code, country), e in failed.items():
+        print(f"- {postal_code}, {country}: {type(e).__name__}: {e}")
@@ -0,0 +1,375 @@
+import csv
+from dataclasses import dataclass
+from ipaddress import IPv4Address, IPv4Network
+from typing import TYPE_CHECKING, Iterator, cast
+
+import numpy as np
+import pandas as pd
+
+# pyarrow is optional, it is only needed for Parquet input
+if TYPE_CHECKING:
+    import pyarrow.parquet as pq
+else:
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        pq = None
+
+from models import BranchData, WanData
+
+# one branch per row, corporate_nets is a semicolon separated list
+BRANCH_COLUMNS = [
+    "name",
+    "country",
+    "postal_code",
+    "contact_name",
+    "contact_email",
+    "transit_net",
+    "corporate_nets",
+    "byod_net",
+    "guest_net",
+    *[
+        f"wan{i}_{field}"
+        for i in (1, 2)
+        for field in (
+            "name",
+            "network",
+            "local",
+            "gateway",
+            "upstream_mbps",
+            "downstream_mbps",
+        )
+    ],
+]
+
+
+# columnar loading for large waves, CSV or Parquet
+# each chunk is validated column by column on integer arrays, BranchData objects are only built
+# for rows that are handed to the provisioner
+
+NETWORK_COLUMNS = [
+    "transit_net",
+    "byod_net",
+    "guest_net",
+    "wan1_network",
+    "wan2_network",
+]
+BANDWIDTH_COLUMNS = [
+    f"wan{i}_{d}_mbps" for i in (1, 2) for d in ("upstream", "downstream")
+]
+
+
+@dataclass
+class InvalidValue:
+    # 1-based data row, the header is not counted
+    row: int
+    column: str
+    value: str
+    reason: str
+
+
+class BranchInputError(ValueError):
+    def __init__(self, path: str, invalid: list[InvalidValue], shown: int = 50):
+        self.path = path
+        self.invalid = invalid
+        rows = len({v.row for v in invalid})
+        lines = [f"{path}: {len(invalid)} invalid value(s) in {rows} row(s)"]
+        lines += [
+            f"- row {v.row} {v.column}={v.value!r}: {v.reason}" for v in invalid[:shown]
+        ]
+        if len(invalid) > shown:
+            lines.append(f"- ... and {len(invalid) - shown} more")
+        super().__init__("\n".join(lines))
+
+
+def parse_ipv4(
+    values: pd.Series, with_prefix: bool = False
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # dotted quads, optionally with /prefix, parsed for every row at once
+    # the strings become a (rows, width) byte matrix which is scanned one character column at a time
+    # returns (address uint32, prefix int8, valid bool), with the same rules as the ipaddress module
+    width = 18 if with_prefix else 15
+    strings = values.astype(str).str.strip()
+    fits = (strings.str.len() <= width).to_numpy(dtype=bool)
+    raw = strings.str.encode("ascii", errors="replace").where(fits, b"")
+    chars = (
+        np.array(raw.tolist(), dtype=f"S{width}")
+        .view(np.uint8)
+        .reshape(len(strings), width)
+    )
+    chars = np.hstack([chars, np.zeros((len(strings), 1), dtype=np.uint8)])
+
+    n = len(strings)
+    valid = fits.copy()
+    address = np.zeros(n, dtype=np.int64)
+    prefix = np.full(n, 32, dtype=np.int64)
+    part = np.zeros(n, dtype=np.int64)
+    digits = np.zeros(n, dtype=np.int64)
+    leading_zero = np.zeros(n, dtype=bool)
+    octets = np.zeros(n, dtype=np.int64)
+    in_prefix = np.zeros(n, dtype=bool)
+    done = np.zeros(n, dtype=bool)
+
+    for j in range(width + 1):
+        c = chars[:, j]
+        active = valid & ~done
+        is_digit = active & (c >= 48) & (c <= 57)
+        is_dot = active & (c == 46) & ~in_prefix
+        is_slash = active & (c == 47) & ~in_prefix & with_prefix
+        is_end = active & (c == 0)
+        valid &= ~(active & ~(is_digit | is_dot | is_slash | is_end))
+
+        # 010 is rejected like ipaddress does, a part has at most 3 digits
+        valid &= ~(is_digit & ((digits >= 3) | leading_zero))
+        leading_zero = np.where(is_digit, (digits == 0) & (c == 48), leading_zero)
+        part = np.where(is_digit, part * 10 + (c.astype(np.int64) - 48), part)
+        digits = np.where(is_digit, digits + 1, digits)
+
+        closes_octet = (is_dot | is_slash | (is_end & ~in_prefix)) & valid
+        valid &= ~(closes_octet & ((digits == 0) | (part > 255)))
+        valid &= ~(is_dot & (octets >= 3))
+        valid &= ~((is_slash | (is_end & ~in_prefix)) & (octets != 3))
+        address = np.where(closes_octet, address * 256 + part, address)
+        octets = np.where(closes_octet, octets + 1, octets)
+
+        closes_prefix = is_end & in_prefix
+        valid &= ~(closes_prefix & ((digits == 0) | (part > 32)))
+        prefix = np.where(closes_prefix, part, prefix)
+
+        resets = is_dot | is_slash
+        part = np.where(resets, 0, part)
+        digits = np.where(resets, 0, digits)
+        leading_zero = np.where(resets, False, leading_zero)
+        in_prefix |= is_slash
+        done |= is_end
+
+    valid &= done
+    return address.astype(np.uint32), prefix.astype(np.int8), valid
+
+
+def netmask(prefix: np.ndarray) -> np.ndarray:
+    return ((0xFFFFFFFF << (32 - prefix.astype(np.int64))) & 0xFFFFFFFF).astype(
+        np.uint32
+    )
+
+
+class BranchColumns:
+    # one validated chunk: parsed integer columns plus every invalid value found in it
+    def __init__(self, df: pd.DataFrame, first_row: int):
+        self.df = df.reset_index(drop=True)
+        self.rows = np.arange(first_row, first_row + len(df))
+        self.invalid: list[InvalidValue] = []
+        self.bad = np.zeros(len(df), dtype=bool)
+        self.networks: dict[str, tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+        self.addresses: dict[str, np.ndarray] = {}
+        self.bandwidth: dict[str, np.ndarray] = {}
+
+        for column in ("name", "country", "postal_code"):
+            self.flag(column, self.text(column) == "", "required")
+        for column in NETWORK_COLUMNS:
+            self.networks[column] = self.parse_networks(self.column(column), column)
+        for i in (1, 2):
+            net, prefix, net_ok = self.networks[f"wan{i}_network"]
+            mask = netmask(prefix)
+            for field in ("local", "gateway"):
+                column = f"wan{i}_{field}"
+                address, _, ok = parse_ipv4(self.column(column))
+                self.flag(column, ~ok, "not an IPv4 address")
+                self.flag(
+                    column,
+                    ok & net_ok & ((address & mask) != net),
+                    f"outside wan{i}_network",
+                )
+                self.addresses[column] = address
+            self.flag(
+                f"wan{i}_gateway",
+                self.addresses[f"wan{i}_local"] == self.addresses[f"wan{i}_gateway"],
+                f"same as wan{i}_local",
+            )
+        for column in BANDWIDTH_COLUMNS:
+            numeric = cast(
+                pd.Series, pd.to_numeric(self.column(column), errors="coerce")
+            )
+            mbps = numeric.to_numpy(dtype="float64")
+            self.flag(
+                column, ~(np.isfinite(mbps) & (mbps > 0)), "not a positive number"
+            )
+            self.bandwidth[column] = mbps
+
+        # corporate_nets holds any number of networks, they are parsed as one exploded column
+        corporate = self.text("corporate_nets").str.split(";").explode().str.strip()
+        corporate = corporate[corporate != ""]
+        self.corporate_row = corporate.index.to_numpy(dtype=np.int64)
+        self.corporate = self.parse_networks(
+            corporate, "corporate_nets", self.corporate_row
+        )
+
+    def column(self, column: str) -> pd.Series:
+        return cast(pd.Series, self.df[column])
+
+    def text(self, column: str) -> pd.Series:
+        return self.column(column).fillna("").astype(str).str.strip()
+
+    def flag(
+        self,
+        column: str,
+        mask: np.ndarray,
+        reason: str,
+        positions: np.ndarray | None = None,
+        values: pd.Series | None = None,
+    ):
+        hits = np.flatnonzero(mask)
+        if len(hits) == 0:
+            return
+        rows = hits if positions is None else positions[hits]
+        values = self.column(column) if values is None else values
+        self.bad[rows] = True
+        for hit, row in zip(hits, rows):
+            self.invalid.append(
+                InvalidValue(int(self.rows[row]), column, str(values.iloc[hit]), reason)
+            )
+
+    def parse_networks(
+        self, values: pd.Series, column: str, positions: np.ndarray | None = None
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        address, prefix, ok = parse_ipv4(values, with_prefix=True)
+        self.flag(column, ~ok, "not an IPv4 network", positions, values)
+        host_bits = ok & ((address & ~netmask(prefix)) != 0)
+        self.flag(column, host_bits, "host bits set", positions, values)
+        return address, prefix, ok & ~host_bits
+
+    def branches(self) -> Iterator[BranchData]:
+        # rows with any invalid value are skipped, callers check invalid first
+        def network(column: str, i: int) -> IPv4Network:
+            address, prefix, _ = self.networks[column]
+            return IPv4Network((int(address[i]), int(prefix[i])))
+
+        def wan(k: int, i: int) -> WanData:
+            return WanData(
+                text[f"wan{k}_name"][i],
+                network(f"wan{k}_network", i),
+                IPv4Address(int(self.addresses[f"wan{k}_local"][i])),
+                IPv4Address(int(self.addresses[f"wan{k}_gateway"][i])),
+                float(self.bandwidth[f"wan{k}_upstream_mbps"][i]),
+                float(self.bandwidth[f"wan{k}_downstream_mbps"][i]),
+                bool(standby[k][i]),
+            )
+
+        corporate_starts = np.searchsorted(
+            self.corporate_row, np.arange(len(self.df) + 1)
+        )
+        corporate_address, corporate_prefix, _ = self.corporate
+        standby = {
+            i: (
+                self.text(f"wan{i}_standby")
+                .str.lower()
+                .isin(["1", "true", "yes"])
+                .to_numpy()
+                if f"wan{i}_standby" in self.df
+                else np.zeros(len(self.df), dtype=bool)
+            )
+            for i in (1, 2)
+        }
+        text = {
+            c: self.text(c).tolist()
+            for c in (
+                "name",
+                "country",
+                "postal_code",
+                "contact_name",
+                "contact_email",
+                "wan1_name",
+                "wan2_name",
+            )
+        }
+
+        for i in np.flatnonzero(~self.bad).tolist():
+            yield BranchData(
+                text["name"][i],
+                text["country"][i],
+                text["postal_code"][i],
+                text["contact_name"][i],
+                text["contact_email"][i],
+                network("transit_net", i),
+                [
+                    IPv4Network((int(corporate_address[j]), int(corporate_prefix[j])))
+                    for j in range(corporate_starts[i], corporate_starts[i + 1])
+                ],
+                network("byod_net", i),
+                network("guest_net", i),
+                (wan(1, i), wan(2, i)),
+            )
+
+
+def read_branch_frames(
+    path: str, chunksize: int = 5000, columns: list[str] | None = None
+) -> Iterator[pd.DataFrame]:
+    # everything is read as text so postal codes keep their leading zeros
+    if path.endswith(".parquet"):
+        if pq is None:
+            raise ImportError("reading Parquet branch input needs pyarrow")
+        parquet = pq.ParquetFile(path)
+        missing = set(columns or BRANCH_COLUMNS) - set(parquet.schema_arrow.names)
+        if missing:
+            raise ValueError(f"{path}: missing column(s) {', '.join(sorted(missing))}")
+        for batch in parquet.iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas().fillna("").astype(str)
+        return
+
+    with open(path, newline="") as fp:
+        header = next(csv.reader(fp), [])
+    missing = set(columns or BRANCH_COLUMNS) - set(header)
+    if missing:
+        raise ValueError(f"{path}: missing column(s) {', '.join(sorted(missing))}")
+    yield from pd.read_csv(
+        path, dtype=str, keep_default_na=False, chunksize=chunksize, usecols=columns
+    )
+
+
+def validate_branches(path: str, chunksize: int = 5000) -> list[InvalidValue]:
+    # a full pass over the file which keeps only the invalid values, one chunk in memory at a time
+    invalid: list[InvalidValue] = []
+    names: dict[str, int] = {}
+    first_row = 1
+    for df in read_branch_frames(path, chunksize):
+        chunk = BranchColumns(df, first_row)
+        invalid += chunk.invalid
+        # edge names must be unique in the enterprise, duplicates are caught across chunks
+        for row, name in zip(chunk.rows, chunk.text("name")):
+            if name and names.setdefault(name, int(row)) != row:
+                invalid.append(
+                    InvalidValue(
+                        int(row), "name", name, f"duplicate of row {names[name]}"
+                    )
+                )
+        first_row += len(df)
+    invalid.sort(key=lambda v: v.row)
+    return invalid
+
+
+def iter_branches(path: str, chunksize: int = 5000) -> Iterator[BranchData]:
+    first_row = 1
+    for df in read_branch_frames(path, chunksize):
+        chunk = BranchColumns(df, first_row)
+        if chunk.invalid:
+            raise BranchInputError(path, chunk.invalid)
+        yield from chunk.branches()
+        first_row += len(df)
+
+
+def read_branches(path: str, chunksize: int = 5000) -> Iterator[BranchData]:
+    # every row is checked before the first branch is returned, so a wave never starts half valid
+    # and all invalid values are reported together, BranchData is then built lazily chunk by chunk
+    invalid = validate_branches(path, chunksize)
+    if invalid:
+        raise BranchInputError(path, invalid)
+    return iter_branches(path, chunksize)
+
+
+def read_locations(path: str) -> list[tuple[str, str]]:
+    # the (postal_code, country) pairs needed to prewarm the geocoding cache, without the other columns
+    locations = {}
+    for df in read_branch_frames(path, columns=["postal_code", "country"]):
+        pairs = zip(df["postal_code"].str.strip(), df["country"].str.strip())
+        locations.update(dict.fromkeys(pairs))
+    return list(locations)
@@ -1,14 +1,40 @@
+import asyncio
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 import dotenv
+from functools import lru_cache
+import httpx
+import itertools
 import jsonpatch
 from ipaddress import ip_address, ip_network, IPv4Network, IPv4Address
 import os
-from requests import Session, session
-from typing import Optional, cast
+from requests import Session
+import sys
+import threading
+import time
+from typing import Iterable, Optional, cast
 import uuid
 
 from api import *
-from models import BranchData, CommonData, WanData
-from util import calculate_lat_lon, extract_module, ipv4_address, ipv4_network
+import aio_api
+from geocache import default_cache, prewarm
+from inputs import iter_branches, read_branches, read_locations
+from subnets import preflight
+from models import BranchData, CommonData, LatLon, ProvisionResult, WanData
+from templates import PatchTemplate, Slot, copy_json
+from util import (
+    calculate_lat_lon,
+    extract_module,
+    ipv4_address,
+    ipv4_network,
+    routed_interface_indexes,
+)
+from vcoclient.aio import AsyncVcoClient
+from vcoclient.codec import set_codec
+from vcoclient.metrics import recorder
+from vcoclient.poller import Poller
+from vcoclient.ratelimit import limiter_for, set_rate_limit
+from vcoclient.simulator import VcoSimulator, config_from_env, install_simulator
+from vcoclient.stacks import stack_cache
 
 
 def generate_wan_overlay(wan_data: tuple[WanData, WanData]):
@@ -61,33 +87,45 @@ def generate_wan_overlay(wan_data: tuple[WanData, WanData]):
     return val
 
 
-def build_static_routes_patch(branch: BranchData) -> list[dict]:
-    return [
+def static_route(branch: BranchData, n: IPv4Network) -> dict:
+    return {
+        "advertise": True,
+        "cidrPrefix": str(n.prefixlen),
+        "cost": 0,
+        "description": "",
+        "destination": str(n.network_address),
+        "gateway": str(branch.transit_net[2]),
+        "icmpProbeLogicalId": None,
+        "netmask": str(n.netmask),
+        "preferred": True,
+        "sourceIp": None,
+        "subinterfaceId": -1,
+        "vlanId": None,
+        "wanInterface": "GE2",
+    }
+
+
+STATIC_ROUTE_TEMPLATE = PatchTemplate(
+    [
         {
             "op": "add",
             "path": "/segments/0/routes/static/-",
-            "value": {
-                "advertise": True,
-                "cidrPrefix": str(n.prefixlen),
-                "cost": 0,
-                "description": "",
-                "destination": str(n.network_address),
-                "gateway": str(branch.transit_net[2]),
-                "icmpProbeLogicalId": None,
-                "netmask": str(n.netmask),
-                "preferred": True,
-                "sourceIp": None,
-                "subinterfaceId": -1,
-                "vlanId": None,
-                "wanInterface": "GE2",
-            },
+            "value": Slot("route"),
         }
-        for n in branch.corporate_nets
     ]
+)
 
 
-def build_vlan_999_patch() -> list[dict]:
+def build_static_routes_patch(branch: BranchData) -> list[dict]:
     return [
+        op
+        for n in branch.corporate_nets
+        for op in STATIC_ROUTE_TEMPLATE.render({"route": static_route(branch, n)})
+    ]
+
+
+VLAN_999_TEMPLATE = PatchTemplate(
+    [
         {
             "op": "add",
             "path": "/lan/networks/0/cidrIp",
@@ -104,132 +142,177 @@ def build_vlan_999_patch() -> list[dict]:
             "value": "32",
         },
     ]
+)
 
 
-def build_wan_patch(wan: WanData, interface_name: str, current_ds: dict) -> list[dict]:
-    interface_index = next(
-        (
-            i
-            for i, e in enumerate(current_ds["routedInterfaces"])
-            if e["name"] == interface_name
-        ),
-        None,
-    )
+def build_vlan_999_patch() -> list[dict]:
+    return VLAN_999_TEMPLATE.render({})
+
 
+def find_interface_index(interface_indexes: dict[str, int], interface_name: str) -> int:
+    interface_index = interface_indexes.get(interface_name)
     if interface_index is None:
         raise ValueError(f"{interface_name} was not found in routedInterfaces")
-
-    return [
-        {
-            "op": "add",
-            "path": f"/routedInterfaces/{interface_index}/addressing/cidrIp",
-            "value": str(wan.local),
-        },
-        {
-            "op": "add",
-            "path": f"/routedInterfaces/{interface_index}/addressing/cidrPrefix",
-            "value": wan.network.prefixlen,
-        },
-        {
-            "op": "add",
-            "path": f"/routedInterfaces/{interface_index}/addressing/netmask",
-            "value": str(wan.network.netmask),
-        },
-        {
-            "op": "add",
-            "path": f"/routedInterfaces/{interface_index}/addressing/gateway",
-            "value": str(wan.gateway),
-        },
-        {
-            "op": "replace",
-            "path": f"/routedInterfaces/{interface_index}/l2/probeInterval",
-            "value": "5",
-        },
-        {
-            "op": "add",
-            "path": f"/routedInterfaces/{interface_index}/l2/losDetection",
-            "value": False,
-        },
-        {
-            "op": "add",
-            "path": f"/routedInterfaces/{interface_index}/override",
-            "value": True,
-        },
-    ]
+    return interface_index
 
 
-def build_ge2_patch(branch: BranchData, current_ds: dict) -> list[dict]:
-    ge2_index = next(
-        (i for i, e in enumerate(current_ds["routedInterfaces"]) if e["name"] == "GE2"),
-        None,
+@lru_cache(maxsize=None)
+def wan_template(interface_index: int) -> PatchTemplate:
+    return PatchTemplate(
+        [
+            {
+                "op": "add",
+                "path": f"/routedInterfaces/{interface_index}/addressing/cidrIp",
+                "value": Slot("local"),
+            },
+            {
+                "op": "add",
+                "path": f"/routedInterfaces/{interface_index}/addressing/cidrPrefix",
+                "value": Slot("prefixlen"),
+            },
+            {
+                "op": "add",
+                "path": f"/routedInterfaces/{interface_index}/addressing/netmask",
+                "value": Slot("netmask"),
+            },
+            {
+                "op": "add",
+                "path": f"/routedInterfaces/{interface_index}/addressing/gateway",
+                "value": Slot("gateway"),
+            },
+            {
+                "op": "replace",
+                "path": f"/routedInterfaces/{interface_index}/l2/probeInterval",
+                "value": "5",
+            },
+            {
+                "op": "add",
+                "path": f"/routedInterfaces/{interface_index}/l2/losDetection",
+                "value": False,
+            },
+            {
+                "op": "add",
+                "path": f"/routedInterfaces/{interface_index}/override",
+                "value": True,
+            },
+        ]
     )
+
+
+def wan_values(wan: WanData) -> dict:
+    return {
+        "local": str(wan.local),
+        "prefixlen": wan.network.prefixlen,
+        "netmask": str(wan.network.netmask),
+        "gateway": str(wan.gateway),
+    }
+
+
+def build_wan_patch(
+    wan: WanData,
+    interface_name: str,
+    current_ds: dict,
+    interface_indexes: dict[str, int] | None = None,
+) -> list[dict]:
+    if interface_indexes is None:
+        interface_indexes = routed_interface_indexes(current_ds)
+    interface_index = find_interface_index(interface_indexes, interface_name)
+    return wan_template(interface_index).render(wan_values(wan))
+
+
+@lru_cache(maxsize=None)
+def ge2_template(ge2_index: int) -> PatchTemplate:
     ge2_11_index = 0
     ge2_12_index = 1
 
-    if ge2_index is None:
-        raise ValueError("GE2 was not found in routedInterfaces")
+    return PatchTemplate(
+        [
+            {
+                "op": "add",
+                "path": f"/routedInterfaces/{ge2_index}/addressing/cidrIp",
+                "value": Slot("transit_ip"),
+            },
+            {
+                "op": "add",
+                "path": f"/routedInterfaces/{ge2_index}/addressing/cidrPrefix",
+                "value": Slot("transit_prefixlen"),
+            },
+            {
+                "op": "add",
+                "path": f"/routedInterfaces/{ge2_index}/addressing/netmask",
+                "value": Slot("transit_netmask"),
+            },
+            {
+                "op": "add",
+                "path": f"/routedInterfaces/{ge2_index}/subinterfaces/{ge2_11_index}/addressing/cidrIp",
+                "value": Slot("byod_ip"),
+            },
+            {
+                "op": "add",
+                "path": f"/routedInterfaces/{ge2_index}/subinterfaces/{ge2_11_index}/addressing/cidrPrefix",
+                "value": Slot("byod_prefixlen"),
+            },
+            {
+                "op": "add",
+                "path": f"/routedInterfaces/{ge2_index}/subinterfaces/{ge2_11_index}/addressing/netmask",
+                "value": Slot("byod_netmask"),
+            },
+            {
+                "op": "add",
+                "path": f"/routedInterfaces/{ge2_index}/subinterfaces/{ge2_12_index}/addressing/cidrIp",
+                "value": Slot("guest_ip"),
+            },
+            {
+                "op": "add",
+                "path": f"/routedInterfaces/{ge2_index}/subinterfaces/{ge2_12_index}/addressing/cidrPrefix",
+                "value": Slot("guest_prefixlen"),
+            },
+            {
+                "op": "add",
+                "path": f"/routedInterfaces/{ge2_index}/subinterfaces/{ge2_12_index}/addressing/netmask",
+                "value": Slot("guest_netmask"),
+            },
+            {
+                "op": "replace",
+                "path": f"/routedInterfaces/{ge2_index}/l2/probeInterval",
+                "value": "3",
+            },
+            {
+                "op": "move",
+                "from": f"/routedInterfaces/{ge2_index}",
+                "path": "/routedInterfaces/0",
+            },
+            {
+                "op": "remove",
+                "path": "/routedInterfaces/0/cellular",
+            },
+        ]
+    )
 
-    return [
-        {
-            "op": "add",
-            "path": f"/routedInterfaces/{ge2_index}/addressing/cidrIp",
-            "value": str(branch.transit_net[1]),
-        },
-        {
-            "op": "add",
-            "path": f"/routedInterfaces/{ge2_index}/addressing/cidrPrefix",
-            "value": branch.transit_net.prefixlen,
-        },
-        {
-            "op": "add",
-            "path": f"/routedInterfaces/{ge2_index}/addressing/netmask",
-            "value": str(branch.transit_net.netmask),
-        },
-        {
-            "op": "add",
-            "path": f"/routedInterfaces/{ge2_index}/subinterfaces/{ge2_11_index}/addressing/cidrIp",
-            "value": str(branch.byod_net[1]),
-        },
-        {
-            "op": "add",
-            "path": f"/routedInterfaces/{ge2_index}/subinterfaces/{ge2_11_index}/addressing/cidrPrefix",
-            "value": branch.byod_net.prefixlen,
-        },
-        {
-            "op": "add",
-            "path": f"/routedInterfaces/{ge2_index}/subinterfaces/{ge2_11_index}/addressing/netmask",
-            "value": str(branch.byod_net.netmask),
-        },
-        {
-            "op": "add",
-            "path": f"/routedInterfaces/{ge2_index}/subinterfaces/{ge2_12_index}/addressing/cidrIp",
-            "value": str(branch.guest_net[1]),
-        },
-        {
-            "op": "add",
-            "path": f"/routedInterfaces/{ge2_index}/subinterfaces/{ge2_12_index}/addressing/cidrPrefix",
-            "value": branch.guest_net.prefixlen,
-        },
-        {
-            "op": "add",
-            "path": f"/routedInterfaces/{ge2_index}/subinterfaces/{ge2_12_index}/addressing/netmask",
-            "value": str(branch.guest_net.netmask),
-        },
-        {
-            "op": "replace",
-            "path": f"/routedInterfaces/{ge2_index}/l2/probeInterval",
-            "value": "3",
-        },
-        {
-            "op": "move",
-            "from": f"/routedInterfaces/{ge2_index}",
-            "path": "/routedInterfaces/0",
-        },
-        {
-            "op": "remove",
-            "path": "/routedInterfaces/0/cellular",
-        },
-    ]
+
+def ge2_values(branch: BranchData) -> dict:
+    return {
+        "transit_ip": str(branch.transit_net[1]),
+        "transit_prefixlen": branch.transit_net.prefixlen,
+        "transit_netmask": str(branch.transit_net.netmask),
+        "byod_ip": str(branch.byod_net[1]),
+        "byod_prefixlen": branch.byod_net.prefixlen,
+        "byod_netmask": str(branch.byod_net.netmask),
+        "guest_ip": str(branch.guest_net[1]),
+        "guest_prefixlen": branch.guest_net.prefixlen,
+        "guest_netmask": str(branch.guest_net.netmask),
+    }
+
+
+def build_ge2_patch(
+    branch: BranchData,
+    current_ds: dict,
+    interface_indexes: dict[str, int] | None = None,
+) -> list[dict]:
+    if interface_indexes is None:
+        interface_indexes = routed_interface_indexes(current_ds)
+    ge2_index = find_interface_index(interface_indexes, "GE2")
+    return ge2_template(ge2_index).render(ge2_values(branch))
 
 
 # pre-provisioning of ZS is limited
@@ -315,9 +398,80 @@ def build_zscaler_refs_patch(branch_data: BranchData) -> list[dict]:
     ]
 
 
-def provision_branch(s: Session, shared: CommonData, branch: BranchData):
+def build_edge_extras(shared: CommonData, branch: BranchData, lat_lon: LatLon) -> dict:
+    return {
+        "name": branch.name,
+        "license": shared.branch_license_logical_id,
+        "haEnabled": True,
+        "site": {
+            "lat": lat_lon.lat,
+            "lon": lat_lon.lon,
+            "contactName": branch.contact_name,
+            "contactEmail": branch.contact_email,
+        },
+    }
+
+
+# the only configuration modules provisioning reads, only these are fetched from the edge's own layer
+PROVISIONED_MODULES = {"deviceSettings", "WAN"}
+
+
+class DeviceSettingsPatch:
+    # the compiled templates for one branch, in the same order as the original patch list
+    def __init__(self, branch: BranchData, current_ds: dict):
+        interface_indexes = routed_interface_indexes(current_ds)
+        self.steps: list[tuple[PatchTemplate, dict]] = [
+            (STATIC_ROUTE_TEMPLATE, {"route": static_route(branch, n)})
+            for n in branch.corporate_nets
+        ]
+        self.steps.extend(
+            [
+                (VLAN_999_TEMPLATE, {}),
+                (
+                    wan_template(find_interface_index(interface_indexes, "GE3")),
+                    wan_values(branch.wans[0]),
+                ),
+                (
+                    wan_template(find_interface_index(interface_indexes, "GE4")),
+                    wan_values(branch.wans[1]),
+                ),
+                (
+                    ge2_template(find_interface_index(interface_indexes, "GE2")),
+                    ge2_values(branch),
+                ),
+            ]
+        )
+
+    @property
+    def patch(self) -> list[dict]:
+        return [op for template, values in self.steps for op in template.render(values)]
+
+    def apply(self, doc: dict, in_place: bool = False) -> dict:
+        if not in_place:
+            doc = copy_json(doc)
+        for template, values in self.steps:
+            template.apply(doc, values)
+        return doc
+
+
+def build_device_settings_patch(
+    branch: BranchData, current_ds: dict
+) -> DeviceSettingsPatch:
+    return DeviceSettingsPatch(branch, current_ds)
+
+
+def provision_branch(
+    s: Session,
+    shared: CommonData,
+    branch: BranchData,
+    result: ProvisionResult | None = None,
+) -> int:
+    # result, when given, gets the edge's ids as soon as they are known, even if a later step fails
     lat_lon = calculate_lat_lon(
-        shared.google_maps_api_key, branch.postal_code, branch.country
+        shared.google_maps_api_key,
+        branch.postal_code,
+        branch.country,
+        cache=default_cache(),
     )
     if lat_lon is None:
         raise LookupError("failed to retrieve lat/lon")
@@ -327,107 +481,353 @@ def provision_branch(s: Session, shared: CommonData, branch: BranchData):
         shared,
         "edge6X0",
         shared.branch_profile_logical_id,
-        extras={
-            "name": branch.name,
-            "license": shared.branch_license_logical_id,
-            "haEnabled": True,
-            "site": {
-                "lat": lat_lon.lat,
-                "lon": lat_lon.lon,
-                "contactName": branch.contact_name,
-                "contactEmail": branch.contact_email,
-            },
-        },
+        extras=build_edge_extras(shared, branch, lat_lon),
     )
 
     edge_url = post_resp["_href"]
     edge_url = f"https://{shared.vco}{edge_url}"
     edge_logical_id = post_resp["logicalId"]
+    if result is not None:
+        result.edge_logical_id = edge_logical_id
+
+    # use edge logical ID to get edge ID using APIv1
+    edge_info_v1 = find_edge(s, shared, edge_logical_id)
+    if edge_info_v1 is None:
+        raise RuntimeError("could not find v1 info for new edge")
+    edge_id = edge_info_v1["id"]
+    if result is not None:
+        result.edge_id = edge_id
+
+    edge_specific_config = get_edge_configuration_modules(
+        s, shared, edge_id, PROVISIONED_MODULES
+    )
 
-    try:
-        # use edge logical ID to get edge ID using APIv1
-        edge_info_v1 = find_edge(s, shared, edge_logical_id)
-        if edge_info_v1 is None:
-            raise RuntimeError("could not find v1 info for new edge")
-        edge_id = edge_info_v1["id"]
-
-        edge_config_stack = get_configuration_stack(s, shared, edge_id)
-        edge_specific_config = edge_config_stack[0]
-
-        edge_ds = extract_module(edge_specific_config["modules"], "deviceSettings")
-        if edge_ds is None:
-            raise LookupError("could not find deviceSettings module")
-        edge_ds_id = edge_ds["id"]
-
-        edge_ds_data = edge_ds["data"]
-
-        static_routes_patch = build_static_routes_patch(branch)
-        vlan_999_patch = build_vlan_999_patch()
-        ge3_patch = build_wan_patch(branch.wans[0], "GE3", edge_ds_data)
-        ge4_patch = build_wan_patch(branch.wans[1], "GE4", edge_ds_data)
-        ge2_patch = build_ge2_patch(branch, edge_ds_data)
-
-        # zscaler cannot be done until edge is activated
-        patch_set = jsonpatch.JsonPatch(
-            [
-                *static_routes_patch,
-                *vlan_999_patch,
-                *ge3_patch,
-                *ge4_patch,
-                *ge2_patch,
-            ]
-        )
-        patch_set.apply(edge_ds_data, in_place=True)
+    edge_ds = extract_module(edge_specific_config["modules"], "deviceSettings")
+    if edge_ds is None:
+        raise LookupError("could not find deviceSettings module")
 
-        update_configuration_module(s, shared, edge_ds_id, edge_ds_data)
+    edge_ds_data = edge_ds["data"]
 
-        edge_wan = extract_module(edge_specific_config["modules"], "WAN")
-        if edge_wan is None:
-            raise LookupError("could not find WAN module")
-        edge_wan_id = edge_wan["id"]
+    # zscaler cannot be done until edge is activated
+    # the patch is applied to a copy so the fetched module can be diffed against it
+    patch_set = build_device_settings_patch(branch, edge_ds_data)
+    new_edge_ds_data = patch_set.apply(edge_ds_data)
 
-        new_edge_wan_data = generate_wan_overlay(branch.wans)
-        update_configuration_module(s, shared, edge_wan_id, new_edge_wan_data)
+    ds_update = update_configuration_module_if_changed(
+        s, shared, edge_ds, new_edge_ds_data
+    )
+    print(f"[{branch.name}] deviceSettings: {ds_update.describe()}")
 
-        quit_key = input(
-            "pre-provisioning complete. press enter to continue to ZScaler provisioning, any other key to exit: "
-        )
-        if quit_key == "":
-            print("Exiting")
-            return
+    edge_wan = extract_module(edge_specific_config["modules"], "WAN")
+    if edge_wan is None:
+        raise LookupError("could not find WAN module")
 
-        print("ZScaler not implemented yet")
-        return
+    new_edge_wan_data = generate_wan_overlay(branch.wans)
+    wan_update = update_configuration_module_if_changed(
+        s, shared, edge_wan, new_edge_wan_data
+    )
+    print(f"[{branch.name}] WAN: {wan_update.describe()}")
 
-        print("proceeding with ZScaler configuration...")
+    return edge_id
 
-        # TODO: poll configuration stack repeatedly
-        # wait for edge/modules/deviceSettings/data/segments/0/css to appear
-        # this indicates that the VCO finished backend API to ZScaler
-        # for now, just don't press enter unless the edge is activated and has the CSS provisioned
 
-        edge_config_stack = get_configuration_stack(s, shared, edge_id)
-        edge_specific_config = edge_config_stack[0]
+def css_provisioned(ds_data: dict) -> bool:
+    segments = ds_data.get("segments") or []
+    return bool(segments) and bool(segments[0].get("css"))
 
-        edge_ds = extract_module(edge_specific_config["modules"], "deviceSettings")
-        if edge_ds is None:
-            raise LookupError("could not find deviceSettings module")
-        edge_ds_id = edge_ds["id"]
 
-        edge_ds_data = edge_ds["data"]
-        edge_ds_refs = edge_ds["refs"]
+def css_poller(s: Session, shared: CommonData, **kwargs) -> Poller[int]:
+    # watch(edge_id) resolves to the edge's deviceSettings module once the VCO has finished its
+    # backend calls to ZScaler, which is when data/segments/0/css appears after activation
+    # edges due together are fetched in one batch, only deviceSettings is decoded
+    kwargs.setdefault("initial_delay", 30.0)
+    kwargs.setdefault("max_delay", 600.0)
 
-        data_patch_set = jsonpatch.JsonPatch(
-            build_zscaler_data_patch(branch, shared, edge_ds_data)
+    def check(edge_ids: list[int]) -> dict[int, dict | Exception]:
+        done = {}
+        stacks = get_edges_configuration_modules(
+            s, shared, edge_ids, {"deviceSettings"}
         )
-        refs_patch_set = jsonpatch.JsonPatch(build_zscaler_refs_patch(branch))
-        data_patch_set.apply(edge_ds_data, in_place=True)
-        refs_patch_set.apply(edge_ds_refs, in_place=True)
+        for edge_id, stack in stacks.items():
+            # failed fetches are polled again with the edges that are still pending
+            if not stack.ok:
+                continue
+            edge_ds = extract_module(stack.result[0]["modules"], "deviceSettings")
+            if edge_ds is None:
+                done[edge_id] = LookupError("could not find deviceSettings module")
+            elif css_provisioned(edge_ds["data"]):
+                done[edge_id] = edge_ds
+        return done
+
+    return Poller(check, **kwargs)
+
+
+def build_zscaler_update(
+    branch: BranchData, shared: CommonData, edge_ds: dict
+) -> tuple[dict, dict]:
+    data_patch_set = jsonpatch.JsonPatch(
+        build_zscaler_data_patch(branch, shared, edge_ds["data"])
+    )
+    refs_patch_set = jsonpatch.JsonPatch(build_zscaler_refs_patch(branch))
+    return (
+        cast(dict, data_patch_set.apply(edge_ds["data"])),
+        cast(dict, refs_patch_set.apply(edge_ds["refs"])),
+    )
 
-        update_configuration_module(s, shared, edge_ds_id, edge_ds_data, edge_ds_refs)
 
-    finally:
-        return
+def provision_zscaler(
+    s: Session, shared: CommonData, branch: BranchData, edge_ds: dict
+) -> ModuleUpdate:
+    # edge_ds is the deviceSettings module the css poller resolved to
+    new_edge_ds_data, new_edge_ds_refs = build_zscaler_update(branch, shared, edge_ds)
+    ds_update = update_configuration_module_if_changed(
+        s, shared, edge_ds, new_edge_ds_data, new_edge_ds_refs
+    )
+    print(f"[{branch.name}] ZScaler deviceSettings: {ds_update.describe()}")
+    return ds_update
+
+
+def report_results(shared: CommonData, results: list[ProvisionResult]):
+    failed = [r for r in results if r.error is not None]
+    print(
+        f"provisioned {len(results) - len(failed)} of {len(results)} branch(es), {len(failed)} failed"
+    )
+    for r in failed:
+        if r.edge_id is not None:
+            edge = f" edge {r.edge_id} ({r.edge_logical_id})"
+        elif r.edge_logical_id is not None:
+            edge = f" edge {r.edge_logical_id}"
+        else:
+            edge = ""
+        print(f"- [{r.branch.name}]{edge} {type(r.error).__name__}: {r.error}")
+    zscaler = sum(r.zscaler_provisioned for r in results)
+    if zscaler:
+        print(f"ZScaler provisioned on {zscaler} edge(s)")
+
+    limiter_stats = limiter_for(shared.vco).stats()
+    print(
+        f"{limiter_stats.calls} VCO request(s), {limiter_stats.waited_calls} waited "
+        f"{limiter_stats.wait_seconds:.1f}s in total for the rate limiter, "
+        f"{limiter_stats.throttled} throttled"
+    )
+    print(recorder().summary())
+    # only whole stacks go through the stack cache, targeted module fetches do not
+    if stack_cache().stats().misses:
+        print(stack_cache().summary())
+
+
+def provision_branches(
+    shared: CommonData,
+    branches: Iterable[BranchData],
+    max_workers: int = 8,
+    css: Poller[int] | None = None,
+    locations: list[tuple[str, str]] | None = None,
+) -> list[ProvisionResult]:
+    # geocode every distinct location up front so it stays off each branch's critical path
+    # with locations given, branches can be a lazy iterator such as inputs.read_branches
+    if locations is None:
+        branches = list(branches)
+        locations = [(b.postal_code, b.country) for b in branches]
+    prewarm(default_cache(), shared.google_maps_api_key, locations, max_workers)
+
+    # each worker thread keeps its own session so connections are reused per thread
+    local = threading.local()
+
+    def thread_session() -> Session:
+        if not hasattr(local, "session"):
+            local.session = new_session(shared)
+        return local.session
+
+    def worker(branch: BranchData) -> ProvisionResult:
+        started = time.monotonic()
+        result = ProvisionResult(branch, None, None, 0.0)
+        try:
+            provision_branch(thread_session(), shared, branch, result)
+        except Exception as e:
+            result.error = e
+        result.elapsed_seconds = time.monotonic() - started
+        return result
+
+    def zscaler_worker(result: ProvisionResult, ready: Future):
+        try:
+            provision_zscaler(thread_session(), shared, result.branch, ready.result())
+            result.zscaler_provisioned = True
+        except Exception as e:
+            result.error = e
+
+    # branches are pulled from the iterator as workers free up, at most two per worker are in
+    # flight, so a lazy wave is never read far ahead of what has been provisioned
+    queued = enumerate(branches)
+    results: dict[int, ProvisionResult] = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        provisioning = {
+            executor.submit(worker, branch): i
+            for i, branch in itertools.islice(queued, max_workers * 2)
+        }
+        # with a css poller, every provisioned edge is watched from the poller's single thread and
+        # the ZScaler update goes out on the pool as soon as that edge's CSS site appears
+        activating: dict[Future, ProvisionResult] = {}
+        updates: set[Future] = set()
+        while provisioning or activating or updates:
+            done, _ = wait(
+                [*provisioning, *activating, *updates], return_when=FIRST_COMPLETED
+            )
+            for future in done:
+                if future in provisioning:
+                    result = results[provisioning.pop(future)] = future.result()
+                    if css is not None and result.error is None:
+                        if result.edge_id is None:
+                            result.error = RuntimeError(
+                                "no edge id to watch for activation"
+                            )
+                        else:
+                            activating[css.watch(result.edge_id)] = result
+                    for i, branch in itertools.islice(queued, 1):
+                        provisioning[executor.submit(worker, branch)] = i
+                elif future in activating:
+                    updates.add(
+                        executor.submit(zscaler_worker, activating.pop(future), future)
+                    )
+                else:
+                    updates.discard(future)
+
+    ordered = [results[i] for i in sorted(results)]
+    report_results(shared, ordered)
+    return ordered
+
+
+async def provision_branch_async(
+    c: AsyncVcoClient,
+    http: httpx.AsyncClient,
+    shared: CommonData,
+    branch: BranchData,
+    result: ProvisionResult | None = None,
+) -> int:
+    lat_lon = await aio_api.calculate_lat_lon(
+        http,
+        shared.google_maps_api_key,
+        branch.postal_code,
+        branch.country,
+        cache=default_cache(),
+    )
+
+    post_resp = await aio_api.post_edge(
+        c,
+        shared,
+        "edge6X0",
+        shared.branch_profile_logical_id,
+        extras=build_edge_extras(shared, branch, lat_lon),
+    )
+    edge_logical_id = post_resp["logicalId"]
+    if result is not None:
+        result.edge_logical_id = edge_logical_id
+
+    edge_info_v1 = await aio_api.find_edge(c, shared, edge_logical_id)
+    if edge_info_v1 is None:
+        raise RuntimeError("could not find v1 info for new edge")
+    edge_id = edge_info_v1["id"]
+    if result is not None:
+        result.edge_id = edge_id
+
+    edge_specific_config = await aio_api.get_edge_configuration_modules(
+        c, shared, edge_id, PROVISIONED_MODULES
+    )
+
+    edge_ds = extract_module(edge_specific_config["modules"], "deviceSettings")
+    if edge_ds is None:
+        raise LookupError("could not find deviceSettings module")
+    edge_wan = extract_module(edge_specific_config["modules"], "WAN")
+    if edge_wan is None:
+        raise LookupError("could not find WAN module")
+
+    new_edge_ds_data = build_device_settings_patch(branch, edge_ds["data"]).apply(
+        edge_ds["data"]
+    )
+
+    # the two modules are independent, so both updates go out together
+    ds_update, wan_update = await asyncio.gather(
+        aio_api.update_configuration_module_if_changed(
+            c, shared, edge_ds, new_edge_ds_data
+        ),
+        aio_api.update_configuration_module_if_changed(
+            c, shared, edge_wan, generate_wan_overlay(branch.wans)
+        ),
+    )
+    print(f"[{branch.name}] deviceSettings: {ds_update.describe()}")
+    print(f"[{branch.name}] WAN: {wan_update.describe()}")
+    return edge_id
+
+
+async def provision_zscaler_async(
+    c: AsyncVcoClient, shared: CommonData, branch: BranchData, edge_ds: dict
+) -> ModuleUpdate:
+    new_edge_ds_data, new_edge_ds_refs = build_zscaler_update(branch, shared, edge_ds)
+    ds_update = await aio_api.update_configuration_module_if_changed(
+        c, shared, edge_ds, new_edge_ds_data, new_edge_ds_refs
+    )
+    print(f"[{branch.name}] ZScaler deviceSettings: {ds_update.describe()}")
+    return ds_update
+
+
+async def provision_branches_async(
+    shared: CommonData,
+    branches: Iterable[BranchData],
+    max_branches: int = 64,
+    max_in_flight: int = 32,
+    css: Poller[int] | None = None,
+    locations: list[tuple[str, str]] | None = None,
+) -> list[ProvisionResult]:
+    if locations is None:
+        branches = list(branches)
+        locations = [(b.postal_code, b.country) for b in branches]
+    prewarm(default_cache(), shared.google_maps_api_key, locations)
+    branch_slots = asyncio.Semaphore(max_branches)
+
+    async with aio_api.new_client(
+        shared, max_in_flight
+    ) as c, httpx.AsyncClient() as http:
+
+        async def provision(branch: BranchData) -> ProvisionResult:
+            async with branch_slots:
+                started = time.monotonic()
+                result = ProvisionResult(branch, None, None, 0.0)
+                try:
+                    await provision_branch_async(c, http, shared, branch, result)
+                except Exception as e:
+                    result.error = e
+                result.elapsed_seconds = time.monotonic() - started
+                return result
+
+        async def zscaler(result: ProvisionResult, css: Poller[int]):
+            # no branch slot is held while the edge waits to activate
+            try:
+                if result.edge_id is None:
+                    raise RuntimeError("no edge id to watch for activation")
+                edge_ds = await asyncio.wrap_future(css.watch(result.edge_id))
+                async with branch_slots:
+                    await provision_zscaler_async(c, shared, result.branch, edge_ds)
+                result.zscaler_provisioned = True
+            except Exception as e:
+                result.error = e
+
+        # a fixed set of workers pulls branches from the iterator one at a time, so a lazy wave
+        # is only read as fast as it is provisioned
+        queued = enumerate(branches)
+        results: dict[int, ProvisionResult] = {}
+        activations: list[asyncio.Task] = []
+
+        async def worker():
+            for i, branch in queued:
+                result = results[i] = await provision(branch)
+                if css is not None and result.error is None:
+                    activations.append(asyncio.create_task(zscaler(result, css)))
+
+        await asyncio.gather(*(worker() for _ in range(max_branches)))
+        await asyncio.gather(*activations)
+
+    ordered = [results[i] for i in sorted(results)]
+    report_results(shared, ordered)
+    return ordered
 
 
 branch_data = BranchData(
@@ -467,18 +867,103 @@ def read_env(name: str) -> str:
     return value
 
 
-dotenv.load_dotenv(".env")
-shared = CommonData(
-    read_env("VCO"),
-    read_env("VCO_TOKEN"),
-    read_env("ENT_LOG_ID"),
-    read_env("ZS_CLOUD_SUB_LOG_ID"),
-    read_env("BRANCH_PROF_LOG_ID"),
-    read_env("BRANCH_LIC_LOG_ID"),
-    read_env("GOOGLE_MAPS_API_KEY"),
-)
+if __name__ == "__main__":
+    dotenv.load_dotenv(".env")
+    shared = CommonData(
+        read_env("VCO"),
+        read_env("VCO_TOKEN"),
+        read_env("ENT_LOG_ID"),
+        read_env("ZS_CLOUD_SUB_LOG_ID"),
+        read_env("BRANCH_PROF_LOG_ID"),
+        read_env("BRANCH_LIC_LOG_ID"),
+        read_env("GOOGLE_MAPS_API_KEY"),
+    )
+
+    json_codec = os.getenv("VCO_JSON_CODEC")
+    if json_codec is not None:
+        set_codec(json_codec)
+
+    max_rps = os.getenv("VCO_MAX_RPS")
+    if max_rps is not None:
+        set_rate_limit(shared.vco, float(max_rps))
+
+    if os.getenv("VCO_SIMULATOR") == "1":
+        install_simulator(
+            shared.vco,
+            VcoSimulator(
+                config_from_env(dict(os.environ)), shared.enterprise_logical_id
+            ),
+        )
+
+    trace_path = os.getenv("VCO_TRACE_FILE")
+    if trace_path is not None:
+        recorder().open_trace(trace_path)
+
+    # ZScaler is configured once each edge has activated and the VCO has provisioned its CSS site
+    css = None
+    if os.getenv("ZSCALER") == "1":
+        css = css_poller(
+            new_session(shared),
+            shared,
+            initial_delay=float(os.getenv("ZSCALER_POLL_SECONDS", "30")),
+            timeout=float(os.getenv("ZSCALER_WAIT_MINUTES", "120")) * 60,
+        )
 
-s = session()
-s.headers.update({"Authorization": f"Token {shared.token}"})
+    # BRANCHES_FILE is a CSV or Parquet wave, every row is validated before provisioning starts
+    branches_path = os.getenv("BRANCHES_FILE")
+    branches, locations = [branch_data], None
+    if branches_path is not None:
+        branches, locations = read_branches(branches_path), read_locations(
+            branches_path
+        )
 
-provision_branch(s, shared, branch_data)
+    # the wave's networks are checked against each other and the deployed fleet before any edge is
+    # created, by default only for waves since it reads the deviceSettings of every deployed edge
+    if os.getenv("SUBNET_CHECK", "0" if branches_path is None else "1") == "1":
+        # the file was validated by read_branches above, its branches are built again without that
+        wave = iter_branches(branches_path) if branches_path is not None else branches
+        index, conflicts = preflight(new_session(shared), shared, wave)
+        if conflicts:
+            print(
+                f"{len(conflicts)} subnet conflict(s) found among {len(index)} network(s):"
+            )
+            for conflict in conflicts:
+                print(f"- {conflict}")
+            sys.exit(1)
+
+    max_workers = int(os.getenv("MAX_WORKERS", "1"))
+    try:
+        if os.getenv("VCO_ASYNC") == "1":
+            asyncio.run(
+                provision_branches_async(
+                    shared,
+                    branches,
+                    max_branches=max_workers,
+                    css=css,
+                    locations=locations,
+                )
+            )
+        elif max_workers > 1 or branches_path is not None:
+            provision_branches(
+                shared, branches, max_workers=max_workers, css=css, locations=locations
+            )
+        else:
+            s = new_session(shared)
+            try:
+                edge_id = provision_branch(s, shared, branch_data)
+                if css is not None:
+                    print(
+                        f"[{branch_data.name}] waiting for edge {edge_id} to activate..."
+                    )
+                    provision_zscaler(
+                        s, shared, branch_data, css.watch(edge_id).result()
+                    )
+            finally:
+                print(recorder().summary())
+    finally:
+        if css is not None:
+            css.close()
+        recorder().close()
+        metrics_path = os.getenv("VCO_METRICS_FILE")
+        if metrics_path is not None:
+            recorder().write_prometheus(metrics_path)
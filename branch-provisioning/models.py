@@ -61,3 +61,15 @@ class EdgeLicense:
     bandwidth_tier: str
     edition: str
     term_months: int
+
+
+@dataclass
+class ProvisionResult:
+    branch: BranchData
+    edge_id: int | None
+    error: Exception | None
+    elapsed_seconds: float
+    # set as soon as the edge exists, so an edge left half provisioned can be found and cleaned up
+    edge_logical_id: str | None = None
+    # set once the ZScaler update has been applied after activation
+    zscaler_provisioned: bool = False
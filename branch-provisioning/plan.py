@@ -0,0 +1,127 @@
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import json
+import os
+import sys
+from typing import Iterable, Iterator
+
+from inputs import read_branches
+from main import build_device_settings_patch, generate_wan_overlay
+from models import BranchData
+
+# offline rendering of what provision_branch would send, using a deviceSettings module saved to disk
+# (test.py writes one in the expected format)
+
+_template_ds: dict = {}
+_diff_only = False
+
+
+def load_device_settings(path: str) -> dict:
+    with open(path) as fp:
+        module = json.load(fp)
+    # accept either the whole module as dumped by test.py or just its data
+    return (
+        module["data"]
+        if "data" in module and "routedInterfaces" not in module
+        else module
+    )
+
+
+def _init_worker(template_path: str, diff_only: bool):
+    global _template_ds, _diff_only
+    _template_ds = load_device_settings(template_path)
+    _diff_only = diff_only
+
+
+def render_branch(branch: BranchData) -> dict:
+    try:
+        ds_patch = build_device_settings_patch(branch, _template_ds)
+        wan_data = generate_wan_overlay(branch.wans)
+        if _diff_only:
+            return {
+                "name": branch.name,
+                "deviceSettings": ds_patch.patch,
+                "WAN": wan_data,
+            }
+
+        return {
+            "name": branch.name,
+            "deviceSettings": ds_patch.apply(_template_ds),
+            "WAN": wan_data,
+        }
+    except Exception as e:
+        return {"name": branch.name, "error": f"{type(e).__name__}: {e}"}
+
+
+def render_chunk(branches: list[BranchData]) -> list[dict]:
+    return [render_branch(branch) for branch in branches]
+
+
+def plan_branches(
+    template_path: str,
+    branches: Iterable[BranchData],
+    diff_only: bool = False,
+    max_workers: int | None = None,
+    chunksize: int = 64,
+) -> Iterator[dict]:
+    # results stream back in input order, workers load the template once each
+    # branches go out a chunk at a time with at most two chunks per worker in flight, so a lazy
+    # wave is read only as fast as it is rendered
+    workers = max_workers or os.cpu_count() or 1
+    remaining = iter(branches)
+    chunks = iter(lambda: list(itertools.islice(remaining, chunksize)), [])
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(template_path, diff_only),
+    ) as executor:
+        pending = deque(
+            executor.submit(render_chunk, chunk)
+            for chunk in itertools.islice(chunks, workers * 2)
+        )
+        while pending:
+            rendered = pending.popleft().result()
+            for chunk in itertools.islice(chunks, 1):
+                pending.append(executor.submit(render_chunk, chunk))
+            yield from rendered
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="render branch configurations without contacting the VCO"
+    )
+    parser.add_argument(
+        "template", help="deviceSettings module JSON, e.g. from test.py"
+    )
+    parser.add_argument("branches", help="branch input CSV or Parquet file")
+    parser.add_argument("output", help="JSON lines output file, - for stdout")
+    parser.add_argument(
+        "--diff",
+        action="store_true",
+        help="write the patch operations instead of full modules",
+    )
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    out = sys.stdout if args.output == "-" else open(args.output, "w")
+    rendered = failed = 0
+    try:
+        for result in plan_branches(
+            args.template, read_branches(args.branches), args.diff, args.workers
+        ):
+            out.write(json.dumps(result, separators=(",", ":")))
+            out.write("\n")
+            rendered += 1
+            if "error" in result:
+                failed += 1
+                print(f"- [{result['name']}] {result['error']}", file=sys.stderr)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    print(
+        f"rendered {rendered - failed} of {rendered} branch(es), {failed} failed",
+        file=sys.stderr,
+    )
@@ -0,0 +1,283 @@
+from ipaddress import IPv4Address, IPv4Network, ip_address, ip_network
+import os
+import sys
+from typing import Iterable, Iterator, NamedTuple, cast
+
+import dotenv
+import numpy as np
+import pandas as pd
+from requests import Session
+
+from api import edge_directory, get_edges_configuration_modules, new_session
+from inputs import netmask, parse_ipv4, read_branches
+from models import BranchData, CommonData
+from util import extract_module
+
+# the VLAN 999 placeholder on every edge, and any other link-local network, is never routed
+LINK_LOCAL = IPv4Network("169.254.0.0/16")
+
+
+class Allocation(NamedTuple):
+    # LAN networks are routed over the overlay, so they must be unique across the whole fleet
+    # WAN networks are underlay, branches behind the same kind of ISP router often share them,
+    # and they only have to stay clear of their own branch's networks
+    owner: str
+    role: str
+    address: int
+    prefix: int
+    wan: bool = False
+
+    @property
+    def network(self) -> IPv4Network:
+        return IPv4Network((self.address, self.prefix))
+
+    def __str__(self) -> str:
+        return f"{self.network} ({self.owner} {self.role})"
+
+
+class Conflict(NamedTuple):
+    allocation: Allocation
+    # the nearest allocation containing it, which may be an identical network
+    container: Allocation
+
+    def __str__(self) -> str:
+        return f"{self.allocation} overlaps {self.container}"
+
+
+def branch_allocations(branch: BranchData) -> Iterator[Allocation]:
+    def allocation(role: str, network: IPv4Network, wan: bool = False) -> Allocation:
+        return Allocation(
+            branch.name, role, int(network.network_address), network.prefixlen, wan
+        )
+
+    yield allocation("transit_net", branch.transit_net)
+    for network in branch.corporate_nets:
+        yield allocation("corporate_nets", network)
+    yield allocation("byod_net", branch.byod_net)
+    yield allocation("guest_net", branch.guest_net)
+    for i, wan in enumerate(branch.wans, start=1):
+        yield allocation(f"wan{i}_network", wan.network, wan=True)
+
+
+def device_settings_networks(ds_data: dict) -> list[tuple[str, str, str, bool]]:
+    # (role, ip, prefix, wan) for every statically addressed network in an edge's deviceSettings
+    # routed interfaces with a gateway are WAN links, the rest of the addressing is LAN
+    networks = []
+    for interface in ds_data.get("routedInterfaces", []):
+        addressing = interface.get("addressing") or {}
+        if addressing.get("cidrIp") and addressing.get("cidrPrefix") is not None:
+            networks.append(
+                (
+                    interface.get("name", "interface"),
+                    addressing["cidrIp"],
+                    addressing["cidrPrefix"],
+                    bool(addressing.get("gateway")),
+                )
+            )
+        for k, sub in enumerate(interface.get("subinterfaces") or []):
+            addressing = sub.get("addressing") or {}
+            if addressing.get("cidrIp") and addressing.get("cidrPrefix") is not None:
+                name = f"{interface.get('name', 'interface')}.{sub.get('subinterfaceId', k)}"
+                networks.append(
+                    (name, addressing["cidrIp"], addressing["cidrPrefix"], False)
+                )
+    for segment in ds_data.get("segments", []):
+        for route in (segment.get("routes") or {}).get("static") or []:
+            if route.get("destination") and route.get("cidrPrefix") is not None:
+                networks.append(
+                    ("static route", route["destination"], route["cidrPrefix"], False)
+                )
+    for network in (ds_data.get("lan") or {}).get("networks") or []:
+        if network.get("cidrIp") and network.get("cidrPrefix") is not None:
+            networks.append(
+                ("lan network", network["cidrIp"], network["cidrPrefix"], False)
+            )
+    return networks
+
+
+def deployed_allocations(
+    s: Session, shared: CommonData, chunk_size: int = 50
+) -> Iterator[Allocation]:
+    # every edge's own deviceSettings module, fetched in batches, edges come from the shared directory
+    names = {
+        edge_id: edge["name"]
+        for edge_id, edge in edge_directory(s, shared).by_id.items()
+    }
+    edge_ids = list(names)
+    for start in range(0, len(edge_ids), chunk_size):
+        chunk = edge_ids[start : start + chunk_size]
+        rows = []
+        stacks = get_edges_configuration_modules(s, shared, chunk, {"deviceSettings"})
+        for edge_id, stack in stacks.items():
+            if not stack.ok:
+                raise RuntimeError(
+                    f"could not fetch configuration of edge {edge_id}: {stack.error}"
+                )
+            ds = extract_module(stack.result[0]["modules"], "deviceSettings")
+            if ds is not None:
+                rows += [
+                    (names[edge_id], *network)
+                    for network in device_settings_networks(ds["data"])
+                ]
+        if not rows:
+            continue
+
+        # interface addresses are host addresses, their network is what gets routed
+        owners, roles, ips, prefixes, wans = zip(*rows)
+        address, _, ok = parse_ipv4(pd.Series(ips, dtype=str))
+        numeric = cast(pd.Series, pd.to_numeric(pd.Series(prefixes), errors="coerce"))
+        prefix = numeric.to_numpy()
+        ok &= ~np.isnan(prefix) & (prefix >= 1) & (prefix <= 32)
+        prefix = np.where(ok, prefix, 32).astype(np.int64)
+        network = address & netmask(prefix)
+        for i in np.flatnonzero(ok):
+            yield Allocation(
+                owners[i], roles[i], int(network[i]), int(prefix[i]), wans[i]
+            )
+
+
+def _nearest_containers(starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    # CIDR blocks are either nested or disjoint, so sorted by start (widest first) the nearest
+    # earlier block still open when a block starts is the one that contains it, -1 for none
+    containers = np.full(len(starts), -1, dtype=np.int64)
+    open_blocks: list[int] = []
+    ends_list = ends.tolist()
+    for i, start in enumerate(starts.tolist()):
+        while open_blocks and ends_list[open_blocks[-1]] < start:
+            open_blocks.pop()
+        if open_blocks:
+            containers[i] = open_blocks[-1]
+        open_blocks.append(i)
+    return containers
+
+
+class SubnetIndex:
+    # allocations as sorted start/end integer arrays, the whole index is built with one sort
+    def __init__(self, allocations: Iterable[Allocation]):
+        allocations = list(allocations)
+        n = len(allocations)
+        starts = np.fromiter((a.address for a in allocations), dtype=np.int64, count=n)
+        prefixes = np.fromiter((a.prefix for a in allocations), dtype=np.int64, count=n)
+        ends = starts + (np.int64(1) << (32 - prefixes)) - 1
+
+        # default routes and link-local networks are never owned by one edge
+        link_local = (prefixes >= LINK_LOCAL.prefixlen) & (
+            (starts & int(LINK_LOCAL.netmask)) == int(LINK_LOCAL.network_address)
+        )
+        keep = np.flatnonzero(~link_local & (prefixes > 0))
+        order = keep[np.lexsort((-ends[keep], starts[keep]))]
+        self.allocations = [allocations[i] for i in order]
+        self.starts = starts[order]
+        self.ends = ends[order]
+        self.owners = np.array([a.owner for a in self.allocations], dtype=object)
+        self.wan = np.array([a.wan for a in self.allocations], dtype=bool)
+        self.containers = _nearest_containers(self.starts, self.ends)
+
+    def __len__(self) -> int:
+        return len(self.allocations)
+
+    def _ancestors(self, i: int) -> Iterator[int]:
+        while i >= 0:
+            yield i
+            i = int(self.containers[i])
+
+    def owners_of(self, address: str | int | IPv4Address) -> list[Allocation]:
+        # every allocation containing the address, innermost first
+        address = int(ip_address(address)) if not isinstance(address, int) else address
+        last = int(np.searchsorted(self.starts, address, side="right")) - 1
+        return [
+            self.allocations[i]
+            for i in self._ancestors(last)
+            if self.ends[i] >= address
+        ]
+
+    def overlapping(self, network: str | IPv4Network) -> list[Allocation]:
+        # the allocations containing the network followed by those inside it
+        net = cast(IPv4Network, ip_network(network))
+        start = int(net.network_address)
+        end = int(net.broadcast_address)
+        containing = self.owners_of(start)
+        lo = int(np.searchsorted(self.starts, start, side="left"))
+        hi = int(np.searchsorted(self.starts, end, side="right"))
+        inside = [a for a in self.allocations[lo:hi] if a not in containing]
+        return containing + inside
+
+    def conflicts(self) -> list[Conflict]:
+        # LAN allocations are checked against the whole fleet, WAN ones against their own owner only
+        # each check is a group of rows, groups are kept apart by offsetting them in a 64-bit key
+        lan = np.flatnonzero(~self.wan)
+        owner_codes, owners = pd.factorize(self.owners)
+        with_wan = np.isin(owner_codes, np.unique(owner_codes[self.wan]))
+        own = np.flatnonzero(with_wan)
+        rows = np.concatenate([lan, own])
+        groups = np.concatenate(
+            [np.zeros(len(lan), dtype=np.int64), owner_codes[own] + 1]
+        )
+
+        offset = groups << 33
+        order = np.lexsort((-(self.ends[rows] + offset), self.starts[rows] + offset))
+        rows = rows[order]
+        containers = _nearest_containers(
+            self.starts[rows] + offset[order], self.ends[rows] + offset[order]
+        )
+
+        found = set()
+        conflicts = []
+        for i in np.flatnonzero(containers >= 0):
+            child, container = int(rows[i]), int(rows[containers[i]])
+            # LAN pairs of one owner with a WAN network are found in both groups
+            if (child, container) not in found:
+                found.add((child, container))
+                conflicts.append(
+                    Conflict(self.allocations[child], self.allocations[container])
+                )
+        return conflicts
+
+
+def preflight(
+    s: Session, shared: CommonData, branches: Iterable[BranchData]
+) -> tuple[SubnetIndex, list[Conflict]]:
+    # only conflicts involving a branch of the wave, clashes already deployed are not its business
+    wave = [a for branch in branches for a in branch_allocations(branch)]
+    wave_owners = {a.owner for a in wave}
+    index = SubnetIndex(wave + list(deployed_allocations(s, shared)))
+    conflicts = [
+        c
+        for c in index.conflicts()
+        if c.allocation.owner in wave_owners or c.container.owner in wave_owners
+    ]
+    return index, conflicts
+
+
+if __name__ == "__main__":
+    # usage: subnets.py <address or network> [branches file], searches the deployed fleet and the wave
+    dotenv.load_dotenv(".env")
+    vco = os.getenv("VCO")
+    token = os.getenv("VCO_TOKEN")
+    assert vco is not None, "missing environment var VCO"
+    assert token is not None, "missing environment var VCO_TOKEN"
+    # the lookup only reads the VCO, the provisioning ids are not needed
+    shared = CommonData(
+        vco,
+        token,
+        os.getenv("ENT_LOG_ID", ""),
+        os.getenv("ZS_CLOUD_SUB_LOG_ID", ""),
+        os.getenv("BRANCH_PROF_LOG_ID", ""),
+        os.getenv("BRANCH_LIC_LOG_ID", ""),
+        os.getenv("GOOGLE_MAPS_API_KEY", ""),
+    )
+
+    wave = read_branches(sys.argv[2]) if len(sys.argv) > 2 else []
+    index, conflicts = preflight(new_session(shared), shared, wave)
+    print(
+        f"{len(index)} network(s) indexed, {len(conflicts)} conflict(s) involving the wave"
+    )
+    for conflict in conflicts:
+        print(f"- {conflict}")
+
+    query = sys.argv[1]
+    matches = index.overlapping(query) if "/" in query else index.owners_of(query)
+    for allocation in matches:
+        print(allocation)
+    if not matches:
+        print(f"{query} is not allocated")
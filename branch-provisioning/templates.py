@@ -0,0 +1,110 @@
+import copy
+import json
+from typing import Any
+
+from jsonpatch import JsonPatchConflict
+from jsonpointer import JsonPointer
+
+
+class Slot:
+    # placeholder for a per-branch value in a PatchTemplate
+    def __init__(self, name: str):
+        self.name = name
+
+    def __repr__(self) -> str:
+        return f"Slot({self.name!r})"
+
+
+def _parse_part(parent, part: str):
+    if isinstance(parent, list):
+        return part if part == "-" else int(part)
+    return part
+
+
+def _parent(doc, parts: tuple[str, ...]):
+    for part in parts[:-1]:
+        doc = doc[int(part)] if isinstance(doc, list) else doc[part]
+    return doc, _parse_part(doc, parts[-1])
+
+
+def _add(doc, parts: tuple[str, ...], value):
+    parent, key = _parent(doc, parts)
+    if isinstance(parent, list):
+        if key == "-":
+            parent.append(value)
+        elif isinstance(key, int) and key <= len(parent):
+            parent.insert(key, value)
+        else:
+            raise JsonPatchConflict(f"can't insert outside of list: /{'/'.join(parts)}")
+    else:
+        parent[key] = value
+
+
+def _replace(doc, parts: tuple[str, ...], value):
+    parent, key = _parent(doc, parts)
+    if isinstance(parent, dict) and key not in parent:
+        raise JsonPatchConflict(
+            f"can't replace a non-existent object: /{'/'.join(parts)}"
+        )
+    parent[key] = value
+
+
+def _remove(doc, parts: tuple[str, ...]):
+    parent, key = _parent(doc, parts)
+    try:
+        return parent.pop(key)
+    except (KeyError, IndexError):
+        raise JsonPatchConflict(
+            f"can't remove a non-existent object: /{'/'.join(parts)}"
+        )
+
+
+class PatchTemplate:
+    # JSON patch whose pointers are parsed once, values are either constants or Slots filled per branch
+    def __init__(self, ops: list[dict]):
+        self.ops = ops
+        self.compiled: list[
+            tuple[str, tuple[str, ...], tuple[str, ...] | None, Any]
+        ] = [
+            (
+                op["op"],
+                tuple(JsonPointer(op["path"]).parts),
+                tuple(JsonPointer(op["from"]).parts) if "from" in op else None,
+                op.get("value"),
+            )
+            for op in ops
+        ]
+
+    def render(self, values: dict) -> list[dict]:
+        rendered = []
+        for op in self.ops:
+            value = op.get("value")
+            if isinstance(value, Slot):
+                op = {**op, "value": values[value.name]}
+            rendered.append(op)
+        return rendered
+
+    def apply(self, doc, values: dict):
+        # applies in place, mirroring jsonpatch semantics for the ops the builders use
+        for op, parts, from_parts, value in self.compiled:
+            if isinstance(value, Slot):
+                value = values[value.name]
+            elif isinstance(value, (dict, list)):
+                value = copy.deepcopy(value)
+
+            if op == "add":
+                _add(doc, parts, value)
+            elif op == "replace":
+                _replace(doc, parts, value)
+            elif op == "remove":
+                _remove(doc, parts)
+            elif op == "move":
+                assert from_parts is not None
+                _add(doc, parts, _remove(doc, from_parts))
+            else:
+                raise ValueError(f"unsupported patch op {op}")
+
+
+def copy_json(doc):
+    # round-tripping through json is considerably faster than deepcopy for large module data
+    return json.loads(json.dumps(doc))
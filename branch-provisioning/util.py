@@ -1,16 +1,47 @@
 from ipaddress import IPv4Address, IPv4Network, ip_address, ip_network
-from typing import Optional, cast
+import os
+from typing import TYPE_CHECKING, Optional, cast
 import requests
+import sys
+import time
+
+# shared VCO client code lives at the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
 
 from models import LatLon
+from vcoclient.portal import decode_json, record_request
+from vcoclient.stacks import find_module
+
+if TYPE_CHECKING:
+    from geocache import GeocodeCache
+
+# geocoder requests are recorded next to the VCO requests under this name
+GEOCODER = "maps.googleapis.com"
 
 
-def calculate_lat_lon(gmaps_api_key: str, postal_code: str, country: str) -> LatLon:
-    resp = requests.get(
-        f'https://maps.googleapis.com/maps/api/geocode/json?address={postal_code},{country}&key={gmaps_api_key}').json()
+def calculate_lat_lon(
+    gmaps_api_key: str,
+    postal_code: str,
+    country: str,
+    cache: "GeocodeCache | None" = None,
+) -> LatLon:
+    if cache is not None:
+        cached = cache.get(postal_code, country)
+        if cached is not None:
+            return cached
 
-    first_location = resp['results'][0]['geometry']['location']
-    return LatLon(first_location['lat'], first_location['lng'])
+    started = time.perf_counter()
+    http_resp = requests.get(
+        f"https://maps.googleapis.com/maps/api/geocode/json?address={postal_code},{country}&key={gmaps_api_key}"
+    )
+    record_request(GEOCODER, "geocode", None, http_resp, 1, started, 0.0, 0.0, 0)
+    resp = decode_json(GEOCODER, http_resp, "geocode")
+
+    first_location = resp["results"][0]["geometry"]["location"]
+    lat_lon = LatLon(first_location["lat"], first_location["lng"])
+    if cache is not None:
+        cache.put(postal_code, country, lat_lon)
+    return lat_lon
 
 
 def ipv4_network(net: str) -> IPv4Network:
@@ -22,4 +53,9 @@ def ipv4_address(addr: str) -> IPv4Address:
 
 
 def extract_module(module_stack: list[dict], module_name: str) -> Optional[dict]:
-    return next((m for m in module_stack if m["name"] == module_name), None)
\ No newline at end of file
+    # stacks fetched through the stack cache are indexed by module name
+    return find_module(module_stack, module_name)
+
+
+def routed_interface_indexes(device_settings: dict) -> dict[str, int]:
+    return {e["name"]: i for i, e in enumerate(device_settings["routedInterfaces"])}
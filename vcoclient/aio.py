@@ -0,0 +1,185 @@
+import asyncio
+import time
+from typing import Any, Callable
+
+import httpx
+
+from vcoclient.codec import codec
+from vcoclient.metrics import http_operation, rpc_operation
+from vcoclient.portal import (
+    PortalCall,
+    PortalResult,
+    batch_rejected,
+    batch_results,
+    batch_supported,
+    call_result,
+    decode_json,
+    mark_batch_unsupported,
+    next_id,
+    record_request,
+    rpc_request,
+)
+from vcoclient.ratelimit import RateLimiter, limiter_for, parse_retry_after
+from vcoclient.transport import async_transport_for
+
+try:
+    import h2  # noqa: F401
+
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class AsyncVcoClient:
+    # one pooled keep-alive connection set per VCO
+    # max_in_flight bounds concurrent requests, the shared rate limiter still paces them
+    def __init__(
+        self,
+        vco: str,
+        token: str,
+        max_in_flight: int = 32,
+        http2: bool = True,
+        limiter: RateLimiter | None = None,
+        timeout: float = 60.0,
+    ):
+        self.vco = vco
+        self.limiter = limiter if limiter is not None else limiter_for(vco)
+        self.in_flight = asyncio.Semaphore(max_in_flight)
+        self.client = httpx.AsyncClient(
+            base_url=f"https://{vco}",
+            headers={"Authorization": f"Token {token}"},
+            http2=http2 and HTTP2_AVAILABLE,
+            limits=httpx.Limits(
+                max_connections=max_in_flight,
+                max_keepalive_connections=max_in_flight,
+            ),
+            timeout=timeout,
+            transport=async_transport_for(vco),
+        )
+
+    async def __aenter__(self) -> "AsyncVcoClient":
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def send(
+        self,
+        http_method: str,
+        url: str,
+        retry_server_errors: bool = True,
+        max_attempts: int = 5,
+        operation: str | None = None,
+        **kwargs,
+    ) -> httpx.Response:
+        # same retry and rate limiter feedback rules as portal.send
+        if operation is None:
+            operation = http_operation(http_method, url)
+        body = kwargs.pop("json", None)
+        if body is not None:
+            kwargs["content"] = codec().dumps(body)
+            kwargs["headers"] = {
+                "Content-Type": "application/json",
+                **kwargs.get("headers", {}),
+            }
+        started = time.perf_counter()
+        limiter_wait = retry_wait = 0.0
+        throttled = 0
+        for attempt in range(1, max_attempts + 1):
+            wait = await self.limiter.acquire_async()
+            if attempt == 1:
+                limiter_wait += wait
+            else:
+                retry_wait += wait
+            async with self.in_flight:
+                resp = await self.client.request(http_method, url, **kwargs)
+            if resp.status_code == 429:
+                throttled += 1
+                self.limiter.on_throttle(
+                    parse_retry_after(resp.headers.get("Retry-After"))
+                )
+            elif resp.status_code >= 500:
+                self.limiter.on_server_error()
+                if not retry_server_errors:
+                    break
+            else:
+                self.limiter.on_success()
+                break
+        record_request(
+            self.vco,
+            operation,
+            body,
+            resp,
+            attempt,
+            started,
+            limiter_wait,
+            retry_wait,
+            throttled,
+        )
+        return resp
+
+    async def post_portal(self, body: dict | list) -> httpx.Response:
+        return await self.send(
+            "POST", "/portal/", operation=rpc_operation(body), json=body
+        )
+
+    async def do_portal(
+        self, method: str, params: dict, decoder: Callable[[bytes], Any] | None = None
+    ) -> Any:
+        resp = decode_json(
+            self.vco,
+            await self.post_portal(rpc_request(method, params)),
+            method,
+            decoder,
+        )
+        if "result" not in resp:
+            raise ValueError(codec().dumps(resp, indent=True).decode())
+        return resp["result"]
+
+    async def _call_chunk(
+        self, calls: list[PortalCall], decoder: Callable[[bytes], Any] | None = None
+    ) -> list[PortalResult] | None:
+        ids = [next_id() for _ in calls]
+        body = [rpc_request(c.method, c.params, i) for c, i in zip(calls, ids)]
+        http_resp = await self.post_portal(body)
+        try:
+            resp = decode_json(self.vco, http_resp, rpc_operation(body), decoder)
+        except ValueError:
+            return None
+        if batch_rejected(http_resp.status_code, resp):
+            mark_batch_unsupported(self.vco)
+        return batch_results(calls, ids, http_resp.status_code, resp)
+
+    async def _call_one(
+        self, c: PortalCall, decoder: Callable[[bytes], Any] | None = None
+    ) -> PortalResult:
+        return call_result(
+            self.vco,
+            c,
+            await self.post_portal(rpc_request(c.method, c.params)),
+            decoder,
+        )
+
+    async def do_portal_batch(
+        self,
+        calls: list[PortalCall],
+        chunk_size: int = 50,
+        decoder: Callable[[bytes], Any] | None = None,
+    ) -> list[PortalResult]:
+        results = []
+        for start in range(0, len(calls), chunk_size):
+            chunk = calls[start : start + chunk_size]
+            chunk_results = None
+            if batch_supported(self.vco):
+                chunk_results = await self._call_chunk(chunk, decoder)
+            # as in portal.call_batch, only a rejected batch turns batching off for the VCO
+            if chunk_results is None:
+                # without batches the calls in a chunk can at least overlap
+                chunk_results = list(
+                    await asyncio.gather(*(self._call_one(c, decoder) for c in chunk))
+                )
+            results.extend(chunk_results)
+        return results
@@ -0,0 +1,142 @@
+import json
+import threading
+from typing import TYPE_CHECKING, AbstractSet, Any, Callable
+
+# both are optional, the type checker always sees them and at runtime they are None when missing
+if TYPE_CHECKING:
+    import msgspec
+    import orjson
+else:
+    try:
+        import orjson
+    except ImportError:
+        orjson = None
+
+    try:
+        import msgspec
+    except ImportError:
+        msgspec = None
+
+
+class JsonCodec:
+    # stdlib json, always available
+    name = "json"
+
+    def dumps(self, obj: Any, indent: bool = False) -> bytes:
+        if indent:
+            return json.dumps(obj, indent=2).encode()
+        return json.dumps(obj, separators=(",", ":")).encode()
+
+    def loads(self, data: bytes | str | memoryview) -> Any:
+        if isinstance(data, memoryview):
+            data = bytes(data)
+        return json.loads(data)
+
+
+class OrjsonCodec(JsonCodec):
+    name = "orjson"
+
+    def dumps(self, obj: Any, indent: bool = False) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else None)
+
+    def loads(self, data: bytes | str | memoryview) -> Any:
+        return orjson.loads(data)
+
+
+class MsgspecCodec(JsonCodec):
+    name = "msgspec"
+
+    def __init__(self):
+        self.encoder = msgspec.json.Encoder()
+        self.decoder = msgspec.json.Decoder()
+
+    def dumps(self, obj: Any, indent: bool = False) -> bytes:
+        data = self.encoder.encode(obj)
+        return msgspec.json.format(data, indent=2) if indent else data
+
+    def loads(self, data: bytes | str | memoryview) -> Any:
+        # callers expect ValueError for malformed JSON, as json and orjson raise
+        try:
+            return self.decoder.decode(data)
+        except msgspec.DecodeError as e:
+            raise ValueError(str(e)) from e
+
+
+CODECS: dict[str, Callable[[], JsonCodec]] = {"json": JsonCodec}
+if msgspec is not None:
+    CODECS["msgspec"] = MsgspecCodec
+if orjson is not None:
+    CODECS["orjson"] = OrjsonCodec
+
+# fastest available first
+_codec: JsonCodec = next(
+    CODECS[name]() for name in ("orjson", "msgspec", "json") if name in CODECS
+)
+_codec_lock = threading.Lock()
+
+
+def codec() -> JsonCodec:
+    return _codec
+
+
+def set_codec(name: str) -> JsonCodec:
+    global _codec
+    if name not in CODECS:
+        raise ValueError(
+            f"JSON codec {name} is not installed, available: {', '.join(CODECS)}"
+        )
+    with _codec_lock:
+        _codec = CODECS[name]()
+        return _codec
+
+
+if msgspec is not None:
+    # configuration stacks described only down to the module level, module bodies stay raw bytes
+    # until one is picked, so the modules nobody asked for never become Python objects
+    class _StackModule(msgspec.Struct):
+        name: str
+        id: int | None = None
+        data: msgspec.Raw | msgspec.UnsetType = msgspec.UNSET
+        refs: msgspec.Raw | msgspec.UnsetType = msgspec.UNSET
+
+    class _StackLayer(msgspec.Struct):
+        id: int | None = None
+        name: str | None = None
+        modules: list[_StackModule] = []
+
+    _single_layer = msgspec.json.Decoder(_StackLayer)
+
+    def _module_dict(module: "_StackModule") -> dict:
+        result = {"id": module.id, "name": module.name}
+        for key in ("data", "refs"):
+            raw = getattr(module, key)
+            if raw is not msgspec.UNSET:
+                result[key] = _codec.loads(memoryview(raw))
+        return result
+
+    def _layer_dict(layer: "_StackLayer", modules: AbstractSet[str]) -> dict:
+        return {
+            "id": layer.id,
+            "name": layer.name,
+            "modules": [_module_dict(m) for m in layer.modules if m.name in modules],
+        }
+
+
+def _select_layer(layer: dict, modules: AbstractSet[str]) -> dict:
+    return {
+        **layer,
+        "modules": [m for m in layer.get("modules", []) if m.get("name") in modules],
+    }
+
+
+def decode_layer(
+    data: bytes | memoryview, modules: AbstractSet[str] | None = None
+) -> dict:
+    # one layer of a configuration stack, with modules set only those modules are decoded
+    if modules is not None and msgspec is not None:
+        try:
+            return _layer_dict(_single_layer.decode(data), modules)
+        except msgspec.DecodeError:
+            pass
+    layer = _codec.loads(data)
+    return _select_layer(layer, modules) if modules is not None else layer
@@ -0,0 +1,278 @@
+from array import array
+from dataclasses import asdict, dataclass
+import json
+import math
+import re
+import threading
+import time
+from typing import IO
+
+# upper bounds in seconds of the latency histogram in the Prometheus export
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+@dataclass
+class RequestRecord:
+    vco: str
+    operation: str
+    # JSON-RPC calls carried by the request, more than 1 for batches
+    calls: int
+    status: int
+    attempts: int
+    # wall time from the first rate limiter wait to the final response
+    seconds: float
+    limiter_wait_seconds: float
+    # time spent waiting before retried attempts, after 429s and 5xx responses
+    retry_wait_seconds: float
+    throttled: int
+    bytes_sent: int
+    bytes_received: int
+
+
+class OperationStats:
+    def __init__(self):
+        self.requests = 0
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.throttled = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.seconds = 0.0
+        self.limiter_wait_seconds = 0.0
+        self.retry_wait_seconds = 0.0
+        self.decodes = 0
+        self.decode_seconds = 0.0
+        self.latencies = array("d")
+
+    def add(self, record: RequestRecord):
+        self.requests += 1
+        self.calls += record.calls
+        self.errors += record.status >= 400
+        self.retries += record.attempts - 1
+        self.throttled += record.throttled
+        self.bytes_sent += record.bytes_sent
+        self.bytes_received += record.bytes_received
+        self.seconds += record.seconds
+        self.limiter_wait_seconds += record.limiter_wait_seconds
+        self.retry_wait_seconds += record.retry_wait_seconds
+        self.latencies.append(record.seconds)
+
+    def percentile(self, q: float) -> float:
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+
+def rpc_operation(body: dict | list) -> str:
+    if isinstance(body, dict):
+        return body.get("method", "portal")
+    methods = {r.get("method") for r in body}
+    return f"{methods.pop()} [batch]" if len(methods) == 1 else "[mixed batch]"
+
+
+def http_operation(http_method: str, path: str) -> str:
+    # ids in v2 paths are replaced so every edge lands on the same operation
+    path = re.sub(
+        r"/enterprises/[^/?]+", "/enterprises/{enterprise}", path.split("?")[0]
+    )
+    path = re.sub(r"/edges/[^/?]+", "/edges/{edge}", path)
+    if path.startswith("/api/sdwan/v2/"):
+        return f"v2 {http_method} {path[len('/api/sdwan/v2'):]}"
+    return f"{http_method} {path}"
+
+
+def body_size(body) -> int:
+    if body is None:
+        return 0
+    if isinstance(body, str):
+        return len(body.encode())
+    return len(body)
+
+
+class Recorder:
+    # per VCO and operation totals for every request, plus an optional JSON lines trace of each one
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats: dict[tuple[str, str], OperationStats] = {}
+        self.trace: IO[str] | None = None
+
+    def open_trace(self, path: str):
+        with self.lock:
+            self.trace = open(path, "a")
+
+    def close(self):
+        with self.lock:
+            if self.trace is not None:
+                self.trace.close()
+                self.trace = None
+
+    def _stats(self, vco: str, operation: str) -> OperationStats:
+        stats = self.stats.get((vco, operation))
+        if stats is None:
+            stats = self.stats[(vco, operation)] = OperationStats()
+        return stats
+
+    def record(self, record: RequestRecord):
+        with self.lock:
+            self._stats(record.vco, record.operation).add(record)
+            if self.trace is not None:
+                self.trace.write(
+                    json.dumps(
+                        {"event": "request", "at": time.time(), **asdict(record)}
+                    )
+                    + "\n"
+                )
+
+    def record_decode(self, vco: str, operation: str, seconds: float, nbytes: int):
+        with self.lock:
+            stats = self._stats(vco, operation)
+            stats.decodes += 1
+            stats.decode_seconds += seconds
+            if self.trace is not None:
+                self.trace.write(
+                    json.dumps(
+                        {
+                            "event": "decode",
+                            "at": time.time(),
+                            "vco": vco,
+                            "operation": operation,
+                            "seconds": seconds,
+                            "bytes": nbytes,
+                        }
+                    )
+                    + "\n"
+                )
+
+    def reset(self):
+        with self.lock:
+            self.stats = {}
+
+    def summary(self) -> str:
+        with self.lock:
+            items = sorted(self.stats.items(), key=lambda item: -item[1].seconds)
+            # fleet runs talk to several VCOs, each row then names its VCO
+            several_vcos = len({vco for vco, _ in self.stats}) > 1
+            lines = [
+                f"{'operation':<48} {'reqs':>6} {'calls':>6} {'err':>4} {'retry':>5} "
+                f"{'sent':>9} {'recv':>9} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8} "
+                f"{'limiter':>8} {'backoff':>8} {'decode':>8}"
+            ]
+            for (vco, operation), stats in items:
+                if several_vcos:
+                    operation = f"{vco} {operation}"
+                lines.append(
+                    f"{operation[:48]:<48} {stats.requests:>6} {stats.calls:>6} {stats.errors:>4} "
+                    f"{stats.retries:>5} {_size(stats.bytes_sent):>9} {_size(stats.bytes_received):>9} "
+                    f"{_ms(stats.percentile(0.5)):>8} {_ms(stats.percentile(0.9)):>8} "
+                    f"{_ms(stats.percentile(0.99)):>8} {_ms(max(stats.latencies, default=0.0)):>8} "
+                    f"{stats.limiter_wait_seconds:>7.1f}s {stats.retry_wait_seconds:>7.1f}s "
+                    f"{stats.decode_seconds:>7.2f}s"
+                )
+            return "\n".join(lines)
+
+    def prometheus(self) -> str:
+        # text exposition format, one series per VCO and operation
+        metrics = {
+            "vco_requests_total": (
+                "counter",
+                "HTTP requests sent",
+                lambda s: s.requests,
+            ),
+            "vco_calls_total": (
+                "counter",
+                "JSON-RPC calls sent, batches count each call",
+                lambda s: s.calls,
+            ),
+            "vco_errors_total": (
+                "counter",
+                "requests whose final status was 4xx or 5xx",
+                lambda s: s.errors,
+            ),
+            "vco_retries_total": ("counter", "retried attempts", lambda s: s.retries),
+            "vco_throttled_total": (
+                "counter",
+                "HTTP 429 responses",
+                lambda s: s.throttled,
+            ),
+            "vco_sent_bytes_total": (
+                "counter",
+                "request body bytes",
+                lambda s: s.bytes_sent,
+            ),
+            "vco_received_bytes_total": (
+                "counter",
+                "response body bytes",
+                lambda s: s.bytes_received,
+            ),
+            "vco_limiter_wait_seconds_total": (
+                "counter",
+                "time waiting for the rate limiter",
+                lambda s: s.limiter_wait_seconds,
+            ),
+            "vco_retry_wait_seconds_total": (
+                "counter",
+                "time waiting before retries",
+                lambda s: s.retry_wait_seconds,
+            ),
+            "vco_decode_seconds_total": (
+                "counter",
+                "time decoding JSON responses",
+                lambda s: s.decode_seconds,
+            ),
+        }
+        with self.lock:
+            lines = []
+            for name, (kind, help_text, value) in metrics.items():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for (vco, operation), stats in self.stats.items():
+                    lines.append(f"{name}{{{_labels(vco, operation)}}} {value(stats)}")
+
+            name = "vco_request_duration_seconds"
+            lines.append(
+                f"# HELP {name} request latency including rate limiter waits and retries"
+            )
+            lines.append(f"# TYPE {name} histogram")
+            for (vco, operation), stats in self.stats.items():
+                labels = _labels(vco, operation)
+                for bound in LATENCY_BUCKETS:
+                    count = sum(1 for latency in stats.latencies if latency <= bound)
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(
+                    f'{name}_bucket{{{labels},le="+Inf"}} {len(stats.latencies)}'
+                )
+                lines.append(f"{name}_sum{{{labels}}} {stats.seconds}")
+                lines.append(f"{name}_count{{{labels}}} {len(stats.latencies)}")
+            return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str):
+        with open(path, "w") as fp:
+            fp.write(self.prometheus())
+
+
+def _labels(vco: str, operation: str) -> str:
+    escaped = operation.replace("\\", "\\\\").replace('"', '\\"')
+    return f'vco="{vco}",operation="{escaped}"'
+
+
+def _ms(seconds: float) -> str:
+    return f"{seconds * 1000:.0f}ms"
+
+
+def _size(nbytes: int) -> str:
+    size = float(nbytes)
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.0f}{unit}"
+        size /= 1024
+    return f"{size:.1f}GB"
+
+
+# one recorder per process, shared by every session and async client
+_recorder = Recorder()
+
+
+def recorder() -> Recorder:
+    return _recorder
@@ -0,0 +1,56 @@
+from dataclasses import dataclass, field
+import jsonpatch
+
+from vcoclient.codec import codec
+
+
+@dataclass
+class ModuleUpdate:
+    module_id: int
+    # the _update payload for configuration/updateConfigurationModule, empty when nothing changed
+    update: dict = field(default_factory=dict)
+    diff_ops: int = 0
+    diff_bytes: int = 0
+    full_bytes: int = 0
+
+    @property
+    def changed(self) -> bool:
+        return len(self.update) > 0
+
+    def describe(self) -> str:
+        if not self.changed:
+            return "unchanged, update skipped"
+        return (
+            f"{self.diff_ops} change(s), {self.diff_bytes} byte diff, "
+            f"sending {', '.join(self.update)} ({self.full_bytes} bytes)"
+        )
+
+
+def _size(value) -> int:
+    return len(codec().dumps(value))
+
+
+def plan_module_update(
+    module: dict, new_data: dict | None, new_refs: dict | None = None
+) -> ModuleUpdate:
+    # updateConfigurationModule replaces data and refs wholesale,
+    # so the smallest valid update leaves out whichever of them did not change
+    plan = ModuleUpdate(module["id"])
+    diff = []
+    for key, new_value in (("data", new_data), ("refs", new_refs)):
+        if new_value is None:
+            continue
+        old_value = module.get(key)
+        if old_value == new_value:
+            continue
+        if isinstance(old_value, dict):
+            ops = jsonpatch.make_patch(old_value, new_value).patch
+        else:
+            ops = [{"op": "replace", "path": "", "value": new_value}]
+        diff.extend({**op, "path": f"/{key}{op['path']}"} for op in ops)
+        plan.update[key] = new_value
+
+    plan.diff_ops = len(diff)
+    plan.diff_bytes = _size(diff) if diff else 0
+    plan.full_bytes = _size(plan.update) if plan.changed else 0
+    return plan
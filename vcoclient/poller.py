@@ -0,0 +1,162 @@
+from concurrent.futures import Future
+import heapq
+import itertools
+import random
+import threading
+import time
+from typing import Any, Callable, Generic, Hashable, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+
+
+class _Pending:
+    def __init__(self, key, deadline: float | None):
+        self.key = key
+        self.deadline = deadline
+        self.attempts = 0
+        self.last_error: Exception | None = None
+        self.future: Future = Future()
+
+
+class Poller(Generic[K]):
+    # one scheduler thread for every pending key, however many there are
+    # check() is called with all keys which fall due within coalesce_seconds of each other, so a
+    # batched VCO call can cover them, and returns {key: result} for the keys that are done.
+    # a result which is an exception fails that key, keys left out are polled again after a backoff
+    def __init__(
+        self,
+        check: Callable[[list[K]], dict[K, Any]],
+        initial_delay: float = 10.0,
+        max_delay: float = 300.0,
+        multiplier: float = 2.0,
+        jitter: float = 0.25,
+        timeout: float | None = None,
+        coalesce_seconds: float = 2.0,
+        max_batch: int = 200,
+    ):
+        self.check = check
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.timeout = timeout
+        self.coalesce_seconds = coalesce_seconds
+        self.max_batch = max_batch
+
+        self.pending: dict[K, _Pending] = {}
+        self.schedule: list[tuple[float, int, K]] = []
+        self.seq = itertools.count()
+        self.wakeup = threading.Condition()
+        self.thread: threading.Thread | None = None
+        self.closed = False
+
+    def delay(self, attempts: int) -> float:
+        # exponential backoff with jitter, so keys watched at the same moment spread out over time
+        delay = min(
+            self.max_delay, self.initial_delay * self.multiplier ** max(0, attempts - 1)
+        )
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def watch(
+        self, key: K, timeout: float | None = None, first_poll: float = 0.0
+    ) -> Future:
+        # returns at once, watching a key that is already pending returns the existing future
+        with self.wakeup:
+            if self.closed:
+                raise RuntimeError("poller is closed")
+            item = self.pending.get(key)
+            if item is not None:
+                return item.future
+
+            timeout = timeout if timeout is not None else self.timeout
+            now = time.monotonic()
+            item = _Pending(key, now + timeout if timeout is not None else None)
+            self.pending[key] = item
+            heapq.heappush(self.schedule, (now + first_poll, next(self.seq), key))
+
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self._run, name="vco-poller", daemon=True
+                )
+                self.thread.start()
+            self.wakeup.notify()
+            return item.future
+
+    def close(self):
+        # pending futures are cancelled, the scheduler thread exits once its current check returns
+        with self.wakeup:
+            self.closed = True
+            for item in self.pending.values():
+                item.future.cancel()
+            self.pending.clear()
+            self.schedule.clear()
+            self.wakeup.notify()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+
+    def _due(self) -> list[_Pending] | None:
+        with self.wakeup:
+            while not self.closed:
+                if not self.schedule:
+                    self.wakeup.wait()
+                    continue
+                wait = self.schedule[0][0] - time.monotonic()
+                if wait > 0:
+                    self.wakeup.wait(wait)
+                    continue
+
+                horizon = time.monotonic() + self.coalesce_seconds
+                due = []
+                while (
+                    self.schedule
+                    and self.schedule[0][0] <= horizon
+                    and len(due) < self.max_batch
+                ):
+                    _, _, key = heapq.heappop(self.schedule)
+                    item = self.pending.get(key)
+                    if item is not None:
+                        due.append(item)
+                if due:
+                    return due
+            return None
+
+    def _run(self):
+        while True:
+            due = self._due()
+            if due is None:
+                return
+
+            try:
+                done = self.check([item.key for item in due])
+                error = None
+            except Exception as e:
+                done = {}
+                error = e
+
+            now = time.monotonic()
+            with self.wakeup:
+                for item in due:
+                    if self.pending.get(item.key) is not item:
+                        continue
+                    item.attempts += 1
+                    if item.key in done:
+                        result = done[item.key]
+                        del self.pending[item.key]
+                        if isinstance(result, Exception):
+                            item.future.set_exception(result)
+                        else:
+                            item.future.set_result(result)
+                        continue
+
+                    if error is not None:
+                        item.last_error = error
+                    next_poll = now + self.delay(item.attempts)
+                    if item.deadline is not None and next_poll > item.deadline:
+                        del self.pending[item.key]
+                        timeout = TimeoutError(
+                            f"{item.key} still pending after {item.attempts} poll(s)"
+                        )
+                        timeout.__cause__ = item.last_error
+                        item.future.set_exception(timeout)
+                        continue
+                    heapq.heappush(self.schedule, (next_poll, next(self.seq), item.key))
@@ -0,0 +1,300 @@
+from dataclasses import dataclass, field
+import itertools
+import threading
+import time
+from typing import Any, Callable
+from urllib.parse import urlsplit
+
+from requests import PreparedRequest, Response, Session
+
+from vcoclient.codec import codec
+from vcoclient.metrics import (
+    RequestRecord,
+    body_size,
+    http_operation,
+    recorder,
+    rpc_operation,
+)
+from vcoclient.ratelimit import limiter_for, parse_retry_after
+
+# JSON-RPC ids only need to be unique within a batch, a process-wide counter keeps them unique everywhere
+_ids = itertools.count(1)
+_ids_lock = threading.Lock()
+
+# VCOs which rejected a batch array outright, these get sequential calls from then on
+_batch_unsupported: set[str] = set()
+
+
+def next_id() -> int:
+    with _ids_lock:
+        return next(_ids)
+
+
+@dataclass
+class PortalCall:
+    method: str
+    params: dict = field(default_factory=dict)
+
+
+@dataclass
+class PortalResult:
+    call: PortalCall
+    result: Any = None
+    error: dict | None = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def rpc_request(method: str, params: dict, request_id: int | None = None) -> dict:
+    return {
+        "jsonrpc": "2.0",
+        "id": request_id if request_id is not None else next_id(),
+        "method": method,
+        "params": params,
+    }
+
+
+def record_request(
+    vco: str,
+    operation: str,
+    body,
+    resp,
+    attempts: int,
+    started: float,
+    limiter_wait: float,
+    retry_wait: float,
+    throttled: int,
+):
+    # works for requests and httpx responses, both keep the sent request on the response
+    request = resp.request
+    sent = request.body if isinstance(request, PreparedRequest) else request.content
+    recorder().record(
+        RequestRecord(
+            vco,
+            operation,
+            len(body) if isinstance(body, list) else 1,
+            resp.status_code,
+            attempts,
+            time.perf_counter() - started,
+            limiter_wait,
+            retry_wait,
+            throttled,
+            body_size(sent),
+            len(resp.content),
+        )
+    )
+
+
+def decode_json(
+    vco: str,
+    resp,
+    operation: str | None = None,
+    decoder: Callable[[bytes], Any] | None = None,
+) -> Any:
+    if operation is None:
+        operation = http_operation(
+            resp.request.method, urlsplit(str(resp.request.url)).path
+        )
+    started = time.perf_counter()
+    body = (decoder or codec().loads)(resp.content)
+    recorder().record_decode(
+        vco, operation, time.perf_counter() - started, len(resp.content)
+    )
+    return body
+
+
+def send(
+    s: Session,
+    vco: str,
+    http_method: str,
+    url: str,
+    retry_server_errors: bool = True,
+    max_attempts: int = 5,
+    operation: str | None = None,
+    **kwargs,
+) -> Response:
+    # every HTTP request to a VCO waits on that VCO's rate limiter and feeds the outcome back to it
+    # 429s are always retried since the VCO did not process the request
+    limiter = limiter_for(vco)
+    if operation is None:
+        operation = http_operation(http_method, urlsplit(url).path)
+    body = kwargs.pop("json", None)
+    if body is not None:
+        kwargs["data"] = codec().dumps(body)
+        kwargs["headers"] = {
+            "Content-Type": "application/json",
+            **kwargs.get("headers", {}),
+        }
+    started = time.perf_counter()
+    limiter_wait = retry_wait = 0.0
+    throttled = 0
+    for attempt in range(1, max_attempts + 1):
+        wait = limiter.acquire()
+        if attempt == 1:
+            limiter_wait += wait
+        else:
+            retry_wait += wait
+        resp = s.request(http_method, url, **kwargs)
+        if resp.status_code == 429:
+            throttled += 1
+            limiter.on_throttle(parse_retry_after(resp.headers.get("Retry-After")))
+        elif resp.status_code >= 500:
+            limiter.on_server_error()
+            if not retry_server_errors:
+                break
+        else:
+            limiter.on_success()
+            break
+    record_request(
+        vco,
+        operation,
+        body,
+        resp,
+        attempt,
+        started,
+        limiter_wait,
+        retry_wait,
+        throttled,
+    )
+    return resp
+
+
+def post_portal(s: Session, vco: str, body: dict | list) -> Response:
+    return send(
+        s,
+        vco,
+        "POST",
+        f"https://{vco}/portal/",
+        operation=rpc_operation(body),
+        json=body,
+    )
+
+
+def call(
+    s: Session,
+    vco: str,
+    method: str,
+    params: dict,
+    decoder: Callable[[bytes], Any] | None = None,
+):
+    resp = decode_json(
+        vco, post_portal(s, vco, rpc_request(method, params)), method, decoder
+    )
+    if "result" not in resp:
+        raise ValueError(codec().dumps(resp, indent=True).decode())
+    return resp["result"]
+
+
+def single_result(c: PortalCall, resp: Any) -> PortalResult:
+    if not isinstance(resp, dict):
+        return PortalResult(c, error={"message": "response is not a JSON-RPC object"})
+    if "result" in resp:
+        return PortalResult(c, result=resp["result"])
+    return PortalResult(c, error=resp.get("error", resp))
+
+
+def call_result(
+    vco: str, c: PortalCall, http_resp, decoder: Callable[[bytes], Any] | None = None
+) -> PortalResult:
+    # a body that is not JSON, such as a proxy's error page, only fails its own call
+    try:
+        resp = decode_json(vco, http_resp, c.method, decoder)
+    except ValueError as e:
+        return PortalResult(
+            c,
+            error={
+                "message": f"HTTP {http_resp.status_code}, response is not JSON: {e}"
+            },
+        )
+    return single_result(c, resp)
+
+
+def batch_results(
+    calls: list[PortalCall], ids: list[int], status_code: int, resp
+) -> list[PortalResult] | None:
+    # a single error object instead of an array means the VCO rejected the batch itself
+    if status_code >= 400 or not isinstance(resp, list):
+        return None
+
+    by_id = {r.get("id"): r for r in resp if isinstance(r, dict)}
+    results = []
+    for c, i in zip(calls, ids):
+        r = by_id.get(i)
+        if r is None:
+            results.append(PortalResult(c, error={"message": "no response for call"}))
+        else:
+            results.append(single_result(c, r))
+    return results
+
+
+def batch_supported(vco: str) -> bool:
+    return vco not in _batch_unsupported
+
+
+def mark_batch_unsupported(vco: str):
+    _batch_unsupported.add(vco)
+
+
+def batch_rejected(status_code: int, resp) -> bool:
+    # the portal refusing batch arrays as such, a 4xx other than 429 or an invalid request or
+    # unknown method error, as opposed to a batch that failed this time (5xx, 429, a garbled body)
+    if 400 <= status_code < 500 and status_code != 429:
+        return True
+    error = resp.get("error") if isinstance(resp, dict) else None
+    return isinstance(error, dict) and error.get("code") in (-32600, -32601)
+
+
+def _call_sequential(
+    s: Session,
+    vco: str,
+    calls: list[PortalCall],
+    decoder: Callable[[bytes], Any] | None = None,
+) -> list[PortalResult]:
+    return [
+        call_result(
+            vco, c, post_portal(s, vco, rpc_request(c.method, c.params)), decoder
+        )
+        for c in calls
+    ]
+
+
+def _call_chunk(
+    s: Session,
+    vco: str,
+    calls: list[PortalCall],
+    decoder: Callable[[bytes], Any] | None = None,
+) -> list[PortalResult] | None:
+    ids = [next_id() for _ in calls]
+    body = [rpc_request(c.method, c.params, i) for c, i in zip(calls, ids)]
+    http_resp = post_portal(s, vco, body)
+    try:
+        resp = decode_json(vco, http_resp, rpc_operation(body), decoder)
+    except ValueError:
+        return None
+    if batch_rejected(http_resp.status_code, resp):
+        mark_batch_unsupported(vco)
+    return batch_results(calls, ids, http_resp.status_code, resp)
+
+
+def call_batch(
+    s: Session,
+    vco: str,
+    calls: list[PortalCall],
+    chunk_size: int = 50,
+    decoder: Callable[[bytes], Any] | None = None,
+) -> list[PortalResult]:
+    # decoder, when given, must handle both a single response object and a batch array
+    results = []
+    for start in range(0, len(calls), chunk_size):
+        chunk = calls[start : start + chunk_size]
+        chunk_results = None
+        if batch_supported(vco):
+            chunk_results = _call_chunk(s, vco, chunk, decoder)
+        # a failed batch is retried call by call, later chunks are batched again unless the VCO
+        # rejected batches as such
+        if chunk_results is None:
+            chunk_results = _call_sequential(s, vco, chunk, decoder)
+        results.extend(chunk_results)
+    return results
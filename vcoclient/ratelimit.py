@@ -0,0 +1,141 @@
+import asyncio
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+import threading
+import time
+
+
+@dataclass
+class LimiterStats:
+    rate: float
+    calls: int
+    waited_calls: int
+    wait_seconds: float
+    throttled: int
+    server_errors: int
+
+
+class RateLimiter:
+    # token bucket whose refill rate follows AIMD:
+    # every healthy response nudges the rate up towards max_rps,
+    # 429s and 5xx responses halve it, and Retry-After blocks all callers until it passes
+    def __init__(
+        self,
+        max_rps: float = 10.0,
+        min_rps: float = 0.5,
+        initial_rps: float | None = None,
+        increase: float = 0.25,
+        decrease: float = 0.5,
+    ):
+        self.max_rps = max_rps
+        self.min_rps = min(min_rps, max_rps)
+        self.rate = (
+            initial_rps if initial_rps is not None else max(self.min_rps, max_rps / 2)
+        )
+        self.increase = increase
+        self.decrease = decrease
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+        self.calls = 0
+        self.waited_calls = 0
+        self.wait_seconds = 0.0
+        self.throttled = 0
+        self.server_errors = 0
+
+    def _refill(self, now: float):
+        capacity = max(1.0, self.rate)
+        self.tokens = min(capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self) -> float:
+        # takes a token, possibly borrowing against future refills, and returns how long to wait for it
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            wait = max(0.0, self.blocked_until - now)
+            if self.tokens < 1.0:
+                wait = max(wait, (1.0 - self.tokens) / self.rate)
+            self.tokens -= 1.0
+
+            self.calls += 1
+            if wait > 0:
+                self.waited_calls += 1
+                self.wait_seconds += wait
+            return wait
+
+    def acquire(self) -> float:
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self) -> float:
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def on_success(self):
+        with self.lock:
+            self.rate = min(self.max_rps, self.rate + self.increase)
+
+    def on_throttle(self, retry_after: float | None = None):
+        with self.lock:
+            self.throttled += 1
+            self.rate = max(self.min_rps, self.rate * self.decrease)
+            if retry_after is not None:
+                self.blocked_until = max(
+                    self.blocked_until, time.monotonic() + retry_after
+                )
+            self.tokens = min(self.tokens, 0.0)
+
+    def on_server_error(self):
+        with self.lock:
+            self.server_errors += 1
+            self.rate = max(self.min_rps, self.rate * self.decrease)
+
+    def stats(self) -> LimiterStats:
+        with self.lock:
+            return LimiterStats(
+                self.rate,
+                self.calls,
+                self.waited_calls,
+                self.wait_seconds,
+                self.throttled,
+                self.server_errors,
+            )
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+# one limiter per VCO, shared by every session talking to it
+_limiters: dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def limiter_for(vco: str) -> RateLimiter:
+    with _limiters_lock:
+        limiter = _limiters.get(vco)
+        if limiter is None:
+            limiter = _limiters[vco] = RateLimiter()
+        return limiter
+
+
+def set_rate_limit(vco: str, max_rps: float) -> RateLimiter:
+    with _limiters_lock:
+        limiter = _limiters[vco] = RateLimiter(max_rps=max_rps)
+        return limiter
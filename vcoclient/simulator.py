@@ -0,0 +1,489 @@
+import asyncio
+from collections import deque
+import copy
+from dataclasses import dataclass
+import json
+import random
+import threading
+import time
+from typing import Any
+from urllib.parse import parse_qs, urlsplit
+import uuid
+
+import httpx
+from requests import PreparedRequest, Response
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+from vcoclient.transport import set_transport
+
+
+@dataclass
+class SimulatorConfig:
+    edge_count: int = 100
+    links_per_edge: int = 2
+    # fraction of WAN links measured with SLOW_START and reporting bandwidth in the burst range
+    burst_fraction: float = 0.1
+    latency_ms: float = 50.0
+    latency_jitter_ms: float = 20.0
+    # added once per call in a JSON-RPC batch on top of the request latency
+    per_call_latency_ms: float = 2.0
+    # chance of a 500 or 429 for a whole HTTP request, and of an error object for one JSON-RPC call
+    error_rate: float = 0.0
+    throttle_rate: float = 0.0
+    rpc_error_rate: float = 0.0
+    # requests above this rate over the last second get a 429, None disables the check
+    max_rps: float | None = None
+    retry_after_seconds: float = 1.0
+    batch_supported: bool = True
+    # older VCOs only serve whole configuration stacks
+    modules_method_supported: bool = True
+    page_size: int = 100
+    # edges created through the API activate this long afterwards, which is when the VCO provisions
+    # their ZScaler CSS site, None leaves them pending
+    activation_delay_seconds: float | None = None
+    seed: int | None = None
+
+
+def _timestamp(t: float) -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(t))
+
+
+def _device_settings() -> dict:
+    return {
+        "routedInterfaces": [
+            {
+                "name": name,
+                "addressing": {"type": "DHCP"},
+                "l2": {"probeInterval": "1", "autonegotiation": True},
+                "subinterfaces": [{"addressing": {}}, {"addressing": {}}],
+                "cellular": {},
+                "override": False,
+            }
+            for name in ["GE1", "GE2", "GE3", "GE4", "GE5", "GE6"]
+        ],
+        "segments": [{"routes": {"static": []}}],
+        "lan": {"networks": [{"vlanId": 999}]},
+        "zscaler": {
+            "config": {
+                "enabled": False,
+                "cloud": "",
+                "provider": {},
+                "sublocations": [],
+            },
+            "deployment": {},
+        },
+    }
+
+
+class VcoSimulator:
+    # in-memory model of one enterprise on a VCO, enough of the portal and v2 API for both tools
+    # handle() is thread-safe, latency is added by the transports outside the lock
+    def __init__(
+        self,
+        config: SimulatorConfig | None = None,
+        enterprise_logical_id: str = "simulated-enterprise",
+    ):
+        self.config = config if config is not None else SimulatorConfig()
+        self.enterprise_logical_id = enterprise_logical_id
+        self.rng = random.Random(self.config.seed)
+        self.lock = threading.Lock()
+        self.request_times: deque[float] = deque()
+        self.counts: dict[str, int] = {}
+
+        self.edges: dict[int, dict] = {}
+        self.edges_by_logical_id: dict[str, dict] = {}
+        self.links: dict[int, list[dict]] = {}
+        self.stacks: dict[int, list[dict]] = {}
+        self.modules: dict[int, dict] = {}
+        self.activations: dict[int, float] = {}
+        self.next_edge_id = 1
+
+        # every edge shares the same profile layer, as edges on one profile do on a real VCO
+        self.profile_layer = {
+            "id": 1,
+            "name": "Simulated Profile",
+            "modules": [
+                {
+                    "id": 1,
+                    "name": "deviceSettings",
+                    "data": _device_settings(),
+                    "refs": {},
+                },
+                {"id": 2, "name": "firewall", "data": {"inbound": [], "outbound": []}},
+                {"id": 3, "name": "QOS", "data": {"rules": []}},
+            ],
+        }
+        for module in self.profile_layer["modules"]:
+            self.modules[module["id"]] = module
+
+        now = time.time()
+        for _ in range(self.config.edge_count):
+            self.create_edge(
+                {"name": f"sim-edge-{self.next_edge_id}"}, now, "CONNECTED"
+            )
+
+    def create_edge(self, body: dict, now: float, edge_state: str = "PENDING") -> dict:
+        edge_id = self.next_edge_id
+        self.next_edge_id += 1
+        edge = {
+            "id": edge_id,
+            "logicalId": str(uuid.UUID(int=self.rng.getrandbits(128))),
+            "name": body.get("name", f"sim-edge-{edge_id}"),
+            "modelNumber": body.get("modelNumber", "edge6X0"),
+            "edgeState": edge_state,
+            "site": body.get("site", {}),
+            "created": _timestamp(now),
+            "modified": _timestamp(now),
+        }
+        self.edges[edge_id] = edge
+        self.edges_by_logical_id[edge["logicalId"]] = edge
+        self.links[edge_id] = [
+            {
+                "internalId": str(uuid.UUID(int=self.rng.getrandbits(128))),
+                "name": f"WAN{k + 1}",
+                "isp": self.rng.choice(["ISP-A", "ISP-B", "ISP-C"]),
+                "burst": self.rng.random() < self.config.burst_fraction,
+            }
+            for k in range(self.config.links_per_edge)
+        ]
+        if edge_state == "PENDING" and self.config.activation_delay_seconds is not None:
+            self.activations[edge_id] = now + self.config.activation_delay_seconds
+        return edge
+
+    def activate_due(self, now: float):
+        for edge_id, at in list(self.activations.items()):
+            if at <= now:
+                del self.activations[edge_id]
+                self.edges[edge_id]["edgeState"] = "CONNECTED"
+                self.edges[edge_id]["modified"] = _timestamp(now)
+                if edge_id in self.stacks:
+                    self.add_css_site(edge_id)
+
+    def add_css_site(self, edge_id: int):
+        data = self.modules[edge_id * 10 + 1]["data"]
+        data["segments"][0]["css"] = {
+            "enabled": True,
+            "sites": [
+                {"name": f"{self.edges[edge_id]['name']}-css", "type": "ZSCALER"}
+            ],
+        }
+
+    def stack(self, edge_id: int) -> list[dict]:
+        # edge layers are built on first use so large fleets start quickly
+        stack = self.stacks.get(edge_id)
+        if stack is None:
+            edge_layer = {
+                "id": 1000 + edge_id,
+                "name": self.edges[edge_id]["name"],
+                "modules": [
+                    {
+                        "id": edge_id * 10 + 1,
+                        "name": "deviceSettings",
+                        "data": _device_settings(),
+                        "refs": {
+                            "deviceSettings:css:site": {},
+                            "deviceSettings:zscaler:location": {},
+                        },
+                    },
+                    {
+                        "id": edge_id * 10 + 2,
+                        "name": "WAN",
+                        "data": {
+                            "links": [
+                                {
+                                    "internalId": link["internalId"],
+                                    "name": link["name"],
+                                    "isp": link["isp"],
+                                    "interfaces": [f"GE{k + 3}"],
+                                    "bwMeasurement": (
+                                        "SLOW_START"
+                                        if link["burst"]
+                                        else "USER_DEFINED"
+                                    ),
+                                }
+                                for k, link in enumerate(self.links[edge_id])
+                            ]
+                        },
+                    },
+                ],
+            }
+            for module in edge_layer["modules"]:
+                self.modules[module["id"]] = module
+            stack = [edge_layer, self.profile_layer]
+            self.stacks[edge_id] = stack
+            if self.edges[edge_id]["edgeState"] != "PENDING":
+                self.add_css_site(edge_id)
+        return stack
+
+    def link_metrics(self) -> list[dict]:
+        metrics = []
+        for edge_id, links in self.links.items():
+            edge = self.edges[edge_id]
+            for link in links:
+                if link["burst"]:
+                    down, up = self.rng.uniform(176, 199), self.rng.uniform(20, 170)
+                else:
+                    down, up = self.rng.uniform(20, 170), self.rng.uniform(20, 170)
+                metrics.append(
+                    {
+                        "link": {
+                            "edgeId": edge_id,
+                            "edgeName": edge["name"],
+                            "internalId": link["internalId"],
+                            "displayName": link["name"],
+                            "isp": link["isp"],
+                        },
+                        "bpsOfBestPathRx": down * 1000000,
+                        "bpsOfBestPathTx": up * 1000000,
+                    }
+                )
+        return metrics
+
+    def update_module(self, params: dict, now: float) -> dict:
+        module_id = params["id"]
+        edge_id = module_id // 10
+        if module_id not in self.modules and edge_id in self.edges:
+            self.stack(edge_id)
+        module = self.modules.get(module_id)
+        if module is None:
+            raise KeyError(f"configuration module {module_id} not found")
+
+        update = params.get("_update", {})
+        if "data" in update:
+            module["data"] = copy.deepcopy(update["data"])
+            # as on the portal, the CSS site of an activated edge survives a deviceSettings write
+            # made from a copy fetched before activation
+            if (
+                module_id == edge_id * 10 + 1
+                and edge_id in self.edges
+                and self.edges[edge_id]["edgeState"] != "PENDING"
+            ):
+                segments = module["data"].get("segments") or []
+                if segments and not (segments[0].get("css") or {}).get("sites"):
+                    self.add_css_site(edge_id)
+        if "refs" in update:
+            module["refs"] = copy.deepcopy(update["refs"])
+        if edge_id in self.edges:
+            self.edges[edge_id]["modified"] = _timestamp(now)
+        return {"id": module_id, "rows": 1}
+
+    def rpc_result(self, method: str, params: dict, now: float) -> Any:
+        if method == "enterprise/getEnterpriseEdges":
+            return [dict(edge) for edge in self.edges.values()]
+        if method == "edge/getEdge":
+            if "logicalId" in params:
+                edge = self.edges_by_logical_id.get(params["logicalId"])
+            else:
+                edge = self.edges.get(params["id"]) if "id" in params else None
+            if edge is None:
+                raise KeyError("edge not found")
+            return dict(edge)
+        if method == "edge/getEdgeConfigurationStack":
+            if params.get("edgeId") not in self.edges:
+                raise KeyError("edge not found")
+            return copy.deepcopy(self.stack(params["edgeId"]))
+        if (
+            method == "edge/getEdgeConfigurationModules"
+            and self.config.modules_method_supported
+        ):
+            if params.get("edgeId") not in self.edges:
+                raise KeyError("edge not found")
+            names = params.get("modules")
+            return {
+                module["name"]: copy.deepcopy(module)
+                for module in self.stack(params["edgeId"])[0]["modules"]
+                if names is None or module["name"] in names
+            }
+        if method == "configuration/updateConfigurationModule":
+            return self.update_module(params, now)
+        if method == "monitoring/getAggregateEdgeLinkMetrics":
+            return self.link_metrics()
+        if method == "async/getStatus":
+            return {
+                "apiToken": params.get("apiToken"),
+                "status": "COMPLETE",
+                "result": {},
+            }
+        if method == "license/getEnterpriseEdgeLicenses":
+            return []
+        raise NotImplementedError(method)
+
+    def rpc(self, request: dict, now: float) -> dict:
+        method = request.get("method", "")
+        self.counts[method] = self.counts.get(method, 0) + 1
+        if self.rng.random() < self.config.rpc_error_rate:
+            error = {"code": -32000, "message": "simulated error"}
+        else:
+            try:
+                return {
+                    "jsonrpc": "2.0",
+                    "id": request.get("id"),
+                    "result": self.rpc_result(method, request.get("params", {}), now),
+                }
+            except NotImplementedError:
+                error = {"code": -32601, "message": f"method {method} not found"}
+            except KeyError as e:
+                error = {"code": -32000, "message": str(e.args[0])}
+        return {"jsonrpc": "2.0", "id": request.get("id"), "error": error}
+
+    def edges_page(self, query: dict) -> dict:
+        offset = int(query.get("nextPageLink", ["0"])[0])
+        edges = list(self.edges.values())
+        page = edges[offset : offset + self.config.page_size]
+        more = offset + len(page) < len(edges)
+        return {
+            "metaData": {
+                "more": more,
+                "nextPageLink": str(offset + len(page)) if more else None,
+            },
+            "data": [dict(edge) for edge in page],
+        }
+
+    def rate_exceeded(self, now: float) -> bool:
+        if self.config.max_rps is None:
+            return False
+        while self.request_times and now - self.request_times[0] > 1.0:
+            self.request_times.popleft()
+        if len(self.request_times) >= self.config.max_rps:
+            return True
+        self.request_times.append(now)
+        return False
+
+    def latency(self, body: Any) -> float:
+        calls = len(body) if isinstance(body, list) else 1
+        with self.lock:
+            jitter = self.rng.uniform(-1, 1) * self.config.latency_jitter_ms
+        return (
+            max(
+                0.0,
+                self.config.latency_ms
+                + jitter
+                + calls * self.config.per_call_latency_ms,
+            )
+            / 1000
+        )
+
+    def handle(
+        self, http_method: str, url: str, content: bytes
+    ) -> tuple[int, dict, bytes]:
+        parts = urlsplit(url)
+        body = json.loads(content) if content else {}
+        edges_path = f"/api/sdwan/v2/enterprises/{self.enterprise_logical_id}/edges"
+        now = time.time()
+
+        with self.lock:
+            self.activate_due(now)
+            if self.rate_exceeded(now) or self.rng.random() < self.config.throttle_rate:
+                return 429, {"Retry-After": str(self.config.retry_after_seconds)}, b""
+            if self.rng.random() < self.config.error_rate:
+                return 500, {}, b'{"error": "simulated server error"}'
+
+            if parts.path == "/portal/" and http_method == "POST":
+                if isinstance(body, list):
+                    if not self.config.batch_supported:
+                        result = {
+                            "jsonrpc": "2.0",
+                            "id": None,
+                            "error": {"code": -32600, "message": "invalid request"},
+                        }
+                        return 400, {}, json.dumps(result).encode()
+                    result = [self.rpc(r, now) for r in body]
+                else:
+                    result = self.rpc(body, now)
+            elif parts.path == edges_path and http_method == "GET":
+                self.counts["GET edges"] = self.counts.get("GET edges", 0) + 1
+                result = self.edges_page(parse_qs(parts.query))
+            elif parts.path == edges_path and http_method == "POST":
+                self.counts["POST edges"] = self.counts.get("POST edges", 0) + 1
+                edge = self.create_edge(body, now)
+                result = {
+                    "_href": f"{edges_path}/{edge['logicalId']}",
+                    "logicalId": edge["logicalId"],
+                }
+            elif parts.path.startswith(edges_path + "/") and http_method == "GET":
+                edge = self.edges_by_logical_id.get(parts.path[len(edges_path) + 1 :])
+                if edge is None:
+                    return 404, {}, b'{"error": "edge not found"}'
+                result = dict(edge)
+            else:
+                return 404, {}, b'{"error": "not found"}'
+
+        return 200, {"Content-Type": "application/json"}, json.dumps(result).encode()
+
+
+class SimulatorAdapter(BaseAdapter):
+    # requests transport adapter, mount it on a session for https://<vco>/
+    def __init__(self, simulator: VcoSimulator):
+        super().__init__()
+        self.simulator = simulator
+
+    def send(
+        self,
+        request: PreparedRequest,
+        stream=False,
+        timeout=None,
+        verify=True,
+        cert=None,
+        proxies=None,
+    ) -> Response:
+        content = request.body or b""
+        if isinstance(content, str):
+            content = content.encode()
+        assert isinstance(content, bytes), "streamed request bodies are not supported"
+        time.sleep(self.simulator.latency(json.loads(content) if content else None))
+        status, headers, body = self.simulator.handle(
+            request.method or "GET", request.url or "", content
+        )
+
+        resp = Response()
+        resp.status_code = status
+        resp.headers = CaseInsensitiveDict(headers)
+        resp._content = body
+        resp.encoding = "utf-8"
+        resp.url = request.url or ""
+        resp.request = request
+        return resp
+
+    def close(self):
+        pass
+
+
+class AsyncSimulatorTransport(httpx.AsyncBaseTransport):
+    # httpx transport for AsyncVcoClient, latency is awaited so concurrent requests overlap
+    def __init__(self, simulator: VcoSimulator):
+        self.simulator = simulator
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        content = await request.aread()
+        await asyncio.sleep(
+            self.simulator.latency(json.loads(content) if content else None)
+        )
+        status, headers, body = self.simulator.handle(
+            request.method, str(request.url), content
+        )
+        return httpx.Response(status, headers=headers, content=body, request=request)
+
+
+def install_simulator(vco: str, simulator: VcoSimulator | None = None) -> VcoSimulator:
+    # routes every session and async client created for vco to the simulator instead of the network
+    if simulator is None:
+        simulator = VcoSimulator()
+    set_transport(vco, SimulatorAdapter(simulator), AsyncSimulatorTransport(simulator))
+    return simulator
+
+
+def config_from_env(env: dict[str, str]) -> SimulatorConfig:
+    # VCO_SIM_<FIELD> overrides, e.g. VCO_SIM_EDGE_COUNT=5000 VCO_SIM_LATENCY_MS=120
+    config = SimulatorConfig()
+    for name, field in SimulatorConfig.__dataclass_fields__.items():
+        value = env.get(f"VCO_SIM_{name.upper()}")
+        if value is None:
+            continue
+        if field.type in (bool, "bool"):
+            setattr(config, name, value == "1")
+        elif "int" in str(field.type):
+            setattr(config, name, int(value))
+        else:
+            setattr(config, name, float(value))
+    return config
@@ -0,0 +1,398 @@
+from collections import OrderedDict
+import copy
+from dataclasses import dataclass
+import hashlib
+import threading
+from typing import TYPE_CHECKING, AbstractSet, Any, Callable
+
+from requests import Session
+
+from vcoclient import portal
+from vcoclient.codec import codec, decode_layer
+from vcoclient.portal import PortalCall, PortalResult
+
+if TYPE_CHECKING:
+    import msgspec
+
+    from vcoclient.aio import AsyncVcoClient
+else:
+    try:
+        import msgspec
+    except ImportError:
+        msgspec = None
+
+
+class ModuleList(list):
+    # a layer's modules with an index by name, built on the first lookup
+    # the index is rebuilt if modules are added or removed, modules themselves may be edited
+    __slots__ = ("_by_name", "_indexed")
+
+    def __init__(self, modules=()):
+        super().__init__(modules)
+        self._by_name: dict[str, dict] | None = None
+        self._indexed = 0
+
+    def find(self, name: str) -> dict | None:
+        if self._by_name is None or self._indexed != len(self):
+            by_name = {}
+            # the first module of a name wins, as with a linear scan
+            for module in self:
+                by_name.setdefault(module["name"], module)
+            self._by_name = by_name
+            self._indexed = len(self)
+        return self._by_name.get(name)
+
+
+def _read_only(self, *args, **kwargs):
+    raise TypeError(
+        f"{type(self).__name__} is part of a shared profile layer, copy it before changing it"
+    )
+
+
+class ReadOnlyDict(dict):
+    # dicts of a shared profile layer, they encode and compare as dicts but refuse changes
+    # copy.deepcopy returns plain, mutable dicts and lists
+    __slots__ = ()
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __copy__(self) -> dict:
+        return dict(self)
+
+    def __deepcopy__(self, memo: dict) -> dict:
+        return {key: copy.deepcopy(value, memo) for key, value in self.items()}
+
+    def __reduce__(self):
+        return ReadOnlyDict, (dict(self),)
+
+
+class _ReadOnlyListMixin(list):
+    __slots__ = ()
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _read_only
+    append = clear = extend = insert = pop = remove = reverse = sort = _read_only
+
+    def __copy__(self) -> list:
+        return list(self)
+
+    def __deepcopy__(self, memo: dict) -> list:
+        return [copy.deepcopy(value, memo) for value in self]
+
+    def __reduce__(self):
+        return type(self), (list(self),)
+
+
+class ReadOnlyList(_ReadOnlyListMixin, list):
+    __slots__ = ()
+
+
+class ReadOnlyModuleList(_ReadOnlyListMixin, ModuleList):
+    __slots__ = ()
+
+
+def read_only(value: Any) -> Any:
+    if isinstance(value, dict):
+        return ReadOnlyDict((key, read_only(item)) for key, item in value.items())
+    if isinstance(value, ModuleList):
+        return ReadOnlyModuleList(read_only(item) for item in value)
+    if isinstance(value, list):
+        return ReadOnlyList(read_only(item) for item in value)
+    return value
+
+
+def find_module(modules: list[dict], name: str) -> dict | None:
+    if isinstance(modules, ModuleList):
+        return modules.find(name)
+    return next((m for m in modules if m["name"] == name), None)
+
+
+def _indexed(layer: dict) -> dict:
+    if isinstance(layer, dict) and isinstance(layer.get("modules"), list):
+        layer["modules"] = ModuleList(layer["modules"])
+    return layer
+
+
+@dataclass
+class StackCacheStats:
+    layers: int
+    hits: int
+    misses: int
+    # profile layer bytes which were hashed but not decoded again
+    bytes_reused: int
+
+
+if msgspec is not None:
+    # layers are kept as the bytes the VCO sent until the cache has looked them up
+    class _RawStackResponse(msgspec.Struct):
+        id: int | str | None = None
+        result: list[msgspec.Raw] | None = None
+        error: dict | None = None
+
+    _single_raw_stack = msgspec.json.Decoder(_RawStackResponse)
+    _batch_raw_stacks = msgspec.json.Decoder(list[_RawStackResponse])
+
+
+class StackCache:
+    # getEdgeConfigurationStack returns the edge's own layer first, then its profile's layers, which
+    # are the same for every edge on the profile. Those layers are keyed by a hash of their content,
+    # decoded the first time they are seen and shared by every stack afterwards.
+    # Shared layers are read-only all the way down, changing one raises TypeError, copy.deepcopy
+    # gives a mutable copy.
+    def __init__(self, max_layers: int = 1024):
+        self.max_layers = max_layers
+        self.layers: OrderedDict[tuple[bytes, frozenset[str] | None], dict] = (
+            OrderedDict()
+        )
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_reused = 0
+
+    def _shared_layer(
+        self,
+        content: bytes | memoryview,
+        modules: frozenset[str] | None,
+        decode: Callable[[], dict],
+    ) -> dict:
+        key = (hashlib.blake2b(content, digest_size=16).digest(), modules)
+        with self.lock:
+            layer = self.layers.get(key)
+            if layer is not None:
+                self.layers.move_to_end(key)
+                self.hits += 1
+                self.bytes_reused += len(content)
+                return layer
+
+        # decoded outside the lock, two threads seeing a new profile at once keep the first copy
+        layer = read_only(_indexed(decode()))
+        with self.lock:
+            self.misses += 1
+            layer = self.layers.setdefault(key, layer)
+            self.layers.move_to_end(key)
+            while len(self.layers) > self.max_layers:
+                self.layers.popitem(last=False)
+        return layer
+
+    def _stack(self, layers: list, modules: frozenset[str] | None) -> list[dict]:
+        # the edge's own layer is unique to it, so it is decoded every time and never stored
+        if not layers:
+            return []
+        return [
+            _indexed(decode_layer(memoryview(layers[0]), modules)),
+            *(
+                self._shared_layer(
+                    raw, modules, lambda raw=raw: decode_layer(memoryview(raw), modules)
+                )
+                for raw in layers[1:]
+            ),
+        ]
+
+    def _response(
+        self, resp: "_RawStackResponse", modules: frozenset[str] | None
+    ) -> dict:
+        if resp.result is None:
+            return {"id": resp.id, "error": resp.error or {}}
+        return {"id": resp.id, "result": self._stack(resp.result, modules)}
+
+    def _intern(self, resp: Any, modules: frozenset[str] | None) -> Any:
+        # without msgspec the whole response has been decoded already, interning the profile
+        # layers still keeps a single copy of each in memory
+        if not isinstance(resp, dict) or not isinstance(resp.get("result"), list):
+            return resp
+        layers = resp["result"]
+        if modules is not None:
+            layers = [
+                {
+                    **l,
+                    "modules": [
+                        m for m in l.get("modules", []) if m.get("name") in modules
+                    ],
+                }
+                for l in layers
+            ]
+        if layers:
+            layers = [
+                _indexed(layers[0]),
+                *(
+                    self._shared_layer(codec().dumps(l), modules, lambda l=l: l)
+                    for l in layers[1:]
+                ),
+            ]
+        return {**resp, "result": layers}
+
+    def decoder(
+        self, modules: AbstractSet[str] | None = None
+    ) -> Callable[[bytes], Any]:
+        # decodes getEdgeConfigurationStack responses, single or batched,
+        # with modules set every layer only carries those modules
+        selected = frozenset(modules) if modules is not None else None
+
+        def decode(data: bytes) -> Any:
+            if msgspec is not None:
+                try:
+                    if data[:64].lstrip()[:1] == b"[":
+                        return [
+                            self._response(r, selected)
+                            for r in _batch_raw_stacks.decode(data)
+                        ]
+                    return self._response(_single_raw_stack.decode(data), selected)
+                except msgspec.DecodeError:
+                    # not shaped like a stack response, or not JSON at all, left to the full decoder
+                    pass
+            resp = codec().loads(data)
+            if isinstance(resp, list):
+                return [self._intern(r, selected) for r in resp]
+            return self._intern(resp, selected)
+
+        return decode
+
+    def stats(self) -> StackCacheStats:
+        with self.lock:
+            return StackCacheStats(
+                len(self.layers), self.hits, self.misses, self.bytes_reused
+            )
+
+    def summary(self) -> str:
+        stats = self.stats()
+        return (
+            f"stack cache: {stats.layers} profile layer(s) held, {stats.hits} reused, "
+            f"{stats.misses} decoded, {stats.bytes_reused / 1e6:.1f} MB not decoded again"
+        )
+
+    def clear(self):
+        with self.lock:
+            self.layers.clear()
+
+
+_stack_cache = StackCache()
+
+
+def stack_cache() -> StackCache:
+    return _stack_cache
+
+
+STACK_METHOD = "edge/getEdgeConfigurationStack"
+MODULES_METHOD = "edge/getEdgeConfigurationModules"
+
+# VCOs which do not know getEdgeConfigurationModules, these get whole stacks from then on
+_modules_unsupported: set[str] = set()
+
+
+def modules_supported(vco: str) -> bool:
+    return vco not in _modules_unsupported
+
+
+def mark_modules_unsupported(vco: str):
+    _modules_unsupported.add(vco)
+
+
+def method_not_found(error: dict | None) -> bool:
+    if not error:
+        return False
+    if error.get("code") == -32601:
+        return True
+    message = str(error.get("message", "")).lower()
+    return "method" in message and ("not found" in message or "unknown" in message)
+
+
+def _modules_stack(resp: Any) -> Any:
+    # getEdgeConfigurationModules maps module names to the edge's own modules, they are returned as
+    # a stack of just that layer so callers read both methods' results the same way
+    if not isinstance(resp, dict) or not isinstance(resp.get("result"), dict):
+        return resp
+    modules = ModuleList(
+        module if "name" in module else {**module, "name": name}
+        for name, module in resp["result"].items()
+        if isinstance(module, dict)
+    )
+    return {**resp, "result": [{"id": None, "name": None, "modules": modules}]}
+
+
+def modules_decoder() -> Callable[[bytes], Any]:
+    def decode(data: bytes) -> Any:
+        resp = codec().loads(data)
+        if isinstance(resp, list):
+            return [_modules_stack(r) for r in resp]
+        return _modules_stack(resp)
+
+    return decode
+
+
+def _edge_params(edge_id: int, params: Callable[[dict], dict] | None) -> dict:
+    return params({"edgeId": edge_id}) if params is not None else {"edgeId": edge_id}
+
+
+def _module_calls(
+    edge_ids: list[int], modules: set[str], params: Callable[[dict], dict] | None
+) -> list[PortalCall]:
+    return [
+        PortalCall(
+            MODULES_METHOD,
+            {**_edge_params(edge_id, params), "modules": sorted(modules)},
+        )
+        for edge_id in edge_ids
+    ]
+
+
+def _stack_calls(
+    edge_ids: list[int], params: Callable[[dict], dict] | None
+) -> list[PortalCall]:
+    return [
+        PortalCall(STACK_METHOD, _edge_params(edge_id, params)) for edge_id in edge_ids
+    ]
+
+
+def _unsupported(vco: str, results: list[PortalResult]) -> bool:
+    if any(not r.ok and method_not_found(r.error) for r in results):
+        mark_modules_unsupported(vco)
+        return True
+    return False
+
+
+def get_edge_modules(
+    s: Session,
+    vco: str,
+    edge_ids: list[int],
+    modules: set[str],
+    params: Callable[[dict], dict] | None = None,
+    chunk_size: int = 50,
+) -> dict[int, PortalResult]:
+    # only the named modules of each edge's own layer, results are stacks whose first layer is the
+    # edge's. VCOs without getEdgeConfigurationModules get whole stacks, decoded through the stack
+    # cache with only the named modules kept. params can add fields such as enterpriseId to each call
+    if modules_supported(vco):
+        results = portal.call_batch(
+            s,
+            vco,
+            _module_calls(edge_ids, modules, params),
+            chunk_size,
+            modules_decoder(),
+        )
+        if not _unsupported(vco, results):
+            return dict(zip(edge_ids, results))
+    results = portal.call_batch(
+        s,
+        vco,
+        _stack_calls(edge_ids, params),
+        chunk_size,
+        stack_cache().decoder(modules),
+    )
+    return dict(zip(edge_ids, results))
+
+
+async def get_edge_modules_async(
+    c: "AsyncVcoClient",
+    edge_ids: list[int],
+    modules: set[str],
+    params: Callable[[dict], dict] | None = None,
+    chunk_size: int = 50,
+) -> dict[int, PortalResult]:
+    if modules_supported(c.vco):
+        results = await c.do_portal_batch(
+            _module_calls(edge_ids, modules, params), chunk_size, modules_decoder()
+        )
+        if not _unsupported(c.vco, results):
+            return dict(zip(edge_ids, results))
+    results = await c.do_portal_batch(
+        _stack_calls(edge_ids, params), chunk_size, stack_cache().decoder(modules)
+    )
+    return dict(zip(edge_ids, results))
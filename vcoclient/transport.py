@@ -0,0 +1,44 @@
+import threading
+from typing import TYPE_CHECKING
+
+from requests import Session
+from requests.adapters import BaseAdapter
+
+if TYPE_CHECKING:
+    import httpx
+
+# transports registered for a VCO replace the network for every session and client created for it,
+# which lets the same tool code run against a real VCO or a local simulator
+_adapters: dict[str, BaseAdapter] = {}
+_async_transports: dict[str, "httpx.AsyncBaseTransport"] = {}
+_transports_lock = threading.Lock()
+
+
+def set_transport(
+    vco: str,
+    adapter: BaseAdapter,
+    async_transport: "httpx.AsyncBaseTransport | None" = None,
+):
+    with _transports_lock:
+        _adapters[vco] = adapter
+        if async_transport is not None:
+            _async_transports[vco] = async_transport
+
+
+def clear_transport(vco: str):
+    with _transports_lock:
+        _adapters.pop(vco, None)
+        _async_transports.pop(vco, None)
+
+
+def mount_transport(s: Session, vco: str) -> Session:
+    with _transports_lock:
+        adapter = _adapters.get(vco)
+    if adapter is not None:
+        s.mount(f"https://{vco}/", adapter)
+    return s
+
+
+def async_transport_for(vco: str) -> "httpx.AsyncBaseTransport | None":
+    with _transports_lock:
+        return _async_transports.get(vco)